@@ -0,0 +1,102 @@
+import hashlib
+import os
+import re
+import time
+from typing import Iterator, Optional
+
+import numpy as np
+
+import observability
+
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "900"))
+# Cosine similarity between query embeddings required to replay a cached answer.
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+# Comma-separated topics (offer_context.detect_topic labels) that always go to the LLM.
+ANSWER_CACHE_SKIP_TOPICS = {t.strip() for t in os.getenv("ANSWER_CACHE_SKIP_TOPICS", "").split(",") if t.strip()}
+
+
+def context_key(*parts: Optional[str]) -> str:
+    """Hash of everything besides the question that shapes an answer (KB version, context, offer status)."""
+    h = hashlib.sha256()
+    for p in parts:
+        h.update((p or "").encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def replay(answer: str) -> Iterator[str]:
+    """Split a cached answer into word-sized chunks so it streams like a live generation."""
+    for piece in re.findall(r"\S+\s*|\s+", answer or ""):
+        yield piece
+
+
+class SemanticAnswerCache:
+    """Recent LLM answers indexed by query embedding.
+
+    A lookup hits when a stored question is at least `threshold` cosine-similar
+    to the new one *and* was answered from the same context key. Storage is a
+    fixed-size ring of embeddings, so the oldest entry is overwritten when full.
+    """
+
+    name = "llm_answer"
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES, ttl_seconds: float = ANSWER_CACHE_TTL, threshold: float = ANSWER_CACHE_THRESHOLD, skip_topics=ANSWER_CACHE_SKIP_TOPICS):
+        self.max_entries = max(0, max_entries)
+        self.ttl = ttl_seconds
+        self.threshold = threshold
+        self.skip_topics = set(skip_topics or ())
+        self._emb: Optional[np.ndarray] = None
+        self._expires = np.zeros(self.max_entries, dtype=np.float64)
+        self._keys = [""] * self.max_entries
+        self._answers = [""] * self.max_entries
+        self._next = 0
+
+    def enabled_for(self, topic: str) -> bool:
+        return self.max_entries > 0 and topic not in self.skip_topics
+
+    def lookup(self, embedding, key: str, topic: str = "") -> Optional[str]:
+        if embedding is None or not self.enabled_for(topic):
+            return None
+        if self._emb is None:
+            observability.CACHE_MISSES.labels(self.name).inc()
+            return None
+        q = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        q = q / (np.linalg.norm(q) or 1.0)
+        sims = self._emb @ q
+        live = self._expires > time.monotonic()
+        sims[~live] = -1.0
+        for i in np.argsort(-sims)[:8]:
+            if sims[i] < self.threshold:
+                break
+            if self._keys[i] == key:
+                observability.CACHE_HITS.labels(self.name).inc()
+                return self._answers[i]
+        observability.CACHE_MISSES.labels(self.name).inc()
+        return None
+
+    def store(self, embedding, key: str, answer: str, topic: str = ""):
+        if embedding is None or not answer or not self.enabled_for(topic):
+            return
+        q = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        q = q / (np.linalg.norm(q) or 1.0)
+        if self._emb is None or self._emb.shape[1] != q.shape[0]:
+            self._emb = np.zeros((self.max_entries, q.shape[0]), dtype=np.float32)
+            self._expires[:] = 0
+        slot = self._next
+        now = time.monotonic()
+        if self._expires[slot] > now:
+            observability.CACHE_EVICTIONS.labels(self.name, "capacity").inc()
+        self._emb[slot] = q
+        self._expires[slot] = now + self.ttl
+        self._keys[slot] = key
+        self._answers[slot] = answer
+        self._next = (slot + 1) % self.max_entries
+        observability.CACHE_BYTES.labels(self.name).set(self._emb.nbytes + sum(len(a) for a in self._answers))
+
+    def clear(self):
+        self._expires[:] = 0
+        self._next = 0
+
+
+answer_cache = SemanticAnswerCache()
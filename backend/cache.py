@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+import numpy as np
+
+import observability
+
+
+def approx_size(value: Any) -> int:
+    """Rough byte footprint of a cached value (payload bytes, not exact interpreter overhead)."""
+    if value is None:
+        return 16
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes) + 112
+    if isinstance(value, (bytes, str)):
+        return len(value) + 49
+    if isinstance(value, dict):
+        return 64 + sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return 56 + sum(approx_size(v) for v in value)
+    return 64
+
+
+class LRUCache:
+    """Thread-safe LRU mapping with per-entry TTL and an approximate memory budget.
+
+    Entries are tied to a version string (e.g. the KB snapshot); binding a new
+    version drops everything cached under the old one.
+    """
+
+    def __init__(self, name: str, max_bytes: int, ttl_seconds: float):
+        self.name = name
+        self.max_bytes = max(0, int(max_bytes))
+        self.ttl = float(ttl_seconds)
+        self.version = ""
+        self.bytes = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def bind_version(self, version: str):
+        if version == self.version:
+            return
+        with self._lock:
+            if version != self.version:
+                self._drop_all("invalidate")
+                self.version = version
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._pop(key, "ttl")
+                entry = None
+            if entry is None:
+                observability.CACHE_MISSES.labels(self.name).inc()
+                return None
+            self._data.move_to_end(key)
+        observability.CACHE_HITS.labels(self.name).inc()
+        return entry[2]
+
+    def put(self, key: Hashable, value: Any, size: Optional[int] = None):
+        if not self.enabled:
+            return
+        size = approx_size(key) + (approx_size(value) if size is None else size)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._pop(key, None)
+            self._data[key] = (time.monotonic() + self.ttl, size, value)
+            self.bytes += size
+            while self.bytes > self.max_bytes and self._data:
+                self._pop(next(iter(self._data)), "lru")
+            observability.CACHE_BYTES.labels(self.name).set(self.bytes)
+
+    def clear(self):
+        with self._lock:
+            self._drop_all("invalidate")
+
+    def __len__(self):
+        return len(self._data)
+
+    def _pop(self, key: Hashable, reason: Optional[str]):
+        _, size, _ = self._data.pop(key)
+        self.bytes -= size
+        if reason:
+            observability.CACHE_EVICTIONS.labels(self.name, reason).inc()
+
+    def _drop_all(self, reason: str):
+        if self._data:
+            observability.CACHE_EVICTIONS.labels(self.name, reason).inc(len(self._data))
+        self._data.clear()
+        self.bytes = 0
+        observability.CACHE_BYTES.labels(self.name).set(0)
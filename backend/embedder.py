@@ -0,0 +1,103 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+
+import observability
+
+# How long the worker waits for more queries after the first one arrives, and the batch cap.
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "3"))
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "32"))
+
+
+def _resolve(fut: asyncio.Future, value, error: Optional[BaseException]):
+    if fut.done():
+        return
+    if error is not None:
+        fut.set_exception(error)
+    else:
+        fut.set_result(value)
+
+
+class BatchingEmbedder:
+    """Encodes query strings off the event loop, micro-batching concurrent callers.
+
+    Callers await encode(text); a single worker thread drains the queue, waits up to
+    window_ms (or until max_batch items) for company, runs one batched encode and
+    resolves every caller's future on its own loop.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], window_ms: float = EMBED_BATCH_WINDOW_MS, max_batch: int = EMBED_BATCH_MAX):
+        self.encode_fn = encode_fn
+        self.window_s = max(0.0, window_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="embedder", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                self._queue.put(None)
+                self._thread.join(timeout=5)
+            self._thread = None
+
+    async def encode(self, text: str) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self.start()
+        self._queue.put((text, fut, loop, time.perf_counter()))
+        return await fut
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        deadline = time.perf_counter() + self.window_s
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [b for b in self._collect(first) if not b[1].cancelled()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            for _, _, _, enqueued in batch:
+                observability.EMBED_QUEUE_WAIT.observe(started - enqueued)
+            # Identical strings in one window are encoded once.
+            texts = list(dict.fromkeys(b[0] for b in batch))
+            vectors, error = None, None
+            try:
+                vectors = dict(zip(texts, np.asarray(self.encode_fn(texts))))
+            except Exception as e:
+                error = e
+            observability.EMBED_ENCODE_SECONDS.observe(time.perf_counter() - started)
+            observability.EMBED_BATCH_SIZE.observe(len(texts))
+            for text, fut, loop, _ in batch:
+                value = vectors.get(text) if vectors is not None else None
+                try:
+                    loop.call_soon_threadsafe(_resolve, fut, value, error)
+                except RuntimeError:
+                    # The caller's loop is already closed; nobody is waiting.
+                    pass
@@ -0,0 +1,209 @@
+"""Sentence-embedding backends behind one encode() interface.
+
+EMBED_BACKEND picks how rag.model turns text into vectors:
+
+  torch      sentence-transformers on PyTorch (the reference)
+  onnx       the same transformer exported to ONNX, run by ONNX Runtime
+  onnx-int8  the ONNX export with dynamically quantized int8 weights
+
+The ONNX backends need neither torch nor sentence-transformers at serve time;
+they read the exported graph and tokenizer.json from EMBED_ONNX_DIR. When the
+export is missing it is produced once by running this module in a child
+process (the export itself needs torch), or ahead of time with:
+
+    python backend/encoders.py --model all-MiniLM-L6-v2 --out data/models/all-MiniLM-L6-v2
+
+Each backend has a model_id that differs between backends, so KB snapshots and
+topic centroids built with one are rebuilt rather than mixed with another.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import List, Optional, Union
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch").strip().lower()
+EMBED_ONNX_DIR = os.getenv("EMBED_ONNX_DIR", os.path.join(BASE_DIR, "../data/models"))
+# ONNX Runtime intra-op threads; 0 lets the runtime pick (one per physical core).
+EMBED_ONNX_THREADS = int(os.getenv("EMBED_ONNX_THREADS", "0"))
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+CONFIG_NAME = "encoder.json"
+FP32_NAME = "model.onnx"
+INT8_NAME = "model-int8.onnx"
+
+
+class TorchEncoder:
+    """sentence-transformers model on PyTorch."""
+
+    backend = "torch"
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model_id = model_name
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts: Union[str, List[str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        kwargs.setdefault("show_progress_bar", False)
+        return self.model.encode(texts, batch_size=batch_size, **kwargs)
+
+    def after_fork(self) -> None:
+        """Nothing to redo: the weights stay shared copy-on-write with the parent."""
+
+
+class OnnxEncoder:
+    """Exported transformer on ONNX Runtime, with the sentence-transformers pooling redone in numpy."""
+
+    def __init__(self, model_dir: str, quantized: bool = False, threads: int = EMBED_ONNX_THREADS):
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, CONFIG_NAME)) as f:
+            self.config = json.load(f)
+        self.backend = "onnx-int8" if quantized else "onnx"
+        self.model_id = f"{self.config['model']}+{self.backend}"
+        self.normalize = bool(self.config.get("normalize", True))
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(int(self.config["max_seq_length"]))
+        self.tokenizer.enable_padding(pad_id=int(self.config["pad_token_id"]), pad_token=self.config["pad_token"])
+
+        self.path = os.path.join(model_dir, INT8_NAME if quantized else FP32_NAME)
+        self.threads = threads
+        self._open()
+
+    def _open(self) -> None:
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads > 0:
+            opts.intra_op_num_threads = self.threads
+        self.session = ort.InferenceSession(self.path, opts, providers=["CPUExecutionProvider"])
+        self._inputs = [i.name for i in self.session.get_inputs()]
+
+    def after_fork(self) -> None:
+        """Reopen the session in a forked worker; the parent's intra-op thread pool did not survive the fork."""
+        self._open()
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encs = self.tokenizer.encode_batch(texts)
+        ids = np.asarray([e.ids for e in encs], dtype=np.int64)
+        mask = np.asarray([e.attention_mask for e in encs], dtype=np.int64)
+        feeds = {"input_ids": ids, "attention_mask": mask, "token_type_ids": np.zeros_like(ids)}
+        hidden = self.session.run(None, {name: feeds[name] for name in self._inputs})[0]
+        # Mean over real tokens, as the sentence-transformers Pooling layer does.
+        m = mask[:, :, None].astype(np.float32)
+        pooled = (hidden * m).sum(axis=1) / np.maximum(m.sum(axis=1), 1e-9)
+        if self.normalize:
+            pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled.astype(np.float32)
+
+    def encode(self, texts: Union[str, List[str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        if not texts:
+            return np.zeros((0, int(self.config.get("dim", 0))), dtype=np.float32)
+        # Length-sorted batches pad less; results go back in input order.
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out = np.empty((len(texts), int(self.config["dim"])), dtype=np.float32)
+        for start in range(0, len(order), max(1, batch_size)):
+            rows = order[start:start + batch_size]
+            out[rows] = self._encode_batch([texts[i] for i in rows])
+        return out[0] if single else out
+
+
+def export_onnx(model_name: str, out_dir: str, quantize: bool = True) -> None:
+    """Export model_name to out_dir as model.onnx (+ model-int8.onnx), tokenizer.json and encoder.json."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    st = SentenceTransformer(model_name, device="cpu")
+    transformer = st[0].auto_model.eval()
+    tokenizer = st.tokenizer
+    pooling = st[1]
+    if getattr(pooling, "pooling_mode_mean_tokens", True) is not True:
+        raise ValueError(f"{model_name}: only mean pooling is supported by the ONNX backend")
+
+    class _Hidden(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)[0]
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer.save_pretrained(out_dir)
+    sample = tokenizer(["export sample", "a slightly longer export sample"], padding=True, return_tensors="pt")
+    if "token_type_ids" not in sample:
+        sample["token_type_ids"] = torch.zeros_like(sample["input_ids"])
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    axes = {n: {0: "batch", 1: "seq"} for n in names}
+    axes["last_hidden_state"] = {0: "batch", 1: "seq"}
+    fp32 = os.path.join(out_dir, FP32_NAME)
+    with torch.no_grad():
+        torch.onnx.export(
+            _Hidden(transformer),
+            tuple(sample[n] for n in names),
+            fp32,
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=axes,
+            opset_version=17,
+            dynamo=False,
+        )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(fp32, os.path.join(out_dir, INT8_NAME), weight_type=QuantType.QInt8)
+    config = {
+        "model": model_name,
+        "dim": int(st.encode(["dim probe"]).shape[1]),
+        "max_seq_length": int(st.max_seq_length),
+        "normalize": any(type(m).__name__ == "Normalize" for m in st),
+        "pad_token": tokenizer.pad_token,
+        "pad_token_id": int(tokenizer.pad_token_id),
+    }
+    with open(os.path.join(out_dir, CONFIG_NAME), "w") as f:
+        json.dump(config, f, indent=2)
+    print(f"Exported {model_name} to {out_dir}" + (" (fp32 + int8)" if quantize else ""))
+
+
+def onnx_dir(model_name: str) -> str:
+    return os.path.join(EMBED_ONNX_DIR, model_name.replace("/", "__"))
+
+
+def _ensure_export(model_name: str, model_dir: str, quantized: bool) -> None:
+    graph = os.path.join(model_dir, INT8_NAME if quantized else FP32_NAME)
+    if os.path.exists(graph) and os.path.exists(os.path.join(model_dir, CONFIG_NAME)):
+        return
+    # Export in a child so this process never imports torch.
+    print(f"ONNX export of {model_name} not found in {model_dir}; exporting")
+    cmd = [sys.executable, os.path.abspath(__file__), "--model", model_name, "--out", model_dir]
+    subprocess.run(cmd, check=True)
+
+
+def make_encoder(model_name: str, backend: Optional[str] = None):
+    backend = (backend or EMBED_BACKEND).strip().lower()
+    if backend == "torch":
+        return TorchEncoder(model_name)
+    if backend in ("onnx", "onnx-int8"):
+        model_dir = onnx_dir(model_name)
+        quantized = backend == "onnx-int8"
+        _ensure_export(model_name, model_dir, quantized)
+        return OnnxEncoder(model_dir, quantized=quantized)
+    raise ValueError(f"Unknown EMBED_BACKEND {backend!r}; expected one of {', '.join(BACKENDS)}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Export a sentence-transformers model for the ONNX backends")
+    ap.add_argument("--model", default="all-MiniLM-L6-v2")
+    ap.add_argument("--out", default="", help="defaults to EMBED_ONNX_DIR/<model>")
+    ap.add_argument("--no-int8", action="store_true", help="skip the quantized variant")
+    args = ap.parse_args()
+    export_onnx(args.model, args.out or onnx_dir(args.model), quantize=not args.no_int8)
@@ -1,13 +1,241 @@
+import os
 import re
-from typing import List, Set
-from datetime import datetime, timedelta
+import time
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
 import asyncio
-from collections import defaultdict
+from collections import defaultdict, deque
+
+import observability
+import ratelimit_store
+from message import NormalizedMessage, normalize
+
+# -------------------------------------------------------------------------
+# Compiled Rule Matching
+# -------------------------------------------------------------------------
+
+_LB = "\x01"  # marks a leading \b in an expanded keyword
+_RB = "\x02"  # marks a trailing \b
+
+
+# Characters re.IGNORECASE folds onto ASCII letters that str.lower() leaves alone.
+_FOLD = str.maketrans({"\u0131": "i", "\u017f": "s"})
+
+
+def _is_word(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+def _fold(text: str) -> str:
+    """Lowercase with re.IGNORECASE's per-character semantics (never changes the length)."""
+    t = text.lower()
+    if text.isascii():
+        return t
+    if len(t) != len(text):
+        t = "".join(c.lower()[0] for c in text)
+    return t.translate(_FOLD)
+
+
+def _product(left: List[str], right: List[str]) -> List[str]:
+    return [a + b for a in left for b in right]
+
+
+def _expand_alternation(p: str, i: int) -> Tuple[Optional[List[str]], int]:
+    """Expand `a|b(c)?|d\\s*e` starting at p[i] into literal variants; None if unsupported."""
+    variants: List[str] = []
+    seq = [""]
+    while i < len(p):
+        ch = p[i]
+        if ch == ")":
+            break
+        if ch == "|":
+            variants.extend(seq)
+            seq = [""]
+            i += 1
+            continue
+        if ch == "(":
+            if p.startswith("(?:", i):
+                i += 3
+            elif p.startswith("(?", i):
+                return None, i
+            else:
+                i += 1
+            inner, i = _expand_alternation(p, i)
+            if inner is None or i >= len(p) or p[i] != ")":
+                return None, i
+            i += 1
+            if i < len(p) and p[i] == "?":
+                inner = inner + [""]
+                i += 1
+            seq = _product(seq, inner)
+            continue
+        if ch == "\\" and i + 1 < len(p):
+            nxt = p[i + 1]
+            i += 2
+            if nxt == "b":
+                seq = _product(seq, [_LB if all(v == "" for v in seq) else _RB])
+            elif nxt == "s":
+                quant = p[i] if i < len(p) else ""
+                if quant == "*":
+                    seq = _product(seq, ["", " "])
+                    i += 1
+                elif quant == "+":
+                    seq = _product(seq, [" "])
+                    i += 1
+                else:
+                    seq = _product(seq, [" "])
+            elif not nxt.isalnum():
+                seq = _product(seq, [nxt.lower()])
+            else:
+                return None, i
+            continue
+        if ch in ".[]{}*+?^$ " or ch.isspace():
+            return None, i
+        seq = _product(seq, [ch.lower()])
+        i += 1
+    variants.extend(seq)
+    return variants, i
+
+
+def expand_keywords(pattern: str) -> Optional[List[Tuple[str, bool, bool]]]:
+    """Turn a case-insensitive keyword regex into (literal, left \\b, right \\b) entries.
+
+    Only the small dialect the rule lists use is understood (alternation, groups,
+    optional groups, \\s*, \\s+, \\b at keyword edges, escaped punctuation); anything
+    else returns None and the pattern stays a regex.
+    """
+    if not pattern.startswith("(?i)"):
+        return None
+    variants, i = _expand_alternation(pattern[4:], 0)
+    if variants is None or i != len(pattern) - 4:
+        return None
+    out = []
+    for v in variants:
+        lb = v.startswith(_LB)
+        rb = v.endswith(_RB)
+        lit = v[1 if lb else 0:len(v) - 1 if rb else len(v)]
+        if not lit or _LB in lit or _RB in lit:
+            return None
+        out.append((lit, lb, rb))
+    return out
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton over literal keywords; each keyword carries a payload.
+
+    Subclasses walk `_goto`/`_fail`/`_out` inline in their own scan loop, since
+    the per-character work is the hot path.
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[list] = [[]]
+
+    def _add(self, literal: str, entry):
+        state = 0
+        for ch in literal:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append(entry)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+
+class RuleMatcher(KeywordAutomaton):
+    """Matches several named rule categories in a single pass over the text.
+
+    Keyword-style patterns are compiled into one Aho-Corasick automaton over
+    lowercased, whitespace-collapsed text, with regex \\b semantics checked at
+    each hit; patterns outside that dialect fall back to one combined regex per
+    category.
+    """
+
+    def __init__(self, categories: Dict[str, Iterable[str]]):
+        super().__init__()
+        self.categories = tuple(categories)
+        fallback: Dict[str, List[str]] = defaultdict(list)
+        literal: Set[str] = set()
+        for category, patterns in categories.items():
+            for pattern in patterns:
+                entries = expand_keywords(pattern)
+                if entries is None:
+                    fallback[category].append(pattern)
+                    continue
+                literal.add(category)
+                for lit, lb, rb in entries:
+                    self._add(lit, (len(lit), category, lb, rb))
+        self._build()
+        # The walk can stop once every category with keywords has hit; a category may have both.
+        self._wanted = len(literal)
+        self._fallback = {
+            c: re.compile("|".join(f"(?:{p[4:] if p.startswith('(?i)') else p})" for p in ps), re.IGNORECASE)
+            for c, ps in fallback.items()
+        }
+        self._last: Tuple[Optional[str], FrozenSet[str]] = (None, frozenset())
+
+    def scan(self, text) -> FrozenSet[str]:
+        """Return the set of categories with at least one matching rule."""
+        if isinstance(text, NormalizedMessage):
+            return text.memo(self, lambda: self.scan(text.raw))
+        last_text, last_hits = self._last
+        if text is last_text:
+            return last_hits
+        t = " ".join(_fold(text or "").split())
+        n = len(t)
+        goto, fail, out = self._goto, self._fail, self._out
+        hits: Set[str] = set()
+        wanted = self._wanted
+        state = 0
+        for i, ch in enumerate(t):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if not out[state]:
+                continue
+            for length, category, lb, rb in out[state]:
+                if category in hits:
+                    continue
+                if lb:
+                    start = i - length + 1
+                    if (start > 0 and _is_word(t[start - 1])) == _is_word(t[start]):
+                        continue
+                if rb:
+                    if (i + 1 < n and _is_word(t[i + 1])) == _is_word(t[i]):
+                        continue
+                hits.add(category)
+            if len(hits) >= wanted:
+                break
+        for category, rx in self._fallback.items():
+            if category not in hits and rx.search(text or ""):
+                hits.add(category)
+        result = frozenset(hits)
+        self._last = (text, result)
+        return result
 
 # -------------------------------------------------------------------------
 # Content Filtering Guard Rails
 # -------------------------------------------------------------------------
 
+# What a reply with blocked content is replaced by when there is nothing better to say.
+BLOCKED_REPLY = "I'm sorry, I cannot provide information on that topic. Please contact support for assistance."
+
 class ContentFilter:
     def __init__(self):
         self.blocked_patterns = [
@@ -23,25 +251,20 @@ class ContentFilter:
             r'(?i)(?:financial|money|payment|transaction)',
             r'(?i)(?:security\s*breach|data\s*leak)',
         ]
+        self.matcher = RuleMatcher({"blocked": self.blocked_patterns, "warning": self.warning_patterns})
     
     def contains_blocked_content(self, text: str) -> bool:
         """Check if text contains blocked patterns"""
-        for pattern in self.blocked_patterns:
-            if re.search(pattern, text):
-                return True
-        return False
+        return "blocked" in self.matcher.scan(text)
     
     def contains_warning_content(self, text: str) -> bool:
         """Check if text contains warning patterns"""
-        for pattern in self.warning_patterns:
-            if re.search(pattern, text):
-                return True
-        return False
+        return "warning" in self.matcher.scan(text)
     
     def filter_response(self, response: str) -> str:
         """Filter LLM responses for sensitive content"""
         if self.contains_blocked_content(response):
-            return "I'm sorry, I cannot provide information on that topic. Please contact support for assistance."
+            return BLOCKED_REPLY
         
         if self.contains_warning_content(response):
             return response + "\n\nNote: For security reasons, please avoid sharing sensitive personal information in this chat."
@@ -52,31 +275,100 @@ class ContentFilter:
 # Rate Limiting Guard Rails
 # -------------------------------------------------------------------------
 
+def _parse_limit(spec: str, default: Tuple[int, int]) -> Tuple[int, int]:
+    """Parse "15/60" (requests/seconds); fall back to the default on anything malformed."""
+    try:
+        count, window = (spec or "").split("/", 1)
+        return max(1, int(count)), max(1, int(window))
+    except (TypeError, ValueError):
+        return default
+
+
 class RateLimiter:
-    def __init__(self, max_requests: int = 10, time_window: int = 60):
+    """Per-key GCRA (token bucket) limiter; all state for a key is one float.
+
+    For each key we store its theoretical arrival time (TAT). A request is allowed
+    while TAT - now stays within the burst tolerance, and each allowed request pushes
+    TAT forward by window / max_requests. Keys live in hash shards that a background
+    sweep walks one at a time, dropping keys whose TAT is in the past (fully idle).
+    The check never awaits, so it is atomic on the event loop and needs no lock.
+
+    Each channel has its own bucket per identifier, and every identifier also has
+    one `client_limit` bucket shared by all channels, so spreading requests over
+    the channels does not multiply the budget. A request is limited if either
+    bucket is exhausted.
+
+    With a shared `store` (see ratelimit_store) the budget is enforced across workers
+    and nodes; the local shards then only answer while the store is unreachable.
+    """
+
+    def __init__(self, max_requests: int = 10, time_window: int = 60, shards: int = 64, channel_limits: Optional[Dict[str, Tuple[int, int]]] = None, store=None, client_limit: Optional[Tuple[int, int]] = None):
         self.max_requests = max_requests
+        self.store = store
         self.time_window = time_window  # seconds
-        self.requests = defaultdict(list)
-        self.lock = asyncio.Lock()
-    
-    async def is_rate_limited(self, identifier: str) -> bool:
-        """Check if user has exceeded rate limit"""
-        async with self.lock:
-            now = datetime.now()
-            
-            # Clean up old requests
-            self.requests[identifier] = [
-                req_time for req_time in self.requests[identifier]
-                if now - req_time < timedelta(seconds=self.time_window)
-            ]
-            
-            # Check if limit exceeded
-            if len(self.requests[identifier]) >= self.max_requests:
+        self.channel_limits: Dict[str, Tuple[int, int]] = dict(channel_limits or {})
+        self.client_limit = client_limit or (max_requests, time_window)
+        self._shards: List[Dict[str, float]] = [{} for _ in range(max(1, shards))]
+        self._sweep_next = 0
+
+    def _limit(self, channel: str) -> Tuple[int, int]:
+        return self.channel_limits.get(channel, (self.max_requests, self.time_window))
+
+    def _buckets(self, identifier: str, channel: str) -> List[Tuple[str, int, int]]:
+        """(key, max_requests, window) for the client-wide bucket and, with a channel, its own."""
+        buckets = [(f"*|{identifier}", *self.client_limit)]
+        if channel:
+            buckets.append((f"{channel}|{identifier}", *self._limit(channel)))
+        return buckets
+
+    def check(self, identifier: str, channel: str = "", now: Optional[float] = None) -> bool:
+        """Record a request and return True if it exceeds the limit."""
+        now = time.monotonic() if now is None else now
+        updates = []
+        for key, max_requests, window in self._buckets(identifier, channel):
+            interval = window / max_requests
+            shard = self._shards[hash(key) % len(self._shards)]
+            tat = max(shard.get(key, now), now)
+            if tat - now > window - interval:
                 return True
-            
-            # Record new request
-            self.requests[identifier].append(now)
-            return False
+            updates.append((shard, key, tat + interval))
+        # Only an allowed request is charged, and to every bucket.
+        for shard, key, tat in updates:
+            shard[key] = tat
+        return False
+
+    async def is_rate_limited(self, identifier: str, channel: str = "") -> bool:
+        """Check if user has exceeded rate limit"""
+        if self.store is not None:
+            try:
+                limited = await self.store.check_many(self._buckets(identifier, channel))
+                return any(limited)
+            except ratelimit_store.StoreUnavailable:
+                observability.RATE_LIMIT_STORE_FALLBACK.labels(self.store.name).inc()
+        return self.check(identifier, channel)
+
+    def __len__(self):
+        return sum(len(s) for s in self._shards)
+
+    def sweep(self, shards: Optional[int] = None, now: Optional[float] = None) -> int:
+        """Drop idle keys from the next `shards` shards (all by default); returns how many went."""
+        now = time.monotonic() if now is None else now
+        count = len(self._shards) if shards is None else min(shards, len(self._shards))
+        removed = 0
+        for _ in range(count):
+            shard = self._shards[self._sweep_next]
+            self._sweep_next = (self._sweep_next + 1) % len(self._shards)
+            idle = [k for k, tat in shard.items() if tat <= now]
+            for k in idle:
+                del shard[k]
+            removed += len(idle)
+        return removed
+
+    async def sweep_forever(self, interval: float = 1.0):
+        """Background task: sweep one shard per tick so every key is visited once per len(shards) ticks."""
+        while True:
+            await asyncio.sleep(interval)
+            self.sweep(shards=1)
 
 # -------------------------------------------------------------------------
 # Input Validation Guard Rails
@@ -87,9 +379,10 @@ class InputValidator:
         self.max_length = 1000  # characters
         self.min_length = 2     # characters
     
-    def validate_input(self, text: str) -> dict:
+    def validate_input(self, text) -> dict:
         """Validate user input and return validation result"""
-        if not text or text.strip() == "":
+        text = normalize(text)
+        if not text.stripped:
             return {"valid": False, "message": "Please provide a message."}
         
         if len(text) < self.min_length:
@@ -113,10 +406,10 @@ class InputValidator:
         
         return {"valid": True, "message": ""}
     
-    def _has_excessive_repetition(self, text: str) -> bool:
+    def _has_excessive_repetition(self, text: NormalizedMessage) -> bool:
         """Check for excessive character or word repetition"""
         # Simple repetition check
-        words = text.split()
+        words = text.words
         if len(words) > 10:
             # Check if any word repeats too many times
             word_counts = {}
@@ -127,12 +420,11 @@ class InputValidator:
         
         return False
 
-    def _looks_like_gibberish(self, text: str) -> bool:
-        s = (text or "").strip().lower()
+    def _looks_like_gibberish(self, text: NormalizedMessage) -> bool:
+        s = text.lower.strip()
         if len(s) < 8:
             return False
-        tokens = s.split()
-        if len(tokens) > 2:
+        if len(text.words) > 2:
             return False
         cleaned = re.sub(r"[^a-z]", "", s)
         if len(cleaned) < 8:
@@ -171,30 +463,48 @@ class DomainGuard:
             r'(?i)\blegal|lawyer|court|lawsuit\b',
             r'(?i)\brelationship|dating|personal\s+advice\b',
         ]
+        self.matcher = RuleMatcher({"in_domain": self.offer_terms, "out_of_scope": self.out_of_scope_patterns})
     
     def is_out_of_scope(self, text: str) -> bool:
-        for term in self.offer_terms:
-            if re.search(term, text):
-                return False
-        for pattern in self.out_of_scope_patterns:
-            if re.search(pattern, text):
-                return True
-        return False
+        hits = self.matcher.scan(text)
+        return "in_domain" not in hits and "out_of_scope" in hits
 
     def response_off_topic(self, text: str) -> bool:
-        for term in self.offer_terms:
-            if re.search(term, text):
-                return False
-        for pattern in self.out_of_scope_patterns:
-            if re.search(pattern, text):
-                return True
-        return False
+        return self.is_out_of_scope(text)
 
 # -------------------------------------------------------------------------
 # Global Instances
 # -------------------------------------------------------------------------
 
 content_filter = ContentFilter()
-rate_limiter = RateLimiter(max_requests=15, time_window=60)  # 15 requests per minute
+# 15 requests per minute by default; RATE_LIMIT_<CHANNEL>="count/seconds" overrides one channel,
+# and RATE_LIMIT_CLIENT caps one client across all channels together.
+rate_limiter = RateLimiter(
+    max_requests=15,
+    time_window=60,
+    client_limit=_parse_limit(os.getenv("RATE_LIMIT_CLIENT", ""), (15, 60)),
+    channel_limits={
+        ch: _parse_limit(os.getenv(f"RATE_LIMIT_{ch.upper()}", ""), (15, 60))
+        for ch in ("ws", "http", "chat_sync", "chat_stream")
+    },
+    # RATE_LIMIT_STORE=shm shares the budget between workers on a host, tcp://host:port across nodes.
+    store=ratelimit_store.make_store(),
+)
 input_validator = InputValidator()
 domain_guard = DomainGuard()
+
+# Every rule category in one automaton. The shared instances use it too, so checking the same
+# text for blocked content and then scope costs one scan (the matcher memoizes the last text).
+guard_matcher = RuleMatcher({
+    "blocked": content_filter.blocked_patterns,
+    "warning": content_filter.warning_patterns,
+    "in_domain": domain_guard.offer_terms,
+    "out_of_scope": domain_guard.out_of_scope_patterns,
+})
+content_filter.matcher = guard_matcher
+domain_guard.matcher = guard_matcher
+
+
+def scan(text) -> FrozenSet[str]:
+    """Return every guard-rail category (blocked, warning, in_domain, out_of_scope) the text hits."""
+    return guard_matcher.scan(text)
@@ -1,6 +1,15 @@
-import requests
+import asyncio
+import hashlib
+import httpx
 import json
 import os
+from contextlib import aclosing
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import observability
+from scheduler import QueueShed, Ticket, llm_scheduler
 
 
 def _normalize_url(u: str) -> str:
@@ -22,9 +31,63 @@ LLM_REPEAT_PENALTY = float(os.getenv("LLM_REPEAT_PENALTY", "1.1"))
 LLM_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "10m")
 LLM_TIMEOUT = int(os.getenv("LLM_TIMEOUT", "60"))
 
+# Ollama stops generating at any of these (not included in the output): the model
+# starting another turn of the prompt template, in the template's own casing. Other
+# casings are still caught by the reply filters. "|"-separated, "\n" for a newline.
+LLM_STOP = [
+    s.replace("\\n", "\n")
+    for s in os.getenv("LLM_STOP", "\\nUser Question:|\\nContext:|\\nAnswer:").split("|")
+    if s
+]
+# Reply budget enforced while streaming (streaming.Budget); the stream is closed once it is met. 0 = no limit.
+LLM_MAX_SENTENCES = int(os.getenv("LLM_MAX_SENTENCES", "2"))
+LLM_MAX_BULLETS = int(os.getenv("LLM_MAX_BULLETS", "5"))
+
+# Connection pool and per-stage timeouts for the shared async client.
+# LLM_READ_TIMEOUT bounds the gap between two streamed frames, not the whole generation.
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "16"))
+LLM_POOL_KEEPALIVE = int(os.getenv("LLM_POOL_KEEPALIVE", str(LLM_POOL_SIZE)))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", str(LLM_TIMEOUT)))
+LLM_WRITE_TIMEOUT = float(os.getenv("LLM_WRITE_TIMEOUT", "10"))
+LLM_POOL_TIMEOUT = float(os.getenv("LLM_POOL_TIMEOUT", "10"))
+
+# Share one upstream stream between concurrent requests with an identical prompt and options.
+LLM_COALESCE = os.getenv("LLM_COALESCE", "1").strip().lower() in {"1", "true", "yes", "on"}
+
+_client: Optional[httpx.AsyncClient] = None
+
 
-def ask_llm(prompt):
-    payload = {
+def get_client() -> httpx.AsyncClient:
+    """Return the process-wide keep-alive client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                connect=LLM_CONNECT_TIMEOUT,
+                read=LLM_READ_TIMEOUT,
+                write=LLM_WRITE_TIMEOUT,
+                pool=LLM_POOL_TIMEOUT,
+            ),
+            limits=httpx.Limits(
+                max_connections=LLM_POOL_SIZE,
+                max_keepalive_connections=LLM_POOL_KEEPALIVE,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _payload(prompt: str, stop: Optional[List[str]] = None) -> Dict:
+    return {
         "model": MODEL_NAME,
         "prompt": prompt,
         "stream": True,
@@ -34,21 +97,239 @@ def ask_llm(prompt):
             "top_k": LLM_TOP_K,
             "top_p": LLM_TOP_P,
             "repeat_penalty": LLM_REPEAT_PENALTY,
+            "stop": LLM_STOP if stop is None else stop,
         },
         "keep_alive": LLM_KEEP_ALIVE,
     }
 
+
+def _flight_key(payload: Dict) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class GenerationStats:
+    """Ollama's own accounting for a generation, read from the final (done) frame of its stream.
+
+    `done` stays False when the stream ended without that frame (cancelled, or an error).
+    """
+
+    done: bool = False
+    done_reason: str = ""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    load_s: float = 0.0
+    prompt_eval_s: float = 0.0
+    eval_s: float = 0.0
+    total_s: float = 0.0
+
+    @property
+    def tokens_per_s(self) -> float:
+        return self.completion_tokens / self.eval_s if self.eval_s > 0 else 0.0
+
+    def load(self, frame: Dict) -> None:
+        # Ollama reports durations in nanoseconds; prompt_eval_count is missing when the prompt was cached.
+        self.done = True
+        self.done_reason = frame.get("done_reason") or ""
+        self.prompt_tokens = int(frame.get("prompt_eval_count") or 0)
+        self.completion_tokens = int(frame.get("eval_count") or 0)
+        self.load_s = (frame.get("load_duration") or 0) / 1e9
+        self.prompt_eval_s = (frame.get("prompt_eval_duration") or 0) / 1e9
+        self.eval_s = (frame.get("eval_duration") or 0) / 1e9
+        self.total_s = (frame.get("total_duration") or 0) / 1e9
+
+
+def _observe(stats: GenerationStats):
+    observability.LLM_PROMPT_TOKENS.observe(stats.prompt_tokens)
+    observability.LLM_COMPLETION_TOKENS.observe(stats.completion_tokens)
+    if stats.eval_s > 0:
+        observability.LLM_TOKENS_PER_SECOND.observe(stats.tokens_per_s)
+    observability.LLM_LOAD_SECONDS.observe(stats.load_s)
+    observability.LLM_PHASE_SECONDS.labels("prompt_eval").observe(stats.prompt_eval_s)
+    observability.LLM_PHASE_SECONDS.labels("generation").observe(stats.eval_s)
+
+
+async def _stream(payload: Dict, stats: Optional[GenerationStats] = None):
+    """Yield the text of each frame; the done frame fills `stats` and feeds the capacity metrics."""
     try:
-        response = requests.post(OLLAMA_URL, json=payload, stream=True, timeout=LLM_TIMEOUT)
-        response.raise_for_status()
-
-        for line in response.iter_lines():
-            if line:
-                try:
-                    data = json.loads(line.decode("utf-8"))
-                    if "response" in data:
+        async with get_client().stream("POST", OLLAMA_URL, json=payload) as response:
+            response.raise_for_status()
+
+            async for line in response.aiter_lines():
+                if line:
+                    try:
+                        data = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if data.get("done"):
+                        done = stats if stats is not None else GenerationStats()
+                        done.load(data)
+                        _observe(done)
+                        if data.get("response"):
+                            yield data["response"]
+                    elif "response" in data:
                         yield data["response"]
-                except json.JSONDecodeError:
-                    continue
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         yield f"Error communicating with LLM: {str(e)}"
+
+
+def _record(produced: int, delivered: int, reason: str):
+    """Account one finished upstream generation; a frame of Ollama's stream is one token."""
+    observability.LLM_TOKENS.labels("useful").inc(delivered)
+    observability.LLM_TOKENS.labels("wasted").inc(max(0, produced - delivered))
+    observability.LLM_GENERATIONS_ENDED.labels(reason).inc()
+
+
+class SharedGeneration:
+    """One upstream generation fanned out to every subscriber.
+
+    Chunks are kept for the lifetime of the generation so a late subscriber
+    first replays the prefix produced so far. The upstream task is cancelled
+    only when the last subscriber goes away, which closes the connection to
+    Ollama and so stops the generation there too.
+
+    The upstream task takes the LLM slot (scheduler.llm_scheduler) with one
+    ticket for everyone, so subscribers that join, even while it is still
+    queued, never wait for or hold a slot of their own; a more urgent joiner
+    promotes the ticket to its priority and deadline. If the queue sheds it,
+    every subscriber gets the QueueShed.
+    """
+
+    def __init__(self, key: str, payload: Dict, priority_level: str = "LOW", deadline: Optional[datetime] = None):
+        self.key = key
+        self.payload = payload
+        self.ticket = Ticket(priority_level, deadline)
+        self.chunks: List[str] = []
+        self.stats = GenerationStats()
+        # Most chunks any subscriber has read; the rest were generated for nobody.
+        self.delivered = 0
+        self.done = False
+        # Set once the last subscriber left and the upstream task is being cancelled.
+        self.closing = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def start(self):
+        self.task = asyncio.create_task(self._produce())
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _produce(self):
+        reason = "completed"
+        try:
+            slot = await llm_scheduler.admit(ticket=self.ticket)
+            async with slot, aclosing(_stream(self.payload, self.stats)) as stream:
+                async for chunk in stream:
+                    self.chunks.append(chunk)
+                    self._notify()
+        except asyncio.CancelledError:
+            reason = "cancelled"
+            raise
+        except QueueShed as e:
+            reason = "shed"
+            self.error = e
+        except Exception as e:
+            reason = "error"
+            self.error = e
+        finally:
+            _record(len(self.chunks), self.delivered, reason)
+            self.done = True
+            if _inflight.get(self.key) is self:
+                del _inflight[self.key]
+            observability.LLM_INFLIGHT_GENERATIONS.set(len(_inflight))
+            self._notify()
+
+    async def subscribe(self, on_cancel: Optional[Callable[[int], None]] = None):
+        """Yield every chunk; `on_cancel` is called if this subscriber leaving cancels the upstream."""
+        self.subscribers += 1
+        i = 0
+        try:
+            while True:
+                while i < len(self.chunks):
+                    i += 1
+                    self.delivered = max(self.delivered, i)
+                    yield self.chunks[i - 1]
+                if self.done:
+                    break
+                changed = self._changed
+                await changed.wait()
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done and self.task:
+                self.closing = True
+                self.task.cancel()
+                if on_cancel is not None:
+                    on_cancel(max(0, LLM_NUM_PREDICT - len(self.chunks)))
+
+
+_inflight: Dict[str, SharedGeneration] = {}
+
+
+async def ask_llm(
+    prompt,
+    stop: Optional[List[str]] = None,
+    stats: Optional[GenerationStats] = None,
+    priority_level: str = "LOW",
+    deadline: Optional[datetime] = None,
+    on_cancel: Optional[Callable[[int], None]] = None,
+):
+    """Stream the reply to prompt; `stop` overrides the LLM_STOP sequences.
+
+    A new upstream generation first waits for an LLM slot at `priority_level`
+    (ordered by the SLA `deadline`); joining an identical in-flight one does
+    not, but raises it to this request's priority if that is more urgent.
+    Raises scheduler.QueueShed, before any text, when the queue sheds it.
+
+    Pass a GenerationStats as `stats` to get Ollama's token counts and timings
+    once the stream is done (a coalesced request gets the shared generation's).
+
+    Consume it under contextlib.aclosing (or aclose() it) so that a consumer
+    that stops early, is cancelled or loses its client releases the upstream
+    generation right away instead of whenever the generator is collected.
+    `on_cancel` is called with the tokens the generation had left (num_predict
+    minus those produced) when this consumer leaving actually stopped it; a
+    coalesced generation others still read from keeps going and does not call it.
+    """
+    payload = _payload(prompt, stop)
+    if not LLM_COALESCE:
+        delivered, reason = 0, "cancelled"
+        try:
+            slot = await llm_scheduler.admit(priority_level, deadline)
+            async with slot, aclosing(_stream(payload, stats)) as stream:
+                async for chunk in stream:
+                    delivered += 1
+                    yield chunk
+            reason = "completed"
+        except QueueShed:
+            reason = "shed"
+            raise
+        except Exception:
+            reason = "error"
+            raise
+        finally:
+            _record(delivered, delivered, reason)
+            if reason == "cancelled" and on_cancel is not None:
+                on_cancel(max(0, LLM_NUM_PREDICT - delivered))
+        return
+
+    key = _flight_key(payload)
+    gen = _inflight.get(key)
+    if gen is None or gen.done or gen.closing:
+        gen = SharedGeneration(key, payload, priority_level, deadline)
+        _inflight[key] = gen
+        observability.LLM_INFLIGHT_GENERATIONS.set(len(_inflight))
+        gen.start()
+    else:
+        observability.LLM_COALESCED.inc()
+        gen.ticket.promote(priority_level, deadline)
+    async with aclosing(gen.subscribe(on_cancel)) as chunks:
+        async for chunk in chunks:
+            yield chunk
+    if stats is not None and gen.stats.done:
+        vars(stats).update(asdict(gen.stats))
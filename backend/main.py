@@ -5,6 +5,8 @@ from pydantic import BaseModel
 from typing import Optional, List, Dict
 import asyncio
 import time
+from contextlib import aclosing
+import anyio
 import json
 import os
 from pathlib import Path
@@ -17,6 +19,12 @@ import guard_rails
 import uuid
 import observability
 import offer_context as offer_context_mod
+import topics
+from readiness import readiness
+from answer_cache import answer_cache, context_key, replay as replay_answer
+from scheduler import QueueShed
+from message import NormalizedMessage
+from streaming import CtaDetector, reply_filters
 CHAT_MODE = os.getenv("CHAT_MODE", "full")
 OFFER_CONTEXT_ENABLED = os.getenv("OFFER_CONTEXT_ENABLED", "0").strip().lower() in {"1", "true", "yes", "on"}
 if CHAT_MODE != "decision_tree":
@@ -55,6 +63,17 @@ async def metrics():
     data = generate_latest()
     return Response(content=data, media_type=CONTENT_TYPE_LATEST)
 
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up. Also shows how far startup has got."""
+    return {"status": "ok", "mode": CHAT_MODE, **readiness.report()}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 503 until every startup component has loaded (or while one has failed)."""
+    report = {"mode": CHAT_MODE, **readiness.report()}
+    return Response(content=json.dumps(report), media_type="application/json", status_code=200 if report["ready"] else 503)
+
 # --------------------------------------------------------------------------
 # WebSocket Connection Manager with Inactivity Monitoring
 # --------------------------------------------------------------------------
@@ -113,13 +132,39 @@ async def inactivity_monitor():
                 print(f"Error in inactivity monitor: {e}")
                 manager.disconnect(websocket)
 
+async def load_rag():
+    """Bring retrieval up in stages while the server already answers requests.
+
+    The lexical indexes come first (milliseconds), so FAQ variants and KB-only
+    topics are served almost at once; dense retrieval follows when the model and
+    embedding snapshot are loaded. /readyz turns 200 after the last stage.
+
+    Under serve.py the parent has loaded them before forking this worker, and
+    the stages only report ready.
+    """
+    await readiness.run("kb_lexical", (lambda: None) if rag.records else rag.load_lexical)
+    if await readiness.run("embedding_model", rag.load_model):
+        await readiness.run("kb_index", (lambda: None) if rag.dense_ready else rag.load_index)
+
 @app.on_event("startup")
 async def startup_event():
-    print("Loading knowledge base...")
     if rag:
-        rag.load_docs()
+        print("Loading knowledge base in the background...")
+        readiness.register("kb_lexical", "embedding_model", "kb_index")
+        asyncio.create_task(load_rag())
     # Start the background monitor
     asyncio.create_task(inactivity_monitor())
+    asyncio.create_task(guard_rails.rate_limiter.sweep_forever())
+    asyncio.create_task(topics.classifier.watch_forever())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if llm:
+        await llm.close_client()
+    if rag:
+        rag.query_embedder.stop()
+    if guard_rails.rate_limiter.store is not None:
+        await guard_rails.rate_limiter.store.close()
 
 def _request_id_from_http(request: Request) -> str:
     return request.headers.get("x-request-id") or str(uuid.uuid4())
@@ -153,30 +198,61 @@ def _log_chat_response_safe(request_id: str, channel: str, response: str, durati
 # Chat Logic (Refactored for reuse)
 # -------------------------------------------------------------------------
 
-async def process_chat(user_msg: str, offer_id: Optional[str], offer_context: Optional[Dict] = None, client_ip: str = "unknown", request_id: Optional[str] = None):
+def _expired_offer_recommendations(offer_id: Optional[str], offer: Optional[Dict], offer_context_query: str) -> Optional[str]:
+    if not offer_id:
+        return None
+    if not offer:
+        offer = mock_offer_api.get_offer_details(offer_id)
+    if offer and offer.get("user_status") == "EXPIRED" and "expired" in (offer_context_query or "").lower():
+        recs = mock_offer_api.get_recommended_offers(exclude_offer_id=offer.get("offer_id"), limit=2)
+        if recs:
+            lines = []
+            for r in recs:
+                title = r.get("title")
+                mins = r.get("estimated_time_minutes")
+                diff = r.get("difficulty")
+                lines.append(f"- {title} (~{mins} min, {diff})")
+            return "\n\nThis offer has expired. Recommended quick alternatives:\n" + "\n".join(lines)
+    return None
+
+_ESCALATION_VERBS = {"connect","escalate","talk","speak","transfer","reach","contact","open","create","submit","file","raise"}
+_ESCALATION_TARGETS = {"human","support","customer","care","agent","representative","associate","executive","person","service","team"}
+
+def _asks_for_human(msg: NormalizedMessage) -> bool:
+    """The user wants an agent or a ticket (e.g. "connect me to support", "raise a ticket")."""
+    tokens = msg.token_set
+    has_verb = not tokens.isdisjoint(_ESCALATION_VERBS) or any(any(v in t for v in _ESCALATION_VERBS) for t in tokens)
+    has_target = not tokens.isdisjoint(_ESCALATION_TARGETS) or any(any(trg in t for trg in _ESCALATION_TARGETS) for t in tokens)
+    ticket = ("ticket" in tokens or "request" in tokens) and not tokens.isdisjoint({"open","create","submit","file","raise"})
+    return (has_verb and has_target) or ticket
+
+async def process_chat(user_msg: str, offer_id: Optional[str], offer_context: Optional[Dict] = None, client_ip: str = "unknown", request_id: Optional[str] = None, channel: str = ""):
     request_id = request_id or str(uuid.uuid4())
+    request_start = time.perf_counter()
+    # Normalize once; every stage below reads the shared views instead of re-lowering/re-tokenizing.
+    msg = NormalizedMessage(user_msg)
     # 1. Input Validation
-    validation_result = guard_rails.input_validator.validate_input(user_msg)
+    validation_result = guard_rails.input_validator.validate_input(msg)
     if not validation_result["valid"]:
         yield validation_result["message"]
         return
     
     # 2. Content Filtering
-    if guard_rails.content_filter.contains_blocked_content(user_msg):
+    if guard_rails.content_filter.contains_blocked_content(msg):
         yield "I'm sorry, I cannot process this request due to security policies. Please contact support for assistance."
         return
     
     # 3. Rate Limiting
-    if await guard_rails.rate_limiter.is_rate_limited(client_ip):
+    if await guard_rails.rate_limiter.is_rate_limited(client_ip, channel):
         yield "Rate limit exceeded. Please wait a moment before sending more messages."
         return
     
     # 4. Domain Guard: keep responses offer-related
-    if guard_rails.domain_guard.is_out_of_scope(user_msg):
+    if guard_rails.domain_guard.is_out_of_scope(msg):
         yield "I can help with offer-related support. Please ask an offer-related question."
         return
     
-    norm_greet = user_msg.strip().lower()
+    norm_greet = msg.lower.strip()
     if norm_greet in {"hi", "hello", "hey", "yo"} or len(norm_greet) < 4:
         yield ("Thanks for reaching out. Please tell me your offer issue:\n"
                "- Rewards pending (24–48 hours)\n"
@@ -191,15 +267,7 @@ async def process_chat(user_msg: str, offer_id: Optional[str], offer_context: Op
         return
     
     try:
-        import re as _re
-        _norm = _re.sub(r"\s+", " ", user_msg or "").strip().lower()
-        _tokens = _re.findall(r"[a-z]+", _norm)
-        _verbs = {"connect","escalate","talk","speak","transfer","reach","contact","open","create","submit","file","raise"}
-        _targets = {"human","support","customer","care","agent","representative","associate","executive","person","service","team"}
-        _has_verb = any(t in _verbs for t in _tokens) or any(any(v in t for v in _verbs) for t in _tokens)
-        _has_target = any(t in _targets for t in _tokens) or any(any(trg in t for trg in _targets) for t in _tokens)
-        _ticket = ("ticket" in _tokens or "request" in _tokens) and any(t in {"open","create","submit","file","raise"} for t in _tokens)
-        if (_has_verb and _has_target) or _ticket:
+        if _asks_for_human(msg):
             yield "One moment please..."
             return
     except Exception:
@@ -209,7 +277,11 @@ async def process_chat(user_msg: str, offer_id: Optional[str], offer_context: Op
         yield "Please use the options above to continue."
         return
 
-    topic = offer_context_mod.detect_topic(user_msg)
+    # Embed the bare message first: its vector routes the topic and, unless offer
+    # context is appended to the query below, is also the retrieval result.
+    probe_msg = msg if msg.raw == msg.stripped else NormalizedMessage(msg.stripped)
+    probe = await rag.search(probe_msg)
+    topic = topics.classify(msg, probe.embedding, probe.topic_hint).topic
     kb_only_topics = {
         "payout",
         "gift_card",
@@ -229,10 +301,10 @@ async def process_chat(user_msg: str, offer_id: Optional[str], offer_context: Op
         if summary and not offer_id and summary.oid:
             offer_id = summary.oid
         if summary:
-            offer_specific = offer_context_mod.offer_aware_response(summary, user_msg)
+            offer_specific = offer_context_mod.offer_aware_response(summary, msg)
     
     # 5. Determine Priority
-    priority_level = priority.determine_priority(user_msg)
+    priority_level = priority.determine_priority(msg)
     print(f"Priority: {priority_level}")
 
     # 2. Get Offer Context (if applicable)
@@ -245,18 +317,21 @@ async def process_chat(user_msg: str, offer_id: Optional[str], offer_context: Op
     if summary:
         offer_context_query = f"{offer_context_query}\n{offer_context_mod.offer_context_prompt(summary)}".strip()
     
-    # 3. Construct Search Query
+    # 3. Construct Search Query / 4. Search Knowledge Base
     # For KB-only topics, avoid polluting retrieval with offer details.
-    if topic in kb_only_topics:
-        search_query = user_msg.strip()
+    if topic in kb_only_topics or not offer_context_query:
+        hits = probe
     else:
-        search_query = f"{user_msg} {offer_context_query}".strip()
-    
-    # 4. Search Knowledge Base
-    docs = rag.search_docs(search_query)
+        hits = await rag.search(f"{user_msg} {offer_context_query}".strip())
     
+    # While the model and index are still loading only lexical hits exist: answer
+    # deterministic cases (KB-only topics, offer-aware replies) and nothing that needs the LLM.
+    if not rag.dense_ready and not offer_specific and not (topic in kb_only_topics and hits.kb_answer):
+        yield "Please use the options above to continue."
+        return
+
     # 5. Fallback Logic
-    if not docs or len(docs) == 0:
+    if not hits.records:
         yield (
             "I didn’t understand that. Please explain in a bit more detail.\n"
             "- What issue are you facing (reward not received / offer expired / withdrawal not received)?"
@@ -264,49 +339,17 @@ async def process_chat(user_msg: str, offer_id: Optional[str], offer_context: Op
         return
 
     # 6. Generate Response with LLM
-    def _clean_context(d: str) -> str:
-        lines = []
-        for ln in (d or "").splitlines():
-            if ln.strip().lower().startswith("keywords:"):
-                continue
-            lines.append(ln)
-        return "\n".join(lines).strip()
-    context_docs = [ _clean_context(d) for d in docs[:2] ]
-    context_str = "\n\n".join(context_docs)
-
-    def _kb_answer_from_context(ctx: str) -> str:
-        lines = (ctx or "").splitlines()
-        out = []
-        in_a = False
-        for ln in lines:
-            if ln.strip().startswith("A:"):
-                in_a = True
-                continue
-            if in_a and ln.strip().startswith("Q:"):
-                break
-            if in_a:
-                out.append(ln)
-        text = "\n".join([l for l in out if l.strip()]).strip()
-        if text:
-            return text
-        filtered = [ln for ln in lines if not ln.strip().startswith("Q:")]
-        return "\n".join([ln for ln in filtered if ln.strip()][:6]).strip()
-
-    def _get_best_kb() -> str:
-        for c in context_docs:
-            txt = _kb_answer_from_context(c)
-            if txt:
-                return txt
-        return _kb_answer_from_context(context_str)
+    # Records come pre-parsed from rag.load_lexical: cleaned context and the KB answer are field reads.
+    context_str = hits.context
 
     if topic in kb_only_topics:
-        kb_text = _get_best_kb()
+        kb_text = hits.kb_answer
         if kb_text:
             yield kb_text
             return
 
     if offer_specific:
-        kb_text = _get_best_kb()
+        kb_text = hits.kb_answer
         combined = offer_specific
         if kb_text and kb_text not in offer_specific:
             combined = f"{offer_specific}\n\n{kb_text}"
@@ -328,97 +371,100 @@ async def process_chat(user_msg: str, offer_id: Optional[str], offer_context: Op
     offer_block = ""
     if summary:
         offer_block = f"\n\nOffer Context:\n{offer_context_mod.offer_context_prompt(summary)}"
+
+    # Semantic answer cache: replay a recent answer to a near-identical question
+    # asked against the same retrieved context and offer status.
+    answer_key = context_key(
+        rag.kb_version,
+        context_str,
+        (offer or {}).get("user_status"),
+        (offer or {}).get("verification_status"),
+        summary.user_status if summary else "",
+        summary.offer_status if summary else "",
+    )
+    cached_answer = answer_cache.lookup(hits.embedding, answer_key, topic)
+    if cached_answer:
+        for piece in replay_answer(cached_answer):
+            yield piece
+        recs = _expired_offer_recommendations(offer_id, offer, offer_context_query)
+        if recs:
+            yield recs
+        return
+
     full_prompt = f"{system_prompt}\n\nContext:\n{context_str}{offer_block}\n\nUser Question: {user_msg}\nAnswer:"
 
-    # Yield chunks from LLM and filter responses
+    sla_info = sla.assign_sla(priority_level)
+
+    # Yield chunks from LLM through the reply filters (streaming.reply_filters): echo
+    # detection, the end-of-answer cut, pleasantry/channel rewrites, the sentence/bullet
+    # budget and the content policy all act on each chunk before it leaves the server.
     response_buffer = ""
     llm_start = time.time()
-    preview = ""
-    stream_started = False
-    tail = ""
-
-    def _looks_like_prompt_echo(txt: str) -> bool:
-        t = (txt or "").lower()
-        return (
-            "you are a helpful offer-support assistant" in t
-            or "use only the provided context to answer" in t
-            or "\ncontext:" in t
-            or "user question:" in t
-        )
-
-    for chunk in llm.ask_llm(full_prompt):
-        if stream_started:
-            import re
-            candidate = (tail + chunk)
-            low = candidate.lower()
-            m = re.search(r"(?:^|\n)\s*user question\b", low) or re.search(r"(?:^|\n)\s*answer\s*:?", low)
-            if m:
-                cut = m.start() - len(tail)
-                if cut > 0:
-                    out = chunk[:cut]
+    filters = reply_filters(guard_rails.scan, llm.LLM_MAX_SENTENCES, llm.LLM_MAX_BULLETS)
+    echo, policy = filters.stages[0], filters.stages[-1]
+    tokens = 0
+    # What the generation had left to say when this request leaving stopped it (not a shared
+    # generation others still read); set by ask_llm's on_cancel as the stream is closed.
+    saved: Optional[int] = None
+    echo_fallback = False
+
+    def cancelled(left: int):
+        nonlocal saved
+        saved = left
+
+    stats = llm.GenerationStats()
+    ttft = observability.CHAT_TTFT.labels(channel or "unknown")
+    first_token = True
+
+    # aclosing: leaving the loop early (filters stopped, echo fallback, the caller going away)
+    # closes the upstream generation instead of leaving Ollama to finish it. ask_llm waits
+    # for an LLM slot unless it joins an identical in-flight generation; when the queue is
+    # too deep for this priority it sheds before any text, and we answer from the KB instead.
+    try:
+        async with aclosing(llm.ask_llm(full_prompt, stats=stats, priority_level=priority_level, deadline=sla_info["first_response_due"], on_cancel=cancelled)) as stream:
+            async for chunk in stream:
+                tokens += 1
+                out = filters.feed(chunk)
+                if echo.echoed and not (response_buffer + out).strip():
+                    # The reply opens with the prompt itself: answer from the KB instead.
+                    echo_fallback = True
+                    break
+                if out:
+                    if first_token:
+                        ttft.observe(time.perf_counter() - request_start)
+                        first_token = False
                     response_buffer += out
                     yield out
-                return
-            response_buffer += chunk
-            tail = candidate[-250:]
-            yield chunk
-            continue
-
-        preview += chunk
-        if len(preview) < 200 and "\n" not in preview:
-            continue
-
-        if _looks_like_prompt_echo(preview):
-            kb_text = _kb_answer_from_context(context_docs[0] if context_docs else context_str)
-            if kb_text:
-                yield kb_text
-                return
-            yield "Please raise a ticket from the app so our support team can help."
-            return
-
-        stream_started = True
-        response_buffer += preview
-        tail = preview[-250:]
-        yield preview
+                if filters.stopped:
+                    # Leaving the loop closes the generation (unless others share it).
+                    break
+    except QueueShed:
+        yield hits.kb_answer or "Please raise a ticket from the app so our support team can help."
+        return
+    if echo_fallback:
+        ttft.observe(time.perf_counter() - request_start)
+        if saved is not None:
+            observability.LLM_TOKENS_SAVED.labels("echo").observe(saved)
+        yield hits.records[0].answer or "Please raise a ticket from the app so our support team can help."
+        return
 
-    if not stream_started and preview:
-        response_buffer += preview
-        yield preview
+    rest = filters.flush()
+    if rest:
+        if first_token:
+            ttft.observe(time.perf_counter() - request_start)
+        response_buffer += rest
+        yield rest
+    if saved is not None and filters.stopped:
+        # After the flush: a later stage may still withhold what an earlier one stopped on.
+        observability.LLM_TOKENS_SAVED.labels(filters.stopped_by).observe(saved)
     llm_ms = int((time.time() - llm_start) * 1000)
-    
-    # Sanitize tone and keep only concise, relevant text
-    def _sanitize(text: str) -> str:
-        t = text.strip()
-        # Drop pleasantries and open-ended follow-ups
-        blacklist = [
-            r"(?i)\b(i'?m glad|happy to help|would you like|is there anything else|let me know|can i help with|feel free to ask)\b",
-            r"(?i)\b(i can guide you|i can assist you)\b",
-        ]
-        import re
-        for pat in blacklist:
-            t = re.sub(pat, "", t)
-        t = re.sub(r"\s{2,}", " ", t).strip()
-        # Keep max 2 sentences or first 5 bullet lines
-        bullets = [ln for ln in t.splitlines() if ln.strip().startswith(("*", "-"))]
-        if bullets:
-            return "\n".join(bullets[:5]).strip()
-        # Sentence clamp
-        sentences = re.split(r"(?<=[.!?])\s+", t)
-        return " ".join(sentences[:2]).strip()
-
-    sanitized = _sanitize(response_buffer)
-    def _channelize(text: str) -> str:
-        import re
-        t = text
-        t = re.sub(r"(?i)raise a ticket\s+(?:on|via)\s+(?:our\s+)?website", "raise a ticket from the app", t)
-        t = re.sub(r"(?i)click the \"?chat with us\"?\s+button\s+on\s+(?:our\s+)?website", "open the app and use the support option", t)
-        t = re.sub(r"(?i)on\s+(?:our\s+)?website", "in the app", t)
-        t = re.sub(r"(?i)\[website url\]", "the app", t)
-        return re.sub(r"\s{2,}", " ", t).strip()
-    sanitized = _channelize(sanitized)
-    um = (user_msg or "").lower()
+    sanitized = response_buffer.strip()
+    # Only clean, model-generated answers are worth replaying from the answer cache.
+    cacheable = bool(sanitized) and not response_buffer.startswith("Error communicating with LLM")
+    um = msg.lower
     if (("completed" in um) and any(p in um for p in ["not get", "not received", "not credited", "didn't get", "did not get"])) or \
        (("reward" in um) and ("completed" in um)):
+        cacheable = False
         sanitized = (
             "Your offer is completed but the reward is not credited.\n"
             "- Advertisers typically verify completion within 48–72 hours.\n"
@@ -432,43 +478,57 @@ async def process_chat(user_msg: str, offer_id: Optional[str], offer_context: Op
             prompt=full_prompt,
             completion=sanitized,
             duration_ms=llm_ms,
-            tokens_prompt=0,
-            tokens_completion=0,
+            tokens_prompt=stats.prompt_tokens,
+            # Ollama's count when the generation finished, else the frames streamed before it was cut.
+            tokens_completion=stats.completion_tokens if stats.done else tokens,
             status="ok",
         )
     except Exception:
         pass
-    # Final content filtering on complete response (avoid duplicating full reply)
-    filtered_response = guard_rails.content_filter.filter_response(sanitized)
-    if guard_rails.domain_guard.response_off_topic(filtered_response):
+    # The policy stage has already seen every released character.
+    if policy.off_topic:
         yield "\nI can help with offer-related support. Please ask an offer-related question."
         return
-    if filtered_response != sanitized:
-        if filtered_response.startswith(sanitized):
-            note = filtered_response[len(sanitized):].strip()
-            if note:
-                yield "\n" + note
-        else:
+    if policy.blocked:
+        # The reply stopped before the blocked text. Blocked terms also occur in our own FAQ
+        # answers (bank account, spam folder), so finish with the vetted KB answer rather than
+        # leave the reply cut short.
+        if hits.kb_answer:
+            yield ("\n\n" if response_buffer.strip() else "") + hits.kb_answer
+        elif response_buffer.strip():
             yield "\n[Some content was removed due to policy]"
-    
-    if offer_id:
-        if not offer:
-            offer = mock_offer_api.get_offer_details(offer_id)
-        if offer and offer.get("user_status") == "EXPIRED" and "expired" in (offer_context_query or "").lower():
-            recs = mock_offer_api.get_recommended_offers(exclude_offer_id=offer.get("offer_id"), limit=2)
-            if recs:
-                lines = []
-                for r in recs:
-                    title = r.get("title")
-                    mins = r.get("estimated_time_minutes")
-                    diff = r.get("difficulty")
-                    lines.append(f"- {title} (~{mins} min, {diff})")
-                yield "\n\nThis offer has expired. Recommended quick alternatives:\n" + "\n".join(lines)
+        else:
+            yield guard_rails.BLOCKED_REPLY
+    elif policy.warning:
+        yield "\nNote: For security reasons, please avoid sharing sensitive personal information in this chat."
+    elif cacheable:
+        answer_cache.store(hits.embedding, answer_key, sanitized, topic)
+
+    recs = _expired_offer_recommendations(offer_id, offer, offer_context_query)
+    if recs:
+        yield recs
 
 # -------------------------------------------------------------------------
 # Endpoints
 # -------------------------------------------------------------------------
 
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse that always closes its body generator.
+
+    When the client disconnects Starlette stops iterating the body but leaves
+    the generator suspended, so process_chat (and the LLM generation under it)
+    would only be cleaned up whenever the generator is garbage-collected.
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            aclose = getattr(self.body_iterator, "aclose", None)
+            if aclose is not None:
+                with anyio.CancelScope(shield=True):
+                    await aclose()
+
 # Keep the HTTP endpoint for backward compatibility (optional, but good practice)
 class ChatRequest(BaseModel):
     message: str
@@ -486,9 +546,13 @@ async def chat(request: ChatRequest, client_request: Request):
         status = "ok"
         start = time.time()
         try:
-            async for chunk in process_chat(request.message, request.offer_id, request.offer_context, client_ip, request_id=request_id):
-                buf.append(chunk)
-                yield chunk
+            async with aclosing(process_chat(request.message, request.offer_id, request.offer_context, client_ip, request_id=request_id, channel="http")) as chunks:
+                async for chunk in chunks:
+                    buf.append(chunk)
+                    yield chunk
+        except (asyncio.CancelledError, GeneratorExit):
+            status = "cancelled"
+            raise
         except Exception:
             status = "error"
             raise
@@ -502,7 +566,7 @@ async def chat(request: ChatRequest, client_request: Request):
                 status=status,
             )
             
-    return StreamingResponse(response_generator(), media_type="text/plain")
+    return ClosingStreamingResponse(response_generator(), media_type="text/plain")
 
 class ChatSyncResponse(BaseModel):
     message_id: str
@@ -518,8 +582,9 @@ async def chat_sync(request: ChatRequest, client_request: Request):
     status = "ok"
     start = time.time()
     try:
-        async for chunk in process_chat(request.message, request.offer_id, request.offer_context, client_ip, request_id=request_id):
-            buf.append(chunk)
+        async with aclosing(process_chat(request.message, request.offer_id, request.offer_context, client_ip, request_id=request_id, channel="chat_sync")) as chunks:
+            async for chunk in chunks:
+                buf.append(chunk)
     except Exception:
         status = "error"
         raise
@@ -556,10 +621,15 @@ async def chat_stream(request: ChatRequest, client_request: Request):
             yield json.dumps({"event": "end"}) + "\n"
             return
         buf = []
+        cta = CtaDetector()
         try:
-            async for chunk in process_chat(request.message, request.offer_id, request.offer_context, client_ip, request_id=request_id):
-                buf.append(chunk)
-                yield json.dumps({"delta": chunk}) + "\n"
+            async with aclosing(process_chat(request.message, request.offer_id, request.offer_context, client_ip, request_id=request_id, channel="chat_stream")) as chunks:
+                async for chunk in chunks:
+                    buf.append(cta.feed(chunk))
+                    yield json.dumps({"delta": chunk}) + "\n"
+        except (asyncio.CancelledError, GeneratorExit):
+            status = "cancelled"
+            raise
         except Exception:
             status = "error"
             raise
@@ -572,37 +642,9 @@ async def chat_stream(request: ChatRequest, client_request: Request):
                 request.offer_id,
                 status=status,
             )
-        full = "".join(buf).strip()
-        # Robust CTA detection
-        import re
-        norm = re.sub(r"\s+", " ", full).strip().lower()
-        inorm = re.sub(r"\s+", " ", request.message or "").strip().lower()
-        # Allow minor punctuation/spacing differences around 48 hours + contact support
-        trigger_patterns = [
-            r"if it exceed[s]?\s*48\s*hour[s]?,?\s*(please )?contact support",
-            r"contact support.*48\s*hour[s]?",
-            r"contact (?:our\s+)?support (?:team|desk|agent)s?",
-            r"reach(?:ing)?\s+out\s+to\s+(?:our\s+)?official\s+channels",
-            r"visit(?:ing)?\s+(?:our\s+)?help\s+center",
-        ]
-        escalate_patterns = [
-            r"(let me|i will)?\s*(connect|escalate)\s+you(?:\s+\w+){0,3}\s+to\s+(?:a\s+)?human(?:\s+agent)?",
-            r"not\s+able\s+to\s+connect\s+you(?:\s+\w+){0,3}\s+to\s+(?:a\s+)?human(?:\s+agent)?",
-            r"talk to (a\s+)?human(\s+agent)?",
-            r"not\s+(?:a\s+)?direct\s+contact\s+to\s+(?:a\s+)?human\s+agent[s]?",
-        ]
-        _tokens = re.findall(r"[a-z]+", inorm)
-        _verbs = {"connect","escalate","talk","speak","transfer","reach","contact","open","create","submit","file","raise"}
-        _targets = {"human","support","customer","care","agent","representative","associate","executive","person","service","team"}
-        has_verb = any(t in _verbs for t in _tokens) or any(any(v in t for v in _verbs) for t in _tokens)
-        has_target = any(t in _targets for t in _tokens) or any(any(trg in t for trg in _targets) for t in _tokens)
-        ticket_intent = (("ticket" in _tokens or "request" in _tokens) and any(t in {"open","create","submit","file","raise"} for t in _tokens))
-        ask_human_input = (has_verb and has_target) or ticket_intent
-        should_cta = (
-            any(re.search(p, norm) for p in trigger_patterns) or
-            any(re.search(p, norm) for p in escalate_patterns) or
-            ask_human_input
-        )
+        # The CTA detector saw every delta as it went out; finish() only rescans the whole reply
+        # for the patterns that can span more than its window.
+        should_cta = cta.finish() or _asks_for_human(NormalizedMessage(request.message or ""))
         if should_cta:
             try:
                 observability.ESCALATE_COUNTER.inc()
@@ -615,7 +657,7 @@ async def chat_stream(request: ChatRequest, client_request: Request):
             except Exception:
                 pass
             yield json.dumps({"event": "end"}) + "\n"
-    return StreamingResponse(gen(), media_type="application/x-ndjson")
+    return ClosingStreamingResponse(gen(), media_type="application/x-ndjson")
 
 class EndSessionRequest(BaseModel):
     reason: Optional[str] = None
@@ -690,9 +732,11 @@ async def websocket_endpoint(websocket: WebSocket):
                 status = "ok"
                 start = time.time()
                 try:
-                    async for chunk in process_chat(current_user_msg, current_offer_id, current_offer_context, client_ip, request_id=current_request_id):
-                        buf.append(chunk)
-                        await manager.send_message(chunk, websocket)
+                    # A new message cancels this task; aclosing makes that close the upstream generation too.
+                    async with aclosing(process_chat(current_user_msg, current_offer_id, current_offer_context, client_ip, request_id=current_request_id, channel="ws")) as chunks:
+                        async for chunk in chunks:
+                            buf.append(chunk)
+                            await manager.send_message(chunk, websocket)
                     await manager.send_message("\n\n", websocket)
                 except asyncio.CancelledError:
                     status = "cancelled"
@@ -0,0 +1,98 @@
+import re
+from functools import cached_property
+from typing import Any, Callable, Dict, FrozenSet, List, Union
+
+# Common synonyms/misspellings rewritten before retrieval to improve recall (applied in order).
+SYNONYMS = {
+    "payout": "withdrawal",
+    "cashout": "withdrawal",
+    "cash out": "withdrawal",
+    "upi payout": "upi withdrawal",
+    "payment": "withdrawal",
+    "money": "withdrawal",
+    "cash": "withdrawal",
+    "did not get my money": "withdrawal not received",
+    "didn't get my money": "withdrawal not received",
+    "not get my money": "withdrawal not received",
+    "not credited": "not received",
+    "referal": "referral",
+    "referrel": "referral",
+    "giftcard": "gift card",
+    "gift voucher": "gift card",
+}
+
+_WS = re.compile(r"\s+")
+_ALPHA = re.compile(r"[a-z]+")
+
+
+def rewrite_synonyms(lowered: str) -> str:
+    for k, v in SYNONYMS.items():
+        if k in lowered:
+            lowered = lowered.replace(k, v)
+    return lowered
+
+
+class NormalizedMessage:
+    """One user message, normalized once and shared by every pipeline stage.
+
+    Each view is computed on first use and kept, so stages that used to lowercase,
+    split or scan the raw text themselves now share the work. `memo` holds
+    per-stage results (guard-rail hits, detected topic, ...) keyed by the stage.
+    Stages also accept a plain str; `normalize` wraps it on the way in.
+    """
+
+    def __init__(self, raw: str):
+        self.raw = raw or ""
+        self._memo: Dict[Any, Any] = {}
+
+    def __str__(self):
+        return self.raw
+
+    def __len__(self):
+        return len(self.raw)
+
+    @cached_property
+    def stripped(self) -> str:
+        return self.raw.strip()
+
+    @cached_property
+    def lower(self) -> str:
+        return self.raw.lower()
+
+    @cached_property
+    def collapsed(self) -> str:
+        """Lowercased with runs of whitespace folded to one space."""
+        return _WS.sub(" ", self.raw).strip().lower()
+
+    @cached_property
+    def words(self) -> List[str]:
+        return self.raw.split()
+
+    @cached_property
+    def tokens(self) -> List[str]:
+        """Alphabetic tokens of the collapsed text."""
+        return _ALPHA.findall(self.collapsed)
+
+    @cached_property
+    def token_set(self) -> FrozenSet[str]:
+        return frozenset(self.tokens)
+
+    @cached_property
+    def rewritten(self) -> str:
+        """Lowercased text with retrieval synonyms applied (see SYNONYMS)."""
+        return rewrite_synonyms(self.lower)
+
+    def memo(self, key: Any, compute: Callable[[], Any]) -> Any:
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key]
+
+    def remember(self, key: Any, value: Any) -> Any:
+        self._memo[key] = value
+        return value
+
+
+def normalize(text: Union[str, NormalizedMessage, None]) -> NormalizedMessage:
+    if isinstance(text, NormalizedMessage):
+        return text
+    return NormalizedMessage(text or "")
@@ -2,7 +2,7 @@ import os
 import time
 import json
 import hashlib
-from prometheus_client import Counter, Histogram
+from prometheus_client import Counter, Gauge, Histogram
 
 ACCESS_COUNTER = Counter(
     "http_requests_total",
@@ -27,6 +27,187 @@ CSAT_COUNTER = Counter(
     "CSAT events",
 )
 
+CHAT_TTFT = Histogram(
+    "chat_time_to_first_token_seconds",
+    "From receiving a message to sending the first LLM-generated text, by channel",
+    ["channel"],
+    buckets=[0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30],
+)
+
+EMBED_BATCH_SIZE = Histogram(
+    "embed_batch_size",
+    "Distinct query strings encoded per embedding batch",
+    buckets=[1, 2, 4, 8, 16, 32, 64],
+)
+
+EMBED_QUEUE_WAIT = Histogram(
+    "embed_queue_wait_seconds",
+    "Time a query waited before its embedding batch started",
+    buckets=[0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.5],
+)
+
+LLM_COALESCED = Counter(
+    "llm_coalesced_requests_total",
+    "LLM requests served by joining an identical in-flight generation",
+)
+
+LLM_INFLIGHT_GENERATIONS = Gauge(
+    "llm_inflight_generations",
+    "Distinct upstream LLM generations currently streaming",
+)
+
+LLM_TOKENS = Counter(
+    "llm_stream_tokens_total",
+    "Streamed LLM tokens (one per Ollama frame): useful were read by a consumer, wasted were generated after every consumer had gone",
+    ["outcome"],
+)
+
+LLM_GENERATIONS_ENDED = Counter(
+    "llm_generations_ended_total",
+    "Upstream LLM generations by how they ended (completed, cancelled when no consumer was left, shed by the queue, error)",
+    ["reason"],
+)
+
+LLM_TOKENS_SAVED = Histogram(
+    "llm_tokens_saved",
+    "Per generation stopped by a reply filter: num_predict minus the tokens generated so far, by the filter that stopped it",
+    ["reason"],
+    buckets=[0, 10, 20, 40, 60, 80, 100, 150, 200, 300, 500],
+)
+
+LLM_PROMPT_TOKENS = Histogram(
+    "llm_prompt_tokens",
+    "Prompt tokens Ollama evaluated per generation (prompt_eval_count; 0 when the prompt was cached)",
+    buckets=[0, 64, 128, 256, 512, 768, 1024, 1536, 2048, 3072, 4096],
+)
+
+LLM_COMPLETION_TOKENS = Histogram(
+    "llm_completion_tokens",
+    "Tokens Ollama generated per completed generation (eval_count)",
+    buckets=[8, 16, 32, 48, 64, 96, 128, 192, 256, 512],
+)
+
+LLM_TOKENS_PER_SECOND = Histogram(
+    "llm_tokens_per_second",
+    "Generation speed per completed generation (eval_count / eval_duration)",
+    buckets=[1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120, 200],
+)
+
+LLM_LOAD_SECONDS = Histogram(
+    "llm_model_load_seconds",
+    "Time Ollama spent loading the model for a generation (load_duration; near 0 when already resident)",
+    buckets=[0.001, 0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30],
+)
+
+LLM_PHASE_SECONDS = Histogram(
+    "llm_phase_seconds",
+    "Time Ollama spent per generation evaluating the prompt vs generating tokens",
+    ["phase"],
+    buckets=[0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60],
+)
+
+LLM_ACTIVE = Gauge(
+    "llm_active_generations",
+    "Upstream LLM streams currently holding a slot (coalesced requests share one)",
+)
+
+LLM_QUEUE_DEPTH = Gauge(
+    "llm_queue_depth",
+    "Requests waiting for an LLM slot",
+    ["priority"],
+)
+
+LLM_QUEUE_WAIT = Histogram(
+    "llm_queue_wait_seconds",
+    "Time spent waiting for an LLM slot",
+    ["priority"],
+    buckets=[0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30],
+)
+
+LLM_QUEUE_SHED = Counter(
+    "llm_queue_shed_total",
+    "Requests answered from the KB instead of waiting for the LLM",
+    ["priority", "reason"],
+)
+
+CACHE_HITS = Counter(
+    "cache_hits_total",
+    "Cache hits",
+    ["cache"],
+)
+
+CACHE_MISSES = Counter(
+    "cache_misses_total",
+    "Cache misses",
+    ["cache"],
+)
+
+CACHE_EVICTIONS = Counter(
+    "cache_evictions_total",
+    "Cache evictions",
+    ["cache", "reason"],
+)
+
+CACHE_BYTES = Gauge(
+    "cache_bytes",
+    "Approximate bytes held by a cache",
+    ["cache"],
+)
+
+EMBED_ENCODE_SECONDS = Histogram(
+    "embed_encode_seconds",
+    "Wall time of one batched embedding encode",
+    buckets=[0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1],
+)
+
+RATE_LIMIT_STORE_RTT = Histogram(
+    "rate_limit_store_rtt_seconds",
+    "Round trip of one batched check against the shared rate-limit store",
+    ["backend"],
+    buckets=[0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1],
+)
+
+RATE_LIMIT_STORE_FALLBACK = Counter(
+    "rate_limit_store_fallback_total",
+    "Rate-limit checks answered by the local limiter because the shared store was unavailable",
+    ["backend"],
+)
+
+RAG_RETRIEVAL_PATH = Counter(
+    "rag_retrieval_path_total",
+    "How rag.search answered: variant, cache, lexical (BM25 only), hybrid, dense, or warming (BM25 while the model loads)",
+    ["path"],
+)
+
+RAG_VARIANT_LOOKUPS = Counter(
+    "rag_variant_lookups_total",
+    "FAQ question-variant lookups before embedding, by result",
+    ["result"],
+)
+
+RAG_VARIANT_SECONDS_SAVED = Counter(
+    "rag_variant_seconds_saved_total",
+    "Estimated encode + vector query time skipped by question-variant matches",
+)
+
+TOPIC_CLASSIFICATIONS = Counter(
+    "topic_classifications_total",
+    "Topic decisions by source: FAQ variant match, embedding centroid, or keyword table fallback",
+    ["source"],
+)
+
+STARTUP_COMPONENT_READY = Gauge(
+    "startup_component_ready",
+    "1 once a startup component (embedding model, KB index, ...) has loaded",
+    ["component"],
+)
+
+STARTUP_COMPONENT_SECONDS = Gauge(
+    "startup_component_seconds",
+    "Time a startup component took to load",
+    ["component"],
+)
+
 def _env(name, default):
     return os.getenv(name, default)
 
@@ -6,6 +6,9 @@ import time
 import re
 from typing import Any, Dict, List, Optional, Tuple
 
+import topics
+from message import normalize
+
 
 def _safe_get(d: Any, *keys: str, default=None):
     cur = d
@@ -52,8 +55,8 @@ def _is_completed(status: str) -> bool:
     return s in {"COMPLETED", "CREDITED", "PAID", "REWARDED"}
 
 
-def _parse_time_claim_seconds(user_msg: str) -> Optional[int]:
-    s = (user_msg or "").lower()
+def _parse_time_claim_seconds(user_msg) -> Optional[int]:
+    s = normalize(user_msg).lower
     vals: List[int] = []
     for m in re.finditer(r"\b(\d+)\s*(hours?|hrs?)\b", s):
         try:
@@ -202,88 +205,16 @@ def offer_context_prompt(summary: OfferSummary) -> str:
     return "\n".join(bits).strip()
 
 
-def classify_offer_intent(user_msg: str) -> str:
-    s = (user_msg or "").lower()
-    if detect_topic(s) in {"offer_status", "offer_reward_crediting"}:
-        if any(w in s for w in ["status", "ongoing", "completed", "expired", "active", "inactive", "progress", "started", "start time", "expires", "expiry"]):
-            return "status"
-        return "reward"
-    if detect_topic(s) in {"support_contact", "ticket"}:
-        return "ticket"
-    return "unknown"
-
-
-def detect_topic(user_msg: str) -> str:
-    s = (user_msg or "").lower()
-    if any(k in s for k in ["gift card", "giftcard", "xoxoday", "redemption", "redeemed", "merchant", "redeem a gift"]):
-        return "gift_card"
-    if any(k in s for k in ["referral", "refer", "invite", "referral code", "bonus", "friend"]):
-        return "referral"
-    payout_keys = [
-        "upi", "bank", "withdraw", "withdrawal", "payout", "transfer", "money not transferred", "redeem coins",
-        "payout processing", "processing payout", "payout failed", "failed payout", "transfer failed", "payment pending"
-    ]
-    if any(k in s for k in payout_keys):
-        return "payout"
-    if any(
-        k in s
-        for k in [
-            "crash",
-            "crashed",
-            "crashing",
-            "crach",
-            "not loading",
-            "freeze",
-            "freezing",
-            "stuck",
-            "glitch",
-            "keeps closing",
-            "closing automatically",
-            "update the app",
-            "update app",
-        ]
-    ):
-        return "app_issue"
-    if any(k in s for k in ["survey", "survey options"]):
-        return "survey"
-    if any(k in s for k in ["suspicious environment", "developer option", "developer options", "developer mode", "clone app", "cloned app"]):
-        return "device_integrity"
-    if any(k in s for k in ["account hold", "on hold", "blocked", "vpn", "policy violation", "proxy"]):
-        return "account_hold"
-    if any(k in s for k in ["customer care", "support number", "phone number", "timing", "timings", "contact support", "reach support", "raise a ticket", "support ticket"]):
-        return "support_contact"
-    if any(k in s for k in ["refund", "in-app purchase", "transaction"]):
-        return "refund"
-    if any(k in s for k in ["expired", "ongoing", "completed", "offer status", "offer is", "progress", "started", "start time", "expires", "expiry"]):
-        return "offer_status"
-    if any(
-        k in s
-        for k in [
-            "under verification",
-            "pending",
-            "verification",
-            "reward not",
-            "reward not credited",
-            "reward not received",
-            "not credited",
-            "not received",
-            "not get",
-            "did not get",
-            "didn't get",
-            "not getting",
-            "points not credited",
-            "coins not credited",
-            "reward pending",
-            "rewards pending",
-        ]
-    ):
-        return "offer_reward_crediting"
-    if re.search(r"\b(\d+)\s*(hours?|hrs?|days?)\b", s) and any(k in s for k in ["already", "more than", "over", "exceed", "exceeded", "since"]):
-        return "offer_reward_crediting"
-    return "unknown"
-
-
-def offer_aware_response(summary: OfferSummary, user_msg: str) -> Optional[str]:
+def classify_offer_intent(user_msg) -> str:
+    return topics.classify(user_msg).intent
+
+
+def detect_topic(user_msg) -> str:
+    return topics.classify(user_msg).topic
+
+
+def offer_aware_response(summary: OfferSummary, user_msg) -> Optional[str]:
+    user_msg = normalize(user_msg)
     topic = detect_topic(user_msg)
     if topic not in {"offer_status", "offer_reward_crediting"}:
         return None
@@ -1,89 +1,405 @@
-from sentence_transformers import SentenceTransformer
-import chromadb
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import json
+import numpy as np
 import os
 import re
+import time
+import cache
+import embedder
+import encoders
+import retrieval
+import observability
+import topics
+from message import normalize
 
-client = chromadb.Client()
-collection = client.get_or_create_collection("support_docs")
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_PATH = os.getenv("RAG_DATA_PATH", os.path.join(BASE_DIR, "../data/faqs.txt"))
+INDEX_DIR = os.getenv("RAG_INDEX_DIR", os.path.join(BASE_DIR, "../data/index"))
+EMBED_MODEL = "all-MiniLM-L6-v2"
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# Query cache budget; RAG_CACHE_MAX_BYTES=0 disables it.
+RAG_CACHE_MAX_BYTES = int(os.getenv("RAG_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+RAG_CACHE_TTL = float(os.getenv("RAG_CACHE_TTL", "600"))
+# Answer messages that repeat a FAQ question variant (exactly or nearly) without the embedding model.
+RAG_VARIANT_INDEX = os.getenv("RAG_VARIANT_INDEX", "1").strip().lower() in {"1", "true", "yes", "on"}
+# "hybrid" fuses BM25 and vector rankings (reciprocal rank fusion); "dense" is vector-only.
+RAG_RETRIEVAL = os.getenv("RAG_RETRIEVAL", "hybrid").strip().lower()
+RAG_RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+# BM25 score at which a chunk is accepted on lexical evidence alone.
+RAG_BM25_MIN_SCORE = float(os.getenv("RAG_BM25_MIN_SCORE", "5.0"))
+# Lexical-only answers skip the encoder when the top BM25 score is high and clearly ahead of the runner-up.
+RAG_LEXICAL_ONLY = os.getenv("RAG_LEXICAL_ONLY", "1").strip().lower() in {"1", "true", "yes", "on"}
+RAG_LEXICAL_MIN_SCORE = float(os.getenv("RAG_LEXICAL_MIN_SCORE", "8.0"))
+RAG_LEXICAL_MARGIN = float(os.getenv("RAG_LEXICAL_MARGIN", "1.6"))
+# Bump when the snapshot layout changes so old snapshots are rebuilt instead of misread.
+SNAPSHOT_VERSION = 1
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+# Vector index; created by load_index() so importing this module stays cheap (Chroma opens a client).
+index = None
+# Identifies the loaded KB (model + chunk hashes); changes whenever the snapshot does.
+kb_version = ""
+# Parsed form of every KB chunk, keyed by the chunk text the index returns.
+records: Dict[str, "FaqRecord"] = {}
+# Normalized FAQ question variants -> chunk text, for the lexical fast path in search().
+questions = retrieval.QuestionIndex()
+# BM25 inverted index over the same chunks as `index`.
+bm25 = retrieval.BM25Index()
+# Moving average of the encode + vector query time a variant hit avoids.
+_embed_path_seconds = 0.0
 
-def load_docs():
-    # Use absolute path relative to this file
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    data_path = os.path.join(base_dir, "../data/faqs.txt")
-    
-    with open(data_path) as f:
+# Embedding backend (EMBED_BACKEND: torch, onnx or onnx-int8); see encoders.py. Loaded by load_model().
+model = None
+# Snapshots and centroids are keyed by this, so switching backends rebuilds them.
+EMBED_MODEL_ID = ""
+# Set once load_index() has the embeddings in place; until then search() answers lexically only.
+dense_ready = False
+# Normalized query text -> (embedding, filtered docs), invalidated when kb_version changes.
+query_cache = cache.LRUCache("rag_query", RAG_CACHE_MAX_BYTES, RAG_CACHE_TTL)
+
+
+def _encode(texts: List[str]) -> np.ndarray:
+    return load_model().encode(texts, batch_size=EMBED_BATCH_SIZE, show_progress_bar=False)
+
+
+# Query encodes run on a worker thread, batched across concurrent requests.
+query_embedder = embedder.BatchingEmbedder(_encode)
+
+
+def read_chunks(path: str = DATA_PATH) -> List[str]:
+    with open(path) as f:
         text = f.read()
+    return text.split("\n\n")
+
+
+def chunk_hash(chunk: str) -> str:
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+
+def _kb_version(hashes: List[str]) -> str:
+    h = hashlib.sha256(f"{SNAPSHOT_VERSION}:{EMBED_MODEL_ID}".encode("utf-8"))
+    for ch in hashes:
+        h.update(ch.encode("ascii"))
+    return h.hexdigest()
+
+
+def kb_answer(context: str) -> str:
+    """Answer lines of a Q/A chunk (everything after "A:" up to the next "Q:"); first lines as a fallback."""
+    lines = (context or "").splitlines()
+    out = []
+    in_a = False
+    for ln in lines:
+        if ln.strip().startswith("A:"):
+            in_a = True
+            continue
+        if in_a and ln.strip().startswith("Q:"):
+            break
+        if in_a:
+            out.append(ln)
+    text = "\n".join([l for l in out if l.strip()]).strip()
+    if text:
+        return text
+    filtered = [ln for ln in lines if not ln.strip().startswith("Q:")]
+    return "\n".join([ln for ln in filtered if ln.strip()][:6]).strip()
+
 
-    # Reset collection to avoid duplicates on reload
+_KEYWORDS_LINE = re.compile(r"(?i)keywords\s*[:\-]\s*(.*)")
+
+
+@dataclass(frozen=True)
+class FaqRecord:
+    """One KB chunk, parsed once at load time."""
+
+    text: str
+    questions: Tuple[str, ...]
+    answer_lines: Tuple[str, ...]
+    keywords: Tuple[str, ...]
+    topics: Tuple[str, ...]
+    # The chunk without its Keywords: line, as it goes into the LLM prompt.
+    context: str
+    # What a KB-only reply sends (see kb_answer).
+    answer: str
+
+
+def parse_chunk(chunk: str) -> FaqRecord:
+    questions, answer_lines, keywords, kept = [], [], [], []
+    in_a = False
+    for ln in chunk.splitlines():
+        s = ln.strip()
+        m = _KEYWORDS_LINE.match(s)
+        if m:
+            keywords += [k.strip().rstrip(".") for k in m.group(1).split(",") if k.strip()]
+            # Only "Keywords:" lines have ever been kept out of the prompt.
+            if s.lower().startswith("keywords:"):
+                continue
+        kept.append(ln)
+        if s.startswith("Q:"):
+            in_a = False
+            questions.append(s[2:].strip())
+        elif s.startswith("A:"):
+            in_a = True
+        elif in_a and s and not m:
+            answer_lines.append(s)
+    context = "\n".join(kept).strip()
+    tags = sorted({topics.classifier.table.classify(q.lower()).topic for q in questions} - {"unknown"})
+    return FaqRecord(
+        text=chunk,
+        questions=tuple(questions),
+        answer_lines=tuple(answer_lines),
+        keywords=tuple(keywords),
+        topics=tuple(tags),
+        context=context,
+        answer=kb_answer(context),
+    )
+
+
+def load_snapshot(index_dir: str = INDEX_DIR) -> Optional[Tuple[Dict, np.ndarray]]:
+    """Return (manifest, embeddings) for a compatible snapshot; embeddings are mmap'd read-only."""
     try:
-        client.delete_collection("support_docs")
-    except Exception:
-        pass
-    global collection
-    collection = client.get_or_create_collection("support_docs")
-
-    chunks = text.split("\n\n")
-    for i, chunk in enumerate(chunks):
-        embedding = model.encode(chunk).tolist()
-        collection.add(
-            documents=[chunk],
-            embeddings=[embedding],
-            ids=[str(i)]
-        )
-
-def search_docs(query, offer_name=None):
-    # Normalize common synonyms/misspellings to improve recall
-    norm = query.lower()
-    if not norm or len(norm.strip()) < 4:
-        return []
-    if re.fullmatch(r"\b(hi|hello|hey|yo|hola)\b", norm.strip()):
-        return []
+        with open(os.path.join(index_dir, "manifest.json")) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != SNAPSHOT_VERSION or manifest.get("model") != EMBED_MODEL_ID:
+            return None
+        emb = np.load(os.path.join(index_dir, manifest["embeddings"]), mmap_mode="r")
+        if emb.shape[0] != len(manifest.get("chunks") or []):
+            return None
+        return manifest, emb
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def build_index(chunks: Optional[List[str]] = None, index_dir: str = INDEX_DIR) -> Dict:
+    """Embed KB chunks in batches and write a versioned snapshot.
+
+    Embeddings of chunks whose content hash is unchanged are copied from the
+    previous snapshot; only new or edited chunks go through the model.
+    """
+    load_model()
+    if chunks is None:
+        chunks = read_chunks()
+    hashes = [chunk_hash(c) for c in chunks]
+    version = _kb_version(hashes)
+
+    reuse: Dict[str, np.ndarray] = {}
+    prev = load_snapshot(index_dir)
+    if prev:
+        prev_manifest, prev_emb = prev
+        if prev_manifest.get("kb_version") == version:
+            return prev_manifest
+        for row, entry in enumerate(prev_manifest["chunks"]):
+            reuse[entry["hash"]] = prev_emb[row]
+
+    todo = [i for i, h in enumerate(hashes) if h not in reuse]
+    fresh = {}
+    if todo:
+        encoded = _encode([chunks[i] for i in todo])
+        fresh = dict(zip(todo, encoded))
+    rows = [fresh[i] if i in fresh else reuse[h] for i, h in enumerate(hashes)]
+    emb = np.asarray(rows, dtype=np.float32).reshape(len(chunks), -1)
+    norms = np.linalg.norm(emb, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    emb = emb / norms
+
+    # Write the versioned embeddings file first, then atomically swap the manifest that points at it,
+    # so a concurrent reader (another worker starting up) never sees a half-written snapshot.
+    os.makedirs(index_dir, exist_ok=True)
+    emb_name = f"embeddings-{version[:16]}.npy"
+    tmp = os.path.join(index_dir, f".{emb_name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, emb)
+    os.replace(tmp, os.path.join(index_dir, emb_name))
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "model": EMBED_MODEL_ID,
+        "kb_version": version,
+        "dim": int(emb.shape[1]) if emb.ndim == 2 else 0,
+        "embeddings": emb_name,
+        "reembedded": len(todo),
+        "chunks": [{"hash": h, "text": c} for h, c in zip(hashes, chunks)],
+    }
+    tmp = os.path.join(index_dir, f".manifest.json.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp, os.path.join(index_dir, "manifest.json"))
+    for name in os.listdir(index_dir):
+        if name.startswith("embeddings-") and name.endswith(".npy") and name != emb_name:
+            try:
+                os.remove(os.path.join(index_dir, name))
+            except OSError:
+                pass
+    print(f"KB snapshot {version[:12]} written: {len(chunks)} chunks, {len(todo)} re-embedded")
+    return manifest
+
+
+def load_model():
+    """Load the embedding backend once; later calls return it."""
+    global model, EMBED_MODEL_ID
+    if model is None:
+        enc = encoders.make_encoder(EMBED_MODEL)
+        EMBED_MODEL_ID = enc.model_id
+        model = enc
+    return model
+
+
+def load_lexical(texts: Optional[List[str]] = None):
+    """Parse the KB and build the variant and BM25 indexes; needs no model.
+
+    Fresh indexes are built and then swapped in, since this may run on a loader
+    thread while search() reads the current ones.
+    """
+    global records, questions, bm25
+    if texts is None:
+        texts = read_chunks()
+    parsed = {t: parse_chunk(t) for t in texts}
+    variants = retrieval.QuestionIndex()
+    variants.set((q, r.text) for r in parsed.values() for q in r.questions)
+    lexical = retrieval.BM25Index()
+    lexical.set(texts)
+    records, questions, bm25 = parsed, variants, lexical
+
+
+def load_index():
+    """Load (building if stale) the embedding snapshot into the vector index, then the topic centroids."""
+    global kb_version, index, dense_ready
+    load_model()
+    chunks = read_chunks()
+    hashes = [chunk_hash(c) for c in chunks]
+    snap = load_snapshot()
+    if snap is None or [e["hash"] for e in snap[0]["chunks"]] != hashes:
+        build_index(chunks)
+        snap = load_snapshot()
+    if snap is None:
+        raise RuntimeError(f"Could not load KB snapshot from {INDEX_DIR}")
+    manifest, emb = snap
+
+    if index is None:
+        index = retrieval.make_index()
+    # Replace index contents wholesale to avoid duplicates on reload
+    texts = [e["text"] for e in manifest["chunks"]]
+    index.set(texts, emb)
+    load_lexical(texts)
+    kb_version = manifest["kb_version"]
+    query_cache.bind_version(kb_version)
+    topics.centroids.load(_encode, INDEX_DIR, EMBED_MODEL_ID)
+    dense_ready = True
+
+
+def load_docs():
+    load_lexical()
+    load_index()
+
+
+@dataclass
+class Retrieval:
+    docs: List[str]
+    # Embedding of the normalized query; None when the query never reached the encoder.
+    embedding: Optional[np.ndarray] = None
+    records: List[FaqRecord] = field(default_factory=list)
+    # Set when the message matched a FAQ question variant and never reached the encoder.
+    variant: bool = False
+
+    @property
+    def topic_hint(self) -> Optional[str]:
+        """The matched FAQ's topic, when a variant match maps to exactly one."""
+        if self.variant and self.records and len(self.records[0].topics) == 1:
+            return self.records[0].topics[0]
+        return None
+
+    @property
+    def context(self) -> str:
+        """Prompt context: the top two records, already cleaned."""
+        return "\n\n".join(r.context for r in self.records[:2])
+
+    @property
+    def kb_answer(self) -> str:
+        for r in self.records[:2]:
+            if r.answer:
+                return r.answer
+        return kb_answer(self.context)
+
+
+def _retrieval(docs, embedding=None) -> Retrieval:
+    return Retrieval(list(docs), embedding, [records.get(d) or parse_chunk(d) for d in docs])
+
+
+async def search_docs(query, offer_name=None):
+    return (await search(query)).docs
+
+
+async def search(query) -> Retrieval:
+    """Retrieve KB chunks for a str or message.NormalizedMessage."""
+    global _embed_path_seconds
+    msg = normalize(query)
+    if not msg.lower or len(msg.lower.strip()) < 4:
+        return Retrieval([])
+    if re.fullmatch(r"\b(hi|hello|hey|yo|hola)\b", msg.lower.strip()):
+        return Retrieval([])
+    if RAG_VARIANT_INDEX and len(questions):
+        match = questions.lookup(msg.lower)
+        observability.RAG_VARIANT_LOOKUPS.labels("miss" if match is None else "exact" if match[1] >= 1.0 else "near").inc()
+        if match is not None:
+            observability.RAG_VARIANT_SECONDS_SAVED.inc(_embed_path_seconds)
+            observability.RAG_RETRIEVAL_PATH.labels("variant").inc()
+            hit = _retrieval([match[0]])
+            hit.variant = True
+            return hit
     # Common offer-support keywords to relax matching
     support_keywords = [
         "reward", "rewards", "wallet", "coin", "payout", "withdraw", "withdrawal",
         "verification", "pending", "completed", "expired", "status", "offer", "credit"
     ]
-    replacements = {
-        "payout": "withdrawal",
-        "cashout": "withdrawal",
-        "cash out": "withdrawal",
-        "upi payout": "upi withdrawal",
-        "payment": "withdrawal",
-        "money": "withdrawal",
-        "cash": "withdrawal",
-        "did not get my money": "withdrawal not received",
-        "didn't get my money": "withdrawal not received",
-        "not get my money": "withdrawal not received",
-        "not credited": "not received",
-        "referal": "referral",
-        "referrel": "referral",
-        "giftcard": "gift card",
-        "gift voucher": "gift card",
-    }
-    for k, v in replacements.items():
-        norm = norm.replace(k, v)
+    # Normalize common synonyms/misspellings to improve recall
+    norm = msg.rewritten
     search_text = norm
-    embedding = model.encode(search_text).tolist()
+    query_cache.bind_version(kb_version)
+    cached = query_cache.get(search_text)
+    if cached is not None:
+        observability.RAG_RETRIEVAL_PATH.labels("cache").inc()
+        return _retrieval(cached[1], cached[0])
+    if not dense_ready:
+        # Still starting up: answer from BM25 alone, without caching the result.
+        lex_docs, lex_scores = bm25.query(search_text, n_results=1)
+        observability.RAG_RETRIEVAL_PATH.labels("warming").inc()
+        return _retrieval(lex_docs if lex_scores and lex_scores[0] >= RAG_BM25_MIN_SCORE else [])
+    hybrid = RAG_RETRIEVAL == "hybrid" and len(bm25) > 0
+    lex_docs, lex_scores = bm25.query(search_text, n_results=5) if hybrid else ([], [])
+    if hybrid and RAG_LEXICAL_ONLY and lex_scores and lex_scores[0] >= RAG_LEXICAL_MIN_SCORE and (
+        len(lex_scores) == 1 or lex_scores[0] >= RAG_LEXICAL_MARGIN * lex_scores[1]
+    ):
+        observability.RAG_RETRIEVAL_PATH.labels("lexical").inc()
+        return _retrieval(lex_docs[:1])
     try:
-        results = collection.query(
-            query_embeddings=[embedding],
-            n_results=5,
-            include=["documents", "distances"]
-        )
-        docs = results.get("documents", [[]])[0] or []
-        dists = results.get("distances", [[]])[0] or [None] * len(docs)
+        start = time.perf_counter()
+        embedding = await query_embedder.encode(search_text)
+        docs, dists = index.query(embedding, n_results=5)
+        took = time.perf_counter() - start
+        _embed_path_seconds = took if not _embed_path_seconds else 0.9 * _embed_path_seconds + 0.1 * took
         # Dynamic threshold: relax for longer queries or known keywords
         has_keywords = any(k in norm for k in support_keywords)
         threshold = 0.25
         if len(norm) >= 12 or has_keywords:
             threshold = 0.45
         filtered = [doc for doc, dist in zip(docs, dists) if dist is None or dist <= threshold]
+        ranked = docs
+        if hybrid and lex_docs:
+            # A chunk qualifies on either signal; qualifying chunks are ordered by fused rank.
+            accepted = set(filtered) | {d for d, sc in zip(lex_docs, lex_scores) if sc >= RAG_BM25_MIN_SCORE}
+            ranked = retrieval.reciprocal_rank_fusion([docs, lex_docs], RAG_RRF_K)
+            filtered = [d for d in ranked if d in accepted]
+        observability.RAG_RETRIEVAL_PATH.labels("hybrid" if hybrid else "dense").inc()
         # Controlled fallback: only for sufficiently informative queries
-        if not filtered and docs and (len(norm) >= 12 or has_keywords):
-            filtered = [docs[0]]
-        return filtered[:1]
+        if not filtered and ranked and (len(norm) >= 12 or has_keywords):
+            filtered = [ranked[0]]
+        result = filtered[:1]
+        embedding = np.array(embedding, dtype=np.float32)
+        query_cache.put(search_text, (embedding, tuple(result)))
+        return _retrieval(result, embedding)
     except Exception:
         # Fallback: return empty to trigger graceful handling
-        return []
+        return Retrieval([])
+
+
+if __name__ == "__main__":
+    m = build_index()
+    print(json.dumps({k: v for k, v in m.items() if k != "chunks"}, indent=2))
@@ -0,0 +1,370 @@
+"""Shared rate-limit state for several uvicorn workers or backend nodes.
+
+Every store speaks one protocol: check_many(ops) takes a batch of
+(key, max_requests, window_seconds) and atomically applies a GCRA check to each,
+returning one "limited" flag per op. Backends:
+
+- LocalStore: a dict in this process (also what the network server runs).
+- SharedMemoryStore: a fixed hash table in POSIX shared memory, guarded by flock,
+  shared by every worker on the host.
+- NetworkStore: one pipelined TCP connection to `python ratelimit_store.py`, with
+  concurrent checks from the same loop tick folded into a single frame.
+
+Run a stand-in server with: python ratelimit_store.py --host 127.0.0.1 --port 7390
+"""
+import argparse
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+import observability
+
+# "local" (default), "shm", or "tcp://host:port".
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "local").strip()
+RATE_LIMIT_STORE_TIMEOUT = float(os.getenv("RATE_LIMIT_STORE_TIMEOUT", "0.05"))
+# After a failure, skip the remote store for this long and use the local limiter.
+RATE_LIMIT_STORE_RETRY = float(os.getenv("RATE_LIMIT_STORE_RETRY", "5"))
+RATE_LIMIT_SHM_NAME = os.getenv("RATE_LIMIT_SHM_NAME", "support_chatbot_ratelimit")
+RATE_LIMIT_SHM_SLOTS = int(os.getenv("RATE_LIMIT_SHM_SLOTS", "65536"))
+
+Op = Tuple[str, int, float]
+
+
+class StoreUnavailable(Exception):
+    """The shared store could not answer in time; callers fall back to local limiting."""
+
+
+def gcra(tat: Optional[float], max_requests: int, window: float, now: float) -> Tuple[bool, float]:
+    """One GCRA step: return (limited, new theoretical arrival time)."""
+    interval = window / max(1, max_requests)
+    if tat is None or tat < now:
+        tat = now
+    if tat - now > window - interval:
+        return True, tat
+    return False, tat + interval
+
+
+class LocalStore:
+    name = "local"
+
+    def __init__(self):
+        self.table: Dict[str, float] = {}
+
+    def check_now(self, ops: Sequence[Op], now: Optional[float] = None) -> List[bool]:
+        now = time.monotonic() if now is None else now
+        out = []
+        for key, max_requests, window in ops:
+            limited, tat = gcra(self.table.get(key), max_requests, window, now)
+            if not limited:
+                self.table[key] = tat
+            out.append(limited)
+        return out
+
+    async def check_many(self, ops: Sequence[Op]) -> List[bool]:
+        return self.check_now(ops)
+
+    def after_fork(self):
+        pass
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        now = time.monotonic() if now is None else now
+        idle = [k for k, tat in self.table.items() if tat <= now]
+        for k in idle:
+            del self.table[k]
+        return len(idle)
+
+    async def close(self):
+        pass
+
+
+class SharedMemoryStore:
+    """Open-addressing table of (key hash, TAT) slots in a shared memory segment.
+
+    The first worker creates the segment and later ones attach. Slots whose TAT
+    has passed are reused in place, so the table never needs a separate sweep.
+    CLOCK_MONOTONIC is system-wide on Linux, so all workers agree on "now".
+
+    flock locks belong to the open file description, so a forked worker must
+    call after_fork() to get a lock fd of its own (serve.py does).
+    """
+
+    name = "shm"
+    PROBES = 32
+
+    def __init__(self, name: str = RATE_LIMIT_SHM_NAME, slots: int = RATE_LIMIT_SHM_SLOTS):
+        self.shm_name = name
+        self.slots = max(1024, slots)
+        self._attach(create=True)
+
+    def _attach(self, create: bool):
+        from multiprocessing import resource_tracker, shared_memory
+
+        size = self.slots * 16
+        try:
+            if not create:
+                raise FileExistsError
+            self.shm = shared_memory.SharedMemory(name=self.shm_name, create=True, size=size)
+        except FileExistsError:
+            self.shm = shared_memory.SharedMemory(name=self.shm_name)
+        # The segment outlives any single worker; stop the resource tracker from unlinking it.
+        try:
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        except Exception:
+            pass
+        self.keys = self.shm.buf[: self.slots * 8].cast("Q")
+        self.tats = self.shm.buf[self.slots * 8: self.slots * 16].cast("d")
+        self._lock_fd = os.open(os.path.join(tempfile.gettempdir(), f"{self.shm_name}.lock"), os.O_CREAT | os.O_RDWR, 0o600)
+        self._pid = os.getpid()
+
+    def after_fork(self):
+        """Drop the parent's lock fd and mapping and attach afresh in this process."""
+        if self._pid == os.getpid():
+            return
+        self.keys.release()
+        self.tats.release()
+        self.shm.close()
+        os.close(self._lock_fd)
+        self._attach(create=False)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        h = struct.unpack("<Q", hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest())[0]
+        return h or 1
+
+    def _check_one(self, key: str, max_requests: int, window: float, now: float) -> bool:
+        h = self._hash(key)
+        keys, tats, n = self.keys, self.tats, self.slots
+        free = -1
+        oldest = -1
+        i = h % n
+        for _ in range(self.PROBES):
+            k = keys[i]
+            if k == h:
+                limited, tat = gcra(tats[i], max_requests, window, now)
+                if not limited:
+                    tats[i] = tat
+                return limited
+            if k == 0:
+                if free < 0:
+                    free = i
+                break
+            if tats[i] <= now and free < 0:
+                free = i
+            if oldest < 0 or tats[i] < tats[oldest]:
+                oldest = i
+            i = (i + 1) % n
+        slot = free if free >= 0 else oldest
+        limited, tat = gcra(None, max_requests, window, now)
+        keys[slot] = h
+        tats[slot] = tat
+        return limited
+
+    def check_now(self, ops: Sequence[Op]) -> List[bool]:
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            now = time.monotonic()
+            return [self._check_one(key, m, w, now) for key, m, w in ops]
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    async def check_many(self, ops: Sequence[Op]) -> List[bool]:
+        start = time.perf_counter()
+        out = self.check_now(ops)
+        observability.RATE_LIMIT_STORE_RTT.labels(self.name).observe(time.perf_counter() - start)
+        return out
+
+    async def close(self):
+        self.keys.release()
+        self.tats.release()
+        self.shm.close()
+        os.close(self._lock_fd)
+
+
+class NetworkStore:
+    """Client for the TCP rate-limit server.
+
+    Frames are JSON lines: {"ops": [[key, max, window], ...]} answered in order by
+    {"limited": [...]}. Several frames may be in flight on the one connection.
+    """
+
+    name = "tcp"
+
+    def __init__(self, host: str, port: int, timeout: float = RATE_LIMIT_STORE_TIMEOUT, retry_after: float = RATE_LIMIT_STORE_RETRY):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._read_task: Optional[asyncio.Task] = None
+        self._inflight: Deque[asyncio.Future] = deque()
+        self._batch: List[Tuple[Op, asyncio.Future]] = []
+        self._down_until = 0.0
+        self._connecting: Optional[asyncio.Future] = None
+
+    async def _connect(self):
+        if self._writer is not None and not self._writer.is_closing():
+            return
+        if self._connecting is not None:
+            await asyncio.shield(self._connecting)
+            return
+        self._connecting = asyncio.get_running_loop().create_future()
+        try:
+            self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+            self._read_task = asyncio.create_task(self._read_loop())
+            self._connecting.set_result(None)
+        except BaseException as e:
+            self._connecting.set_exception(StoreUnavailable(str(e) or type(e).__name__))
+            self._connecting.exception()
+            raise
+        finally:
+            self._connecting = None
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    raise ConnectionError("rate-limit store closed the connection")
+                reply = json.loads(line)
+                fut = self._inflight.popleft()
+                if not fut.done():
+                    # _flush checks the shape; an {"error": ...} reply fails it there.
+                    fut.set_result(reply.get("limited") if isinstance(reply, dict) else reply)
+        except Exception as e:
+            self._fail(e)
+
+    def _fail(self, error: BaseException):
+        self._down_until = time.monotonic() + self.retry_after
+        while self._inflight:
+            fut = self._inflight.popleft()
+            if not fut.done():
+                fut.set_exception(StoreUnavailable(str(error) or type(error).__name__))
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = None
+        self._reader = None
+
+    async def _flush(self):
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        futures = [f for _, f in batch]
+        try:
+            await self._connect()
+            frame = asyncio.get_running_loop().create_future()
+            self._inflight.append(frame)
+            payload = json.dumps({"ops": [list(op) for op, _ in batch]}, separators=(",", ":"))
+            self._writer.write(payload.encode("utf-8") + b"\n")
+            limited = await asyncio.wait_for(asyncio.shield(frame), self.timeout)
+            if not isinstance(limited, list) or len(limited) != len(futures):
+                raise StoreUnavailable("malformed rate-limit store reply: %.100r" % (limited,))
+            for fut, flag in zip(futures, limited):
+                if not fut.done():
+                    fut.set_result(bool(flag))
+        except Exception as e:
+            if isinstance(e, (asyncio.TimeoutError, StoreUnavailable)):
+                # Replies are matched by order, so a missing or malformed one poisons the connection.
+                self._fail(e)
+            self._down_until = time.monotonic() + self.retry_after
+            for fut in futures:
+                if not fut.done():
+                    fut.set_exception(e if isinstance(e, StoreUnavailable) else StoreUnavailable(str(e) or type(e).__name__))
+
+    def after_fork(self):
+        """Forget any connection inherited from the parent; the next check reconnects."""
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._inflight.clear()
+        self._batch = []
+        self._connecting = None
+
+    async def check_many(self, ops: Sequence[Op]) -> List[bool]:
+        if time.monotonic() < self._down_until:
+            raise StoreUnavailable("rate-limit store marked down")
+        loop = asyncio.get_running_loop()
+        futures = []
+        for op in ops:
+            fut = loop.create_future()
+            self._batch.append((op, fut))
+            futures.append(fut)
+        if len(self._batch) == len(ops):
+            # First caller this tick schedules the flush; later callers ride along in the same frame.
+            loop.call_soon(lambda: asyncio.ensure_future(self._flush()))
+        start = time.perf_counter()
+        out = list(await asyncio.gather(*futures))
+        observability.RATE_LIMIT_STORE_RTT.labels(self.name).observe(time.perf_counter() - start)
+        return out
+
+    async def close(self):
+        if self._read_task:
+            self._read_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = None
+
+
+def make_store(spec: str = ""):
+    """Build the configured shared store, or None for plain in-process limiting."""
+    spec = (spec or RATE_LIMIT_STORE).strip()
+    if not spec or spec == "local":
+        return None
+    if spec == "shm":
+        return SharedMemoryStore()
+    if spec.startswith("tcp://"):
+        host, _, port = spec[len("tcp://"):].rpartition(":")
+        return NetworkStore(host or "127.0.0.1", int(port))
+    raise ValueError(f"Unknown RATE_LIMIT_STORE: {spec}")
+
+
+async def serve(host: str = "127.0.0.1", port: int = 7390, sweep_interval: float = 10.0):
+    """Run the TCP store; each frame is applied atomically because the loop is single-threaded."""
+    store = LocalStore()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    ops = [(str(k), int(m), float(w)) for k, m, w in json.loads(line)["ops"]]
+                    reply = {"limited": store.check_now(ops)}
+                except (ValueError, KeyError, TypeError) as e:
+                    reply = {"limited": [], "error": str(e)}
+                writer.write(json.dumps(reply, separators=(",", ":")).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def sweeper():
+        while True:
+            await asyncio.sleep(sweep_interval)
+            store.sweep()
+
+    server = await asyncio.start_server(handle, host, port)
+    sweep_task = asyncio.create_task(sweeper())
+    print(f"rate-limit store listening on {host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        sweep_task.cancel()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=7390)
+    args = ap.parse_args()
+    asyncio.run(serve(args.host, args.port))
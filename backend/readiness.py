@@ -0,0 +1,70 @@
+"""Load state of the components the server brings up after it starts listening.
+
+The embedding model and KB index load on a worker thread in the background
+(see main.startup_event); /healthz and /readyz report each component's state
+and timing from here, and process_chat checks ready() to decide whether the
+model-backed path is available yet.
+"""
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+import observability
+
+
+@dataclass
+class Component:
+    name: str
+    state: str = "pending"  # pending -> loading -> ready | failed
+    started_at: Optional[float] = None
+    seconds: Optional[float] = None
+    error: str = ""
+
+    def as_dict(self) -> Dict:
+        return {"state": self.state, "seconds": None if self.seconds is None else round(self.seconds, 3), "error": self.error or None}
+
+
+class Readiness:
+    def __init__(self):
+        self.started = time.time()
+        self.components: Dict[str, Component] = {}
+
+    def register(self, *names: str) -> None:
+        for name in names:
+            self.components.setdefault(name, Component(name))
+            observability.STARTUP_COMPONENT_READY.labels(name).set(0)
+
+    async def run(self, name: str, load: Callable[[], object]) -> bool:
+        """Run a blocking loader off the event loop and record how it went; never raises."""
+        comp = self.components.setdefault(name, Component(name))
+        comp.state, comp.started_at, comp.error = "loading", time.perf_counter(), ""
+        try:
+            await asyncio.to_thread(load)
+        except Exception as e:
+            comp.state, comp.error = "failed", f"{type(e).__name__}: {e}"
+            print(f"Startup: {name} failed after {time.perf_counter() - comp.started_at:.1f}s: {comp.error}")
+            return False
+        finally:
+            comp.seconds = time.perf_counter() - comp.started_at
+            observability.STARTUP_COMPONENT_SECONDS.labels(name).set(comp.seconds)
+        comp.state = "ready"
+        observability.STARTUP_COMPONENT_READY.labels(name).set(1)
+        print(f"Startup: {name} ready in {comp.seconds:.2f}s")
+        return True
+
+    def ready(self, name: Optional[str] = None) -> bool:
+        if name is not None:
+            comp = self.components.get(name)
+            return comp is not None and comp.state == "ready"
+        return all(c.state == "ready" for c in self.components.values())
+
+    def report(self) -> Dict:
+        return {
+            "ready": self.ready(),
+            "uptime_s": round(time.time() - self.started, 1),
+            "components": {name: c.as_dict() for name, c in self.components.items()},
+        }
+
+
+readiness = Readiness()
@@ -0,0 +1,283 @@
+import math
+import os
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+# Which vector store answers rag.search_docs queries: "numpy" (default) or "chroma".
+RAG_BACKEND = os.getenv("RAG_BACKEND", "numpy").strip().lower()
+# Storage dtype of the in-process matrix; float16 halves memory at a small precision cost.
+RAG_MATRIX_DTYPE = os.getenv("RAG_MATRIX_DTYPE", "float32").strip().lower()
+# Trigram Jaccard similarity a message needs to a FAQ question variant to count as a near-exact match.
+RAG_VARIANT_MIN_SIMILARITY = float(os.getenv("RAG_VARIANT_MIN_SIMILARITY", "0.8"))
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_WORD = re.compile(r"\w+")
+# Function words that only add noise to BM25 on short support questions.
+_STOPWORDS = frozenset(
+    "a an and are am be but by can do does for from have how i if in is it its me my of on or so "
+    "that the this to was what when where which why will with you your".split()
+)
+
+
+def _unit_rows(emb: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(emb, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return emb / norms
+
+
+class NumpyIndex:
+    """Brute-force index over one contiguous matrix of unit-norm chunk embeddings.
+
+    Distances are squared L2 between unit vectors (2 - 2 * cosine), the same
+    scale Chroma's default "l2" space reports, so thresholds carry over as-is.
+    """
+
+    name = "numpy"
+
+    def __init__(self, dtype: str = "float32"):
+        self.dtype = np.dtype(dtype)
+        self.docs: List[str] = []
+        self.matrix = np.zeros((0, 0), dtype=self.dtype)
+
+    def reset(self):
+        self.docs = []
+        self.matrix = np.zeros((0, 0), dtype=self.dtype)
+
+    def set(self, docs: Sequence[str], matrix) -> None:
+        """Adopt a prebuilt unit-norm matrix; a float32 mmap'd snapshot is used without copying."""
+        if not isinstance(matrix, np.ndarray) or matrix.dtype != self.dtype or not matrix.flags.c_contiguous:
+            matrix = np.ascontiguousarray(matrix, dtype=self.dtype)
+        self.matrix = matrix
+        self.docs = list(docs)
+
+    def add(self, docs: Sequence[str], embeddings) -> None:
+        emb = _unit_rows(np.atleast_2d(np.asarray(embeddings, dtype=np.float32)))
+        if self.matrix.size:
+            emb = np.vstack([self.matrix.astype(np.float32), emb])
+        self.matrix = np.ascontiguousarray(emb, dtype=self.dtype)
+        self.docs.extend(docs)
+
+    def query(self, embedding, n_results: int = 5) -> Tuple[List[str], List[float]]:
+        n = len(self.docs)
+        if n == 0:
+            return [], []
+        q = _unit_rows(np.asarray(embedding, dtype=np.float32).reshape(-1))
+        sims = (self.matrix @ q.astype(self.dtype)).astype(np.float32)
+        k = min(n_results, n)
+        if k < n:
+            top = np.argpartition(-sims, k - 1)[:k]
+        else:
+            top = np.arange(n)
+        top = top[np.argsort(-sims[top], kind="stable")]
+        dists = 2.0 - 2.0 * sims[top]
+        return [self.docs[i] for i in top], [float(d) for d in dists]
+
+    def __len__(self):
+        return len(self.docs)
+
+
+class ChromaIndex:
+    """In-memory Chroma collection; kept as an optional backend."""
+
+    name = "chroma"
+
+    def __init__(self, collection_name: str = "support_docs"):
+        import chromadb
+
+        self.collection_name = collection_name
+        self.client = chromadb.Client()
+        self.collection = self.client.get_or_create_collection(collection_name)
+
+    def reset(self):
+        try:
+            self.client.delete_collection(self.collection_name)
+        except Exception:
+            pass
+        self.collection = self.client.get_or_create_collection(self.collection_name)
+
+    def set(self, docs: Sequence[str], matrix) -> None:
+        self.reset()
+        self.add(docs, matrix)
+
+    def add(self, docs: Sequence[str], embeddings) -> None:
+        start = self.collection.count()
+        self.collection.add(
+            documents=list(docs),
+            embeddings=[np.asarray(e, dtype=np.float32).tolist() for e in embeddings],
+            ids=[str(start + i) for i in range(len(docs))],
+        )
+
+    def query(self, embedding, n_results: int = 5) -> Tuple[List[str], List[float]]:
+        results = self.collection.query(
+            query_embeddings=[np.asarray(embedding, dtype=np.float32).tolist()],
+            n_results=n_results,
+            include=["documents", "distances"],
+        )
+        docs = results.get("documents", [[]])[0] or []
+        dists = results.get("distances", [[]])[0] or [None] * len(docs)
+        return docs, dists
+
+    def __len__(self):
+        return self.collection.count()
+
+
+def normalize_question(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace."""
+    return " ".join(_NON_WORD.sub(" ", (text or "").lower()).split())
+
+
+# Words that flip a question's meaning ("received" vs "not received"); contractions arrive as "didn t".
+_NEGATIONS = frozenset({
+    "not", "no", "never", "nothing", "none", "nor", "cannot", "cant", "dont", "didnt", "doesnt",
+    "isnt", "wasnt", "havent", "hasnt", "wont", "nahi", "nahin", "nhi", "nai", "mat", "bina",
+})
+
+
+def is_negated(normalized: str) -> bool:
+    """True when a normalized question contains a negation word or an n't contraction."""
+    words = normalized.split()
+    return any(w in _NEGATIONS or (w.endswith("n") and nxt == "t") for w, nxt in zip(words, words[1:] + [""]))
+
+
+def _trigrams(text: str) -> Set[str]:
+    t = f"  {text} "
+    return {t[i:i + 3] for i in range(len(t) - 2)}
+
+
+class QuestionIndex:
+    """Lexical lookup of FAQ question variants, answered without the embedding model.
+
+    Exact matches on the normalized question are a dict read. Near matches
+    (typos, a dropped word) go through character-trigram postings and are
+    accepted when the Jaccard similarity reaches `min_similarity`, the query and
+    the variant agree on negation (dropping "not" barely moves the trigram score
+    but flips the answer), and the best doc is unambiguous.
+    """
+
+    def __init__(self, min_similarity: float = RAG_VARIANT_MIN_SIMILARITY):
+        self.min_similarity = min_similarity
+        self.exact: Dict[str, Optional[str]] = {}
+        self._grams: List[Set[str]] = []
+        self._docs: List[str] = []
+        self._negated: List[bool] = []
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+
+    def set(self, pairs: Iterable[Tuple[str, str]]) -> None:
+        """Index (question, doc) pairs; a question shared by two docs is never matched exactly."""
+        self.exact = {}
+        self._grams, self._docs, self._negated = [], [], []
+        self._postings = defaultdict(list)
+        for question, doc in pairs:
+            q = normalize_question(question)
+            if not q:
+                continue
+            if q in self.exact:
+                if self.exact[q] != doc:
+                    self.exact[q] = None
+                continue
+            self.exact[q] = doc
+            grams = _trigrams(q)
+            row = len(self._docs)
+            self._grams.append(grams)
+            self._docs.append(doc)
+            self._negated.append(is_negated(q))
+            for g in grams:
+                self._postings[g].append(row)
+
+    def lookup(self, text: str) -> Optional[Tuple[str, float]]:
+        """Return (doc, similarity) for an exact (1.0) or near-exact variant match, else None."""
+        q = normalize_question(text)
+        if not q:
+            return None
+        if q in self.exact:
+            doc = self.exact[q]
+            return (doc, 1.0) if doc is not None else None
+        grams = _trigrams(q)
+        negated = is_negated(q)
+        overlap: Dict[int, int] = defaultdict(int)
+        for g in grams:
+            for row in self._postings.get(g, ()):
+                overlap[row] += 1
+        best: Dict[str, float] = {}
+        for row, inter in overlap.items():
+            if self._negated[row] != negated:
+                continue
+            score = inter / (len(grams) + len(self._grams[row]) - inter)
+            if score >= self.min_similarity and score > best.get(self._docs[row], 0.0):
+                best[self._docs[row]] = score
+        if len(best) != 1:
+            return None
+        return next(iter(best.items()))
+
+    def __len__(self):
+        return len(self._docs)
+
+
+def bm25_tokens(text: str) -> List[str]:
+    return [t for t in _WORD.findall((text or "").lower()) if t not in _STOPWORDS]
+
+
+class BM25Index:
+    """Inverted index with Okapi BM25 scoring over the KB chunks."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs: List[str] = []
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._idf: Dict[str, float] = {}
+        self._norm: List[float] = []
+
+    def set(self, docs: Sequence[str]) -> None:
+        self.docs = list(docs)
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        lengths = []
+        for i, doc in enumerate(self.docs):
+            tokens = bm25_tokens(doc)
+            lengths.append(len(tokens))
+            counts: Dict[str, int] = defaultdict(int)
+            for t in tokens:
+                counts[t] += 1
+            for t, tf in counts.items():
+                postings[t].append((i, tf))
+        n = len(self.docs)
+        avg = (sum(lengths) / n) if n else 1.0
+        self._postings = dict(postings)
+        self._idf = {t: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for t, p in postings.items()}
+        # Per-doc length normalization term of the BM25 denominator, precomputed.
+        self._norm = [self.k1 * (1 - self.b + self.b * length / (avg or 1.0)) for length in lengths]
+
+    def query(self, text: str, n_results: int = 5) -> Tuple[List[str], List[float]]:
+        scores: Dict[int, float] = defaultdict(float)
+        for t in set(bm25_tokens(text)):
+            idf = self._idf.get(t)
+            if idf is None:
+                continue
+            for i, tf in self._postings[t]:
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + self._norm[i])
+        top = sorted(scores.items(), key=lambda kv: -kv[1])[:n_results]
+        return [self.docs[i] for i, _ in top], [s for _, s in top]
+
+    def __len__(self):
+        return len(self.docs)
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[str]], k: int = 60) -> List[str]:
+    """Merge ranked doc lists by summing 1 / (k + rank); ties keep first-seen order."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            scores[doc] = scores.get(doc, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda d: -scores[d])
+
+
+def make_index(backend: str = ""):
+    backend = (backend or RAG_BACKEND).strip().lower()
+    if backend == "chroma":
+        return ChromaIndex()
+    if backend == "numpy":
+        return NumpyIndex(dtype=RAG_MATRIX_DTYPE)
+    raise ValueError(f"Unknown RAG_BACKEND: {backend}")
@@ -0,0 +1,203 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import observability
+
+# At most this many generations talk to Ollama at once; the rest wait in the priority queue.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+# Longest a request of each priority may wait for a slot before it is served from the KB instead.
+LLM_QUEUE_BUDGETS = {
+    "HIGH": float(os.getenv("LLM_QUEUE_BUDGET_HIGH", "30")),
+    "MEDIUM": float(os.getenv("LLM_QUEUE_BUDGET_MEDIUM", "15")),
+    "LOW": float(os.getenv("LLM_QUEUE_BUDGET_LOW", "5")),
+}
+
+PRIORITY_RANK = {"HIGH": 0, "MEDIUM": 1, "LOW": 2}
+
+
+class QueueShed(Exception):
+    """Raised when a request should skip the LLM rather than wait for a slot."""
+
+    def __init__(self, priority: str, reason: str):
+        super().__init__(f"{priority} request shed: {reason}")
+        self.priority = priority
+        self.reason = reason
+
+
+class Slot:
+    """A granted LLM slot; releases itself when the `async with` block exits."""
+
+    def __init__(self, scheduler: "LLMScheduler"):
+        self._scheduler = scheduler
+        self._started = time.monotonic()
+        self._released = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+        return False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._scheduler._release(time.monotonic() - self._started)
+
+
+class Ticket:
+    """A request's place in the admission queue.
+
+    promote() raises it to a more urgent priority or an earlier deadline (a
+    coalesced joiner's), re-keying it in the heap and extending how long it may
+    wait to the new priority's budget. A ticket that is not queued yet keeps the
+    raised values for when it is.
+    """
+
+    def __init__(self, priority_level: str = "LOW", deadline: Optional[datetime] = None):
+        self.priority_level = priority_level if priority_level in PRIORITY_RANK else "LOW"
+        self.deadline = deadline
+        self.key: Optional[tuple] = None
+        self.fut: Optional[asyncio.Future] = None
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self._scheduler: Optional["LLMScheduler"] = None
+
+    def queued(self) -> bool:
+        return self.fut is not None and not self.fut.done()
+
+    def promote(self, priority_level: str, deadline: Optional[datetime] = None):
+        priority_level = priority_level if priority_level in PRIORITY_RANK else "LOW"
+        if self._scheduler is not None and self.queued():
+            self._scheduler._promote(self, priority_level, deadline)
+        elif self.fut is None:
+            rank, new_rank = PRIORITY_RANK[self.priority_level], PRIORITY_RANK[priority_level]
+            if new_rank < rank or new_rank == rank and _earlier(deadline, self.deadline):
+                self.priority_level, self.deadline = priority_level, deadline
+
+
+def _earlier(a: Optional[datetime], b: Optional[datetime]) -> bool:
+    return a is not None and (b is None or a < b)
+
+
+class LLMScheduler:
+    """Bounded admission queue in front of the LLM.
+
+    Waiters are ordered by priority rank, then SLA first-response deadline
+    (earliest first), then arrival. A request is shed up front when the queue
+    is full or its predicted wait runs past its SLA deadline (past its
+    priority's budget if it has none), and later if it is still queued when
+    the budget runs out.
+    """
+
+    def __init__(self, concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE, budgets: Optional[Dict[str, float]] = None):
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max(0, max_queue)
+        self.budgets = dict(budgets or LLM_QUEUE_BUDGETS)
+        self.active = 0
+        # Entries are (rank, due, seq, ticket); an entry whose key is no longer its ticket's is stale.
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._waiting = {p: 0 for p in PRIORITY_RANK}
+        # Moving average of how long a generation holds its slot; drives the wait prediction.
+        self._avg_service = 0.0
+
+    def queue_depth(self) -> int:
+        return sum(self._waiting.values())
+
+    def predicted_wait(self, key: tuple) -> float:
+        ahead = sum(1 for entry in self._heap if entry[:3] < key and entry[3].key == entry[:3] and entry[3].queued())
+        return math.ceil((ahead + 1) / self.concurrency) * self._avg_service
+
+    def _key(self, priority_level: str, deadline: Optional[datetime]) -> tuple:
+        due = deadline.timestamp() if deadline else time.time() + self.budgets.get(priority_level, 0.0)
+        return (PRIORITY_RANK[priority_level], due, next(self._seq))
+
+    async def admit(self, priority_level: str = "LOW", deadline: Optional[datetime] = None, ticket: Optional[Ticket] = None) -> Slot:
+        """Wait for a slot; with a `ticket`, its (possibly promoted) priority and deadline are used."""
+        ticket = ticket or Ticket(priority_level, deadline)
+        ticket._scheduler = self
+        if self.active < self.concurrency and not self.queue_depth():
+            self.active += 1
+            observability.LLM_ACTIVE.set(self.active)
+            observability.LLM_QUEUE_WAIT.labels(ticket.priority_level).observe(0.0)
+            return Slot(self)
+
+        key = self._key(ticket.priority_level, ticket.deadline)
+        if self.queue_depth() >= self.max_queue:
+            self._shed(ticket.priority_level, "queue_full")
+        if time.time() + self.predicted_wait(key) > key[1]:
+            self._shed(ticket.priority_level, "predicted_wait")
+
+        loop = asyncio.get_running_loop()
+        ticket.key, ticket.fut = key, loop.create_future()
+        heapq.heappush(self._heap, key + (ticket,))
+        self._set_waiting(ticket.priority_level, +1)
+        ticket.timer = loop.call_later(self.budgets.get(ticket.priority_level, 0.0), self._expire, ticket)
+        start = time.monotonic()
+        try:
+            await ticket.fut
+        except asyncio.CancelledError:
+            if ticket.fut.done() and not ticket.fut.cancelled():
+                # Granted in the same tick we gave up; pass the slot on.
+                self._release(0.0, record=False)
+            elif ticket.fut.cancelled():
+                self._set_waiting(ticket.priority_level, -1)
+            raise
+        finally:
+            ticket.timer.cancel()
+        observability.LLM_QUEUE_WAIT.labels(ticket.priority_level).observe(time.monotonic() - start)
+        return Slot(self)
+
+    def _promote(self, ticket: Ticket, priority_level: str, deadline: Optional[datetime]):
+        key = self._key(priority_level, deadline)
+        if key[:2] >= ticket.key[:2]:
+            return
+        self._set_waiting(ticket.priority_level, -1)
+        self._set_waiting(priority_level, +1)
+        ticket.priority_level, ticket.deadline, ticket.key = priority_level, deadline, key
+        # The old entry stays in the heap, stale; _release and predicted_wait skip it.
+        heapq.heappush(self._heap, key + (ticket,))
+        loop = asyncio.get_running_loop()
+        give_up = loop.time() + self.budgets.get(priority_level, 0.0)
+        if give_up > ticket.timer.when():
+            ticket.timer.cancel()
+            ticket.timer = loop.call_at(give_up, self._expire, ticket)
+
+    def _expire(self, ticket: Ticket):
+        if not ticket.queued():
+            return
+        self._set_waiting(ticket.priority_level, -1)
+        observability.LLM_QUEUE_SHED.labels(ticket.priority_level, "timeout").inc()
+        ticket.fut.set_exception(QueueShed(ticket.priority_level, "timeout"))
+
+    def _shed(self, priority_level: str, reason: str):
+        observability.LLM_QUEUE_SHED.labels(priority_level, reason).inc()
+        raise QueueShed(priority_level, reason)
+
+    def _set_waiting(self, priority_level: str, delta: int):
+        self._waiting[priority_level] += delta
+        observability.LLM_QUEUE_DEPTH.labels(priority_level).set(self._waiting[priority_level])
+
+    def _release(self, held: float, record: bool = True):
+        if record:
+            self._avg_service = held if not self._avg_service else 0.8 * self._avg_service + 0.2 * held
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            ticket = entry[3]
+            if ticket.key != entry[:3] or not ticket.queued():
+                continue
+            self._set_waiting(ticket.priority_level, -1)
+            ticket.fut.set_result(None)
+            return
+        self.active -= 1
+        observability.LLM_ACTIVE.set(self.active)
+
+
+llm_scheduler = LLMScheduler()
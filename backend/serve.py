@@ -0,0 +1,115 @@
+"""Run the API in several worker processes that share one loaded model and KB index.
+
+`uvicorn main:app --workers N` starts every worker from scratch, so each one
+loads its own copy of the embedding model and KB. This script loads them once
+in the parent, freezes the parent's heap out of the garbage collector
+(gc.freeze), then forks the workers on one shared listening socket. The model
+weights and index pages are inherited copy-on-write and stay shared as long as
+nobody writes to them. The embedding matrix is an mmap of the snapshot file, so
+it lives in the page cache either way.
+
+    python serve.py --workers 4 [--host 0.0.0.0] [--port 8080]
+
+A worker that dies is re-forked from the parent, still without reloading.
+Notes:
+- The ONNX backends reopen their session in each worker (see
+  encoders.OnnxEncoder.after_fork). The int8 graph is small.
+- Shared rate-limit stores reattach per worker (ratelimit_store after_fork).
+- With RAG_BACKEND=chroma only the model is preloaded, and each worker builds
+  its own collection.
+"""
+import argparse
+import gc
+import os
+import signal
+import time
+
+import uvicorn
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "4"))
+
+
+def preload():
+    """Import the app and load everything the workers would otherwise each load themselves."""
+    import main
+    import retrieval
+
+    if main.rag:
+        start = time.perf_counter()
+        main.rag.load_lexical()
+        main.rag.load_model()
+        if retrieval.RAG_BACKEND == "numpy":
+            main.rag.load_index()
+        print(f"Preloaded model and KB in {time.perf_counter() - start:.1f}s")
+    return main
+
+
+def run_worker(main, config: uvicorn.Config, sock) -> None:
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    if main.rag and main.rag.model is not None:
+        main.rag.model.after_fork()
+    # The shm store's flock fd was opened by the parent; each worker needs its own.
+    store = main.guard_rails.rate_limiter.store
+    if store is not None:
+        store.after_fork()
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve(host: str, port: int, workers: int) -> None:
+    main = preload()
+    config = uvicorn.Config(main.app, host=host, port=port, lifespan="on")
+    sock = config.bind_socket()
+    # Everything allocated so far is long-lived; keep the collector from touching
+    # (and so un-sharing) those pages in every worker.
+    gc.collect()
+    gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def spawn(slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(main, config, sock)
+            finally:
+                os._exit(0)
+        children[pid] = slot
+        print(f"Worker {slot} started (pid {pid})")
+
+    def stop(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for slot in range(max(1, workers)):
+        spawn(slot)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        slot = children.pop(pid, None)
+        if slot is None:
+            continue
+        if not stopping:
+            print(f"Worker {slot} (pid {pid}) exited with status {status}; restarting")
+            time.sleep(1)
+            spawn(slot)
+    sock.close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=int(os.getenv("PORT", "8080")))
+    ap.add_argument("--workers", type=int, default=WEB_CONCURRENCY)
+    args = ap.parse_args()
+    serve(args.host, args.port, args.workers)
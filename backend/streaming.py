@@ -0,0 +1,507 @@
+"""Incremental filters applied to LLM output while it streams to the client.
+
+Each stage takes text as it arrives and returns the part that may leave the
+server now, holding back only the short tail that could still turn into
+something it must act on (the start of a prompt echo, a phrase to rewrite, a
+half-received word). Stages can rewrite text, suppress it, or stop the stream;
+a Pipeline chains them so every chunk passes through all of them once.
+"""
+import re
+from typing import Callable, Dict, FrozenSet, Iterable, Sequence, Set
+
+# Text that only appears in a reply when the model is echoing the prompt back.
+ECHO_MARKERS = (
+    "you are a helpful offer-support assistant",
+    "use only the provided context to answer",
+    "\ncontext:",
+    "user question:",
+)
+
+# Lines that mean the model has moved past its answer and is continuing the prompt template.
+ANSWER_END_PHRASES = ("user question", "answer")
+
+# Pleasantries and open-ended follow-ups dropped from replies, but only when one is a whole
+# sentence or the last clause of one ("Sure, happy to help."); "Let me know if ..." stays.
+_I_AM = ("i'm ", "i\u2019m ", "im ", "i am ")
+PLEASANTRIES = tuple(
+    [f"{i}glad{t}" for i in _I_AM for t in ("", " you asked", " to help", " to assist", " i could help")]
+    + [f"{i}happy to {v}{t}" for i in ("",) + _I_AM for v in ("help", "assist") for t in ("", " you")]
+    + [
+        "is there anything else", "is there anything else i can help with", "is there anything else i can help you with",
+        "can i help with anything else", "can i help you with anything else",
+        "let me know", "let me know if you have any questions", "let me know if you have any other questions",
+        "let me know if you need anything else", "let me know if you need more help",
+        "feel free to ask", "feel free to ask if you have any questions", "feel free to ask any other questions",
+        "would you like more help", "would you like more details", "would you like anything else",
+        "i can guide you", "i can guide you with that", "i can assist you", "i can assist you with that",
+        "hope this helps", "i hope this helps",
+    ]
+)
+
+# Web-only instructions rewritten for the in-app channel (longest phrase wins).
+CHANNEL_REWRITES = {
+    "raise a ticket on website": "raise a ticket from the app",
+    "raise a ticket on our website": "raise a ticket from the app",
+    "raise a ticket via website": "raise a ticket from the app",
+    "raise a ticket via our website": "raise a ticket from the app",
+    "click the chat with us button on website": "open the app and use the support option",
+    "click the chat with us button on our website": "open the app and use the support option",
+    'click the "chat with us" button on website': "open the app and use the support option",
+    'click the "chat with us" button on our website': "open the app and use the support option",
+    "on website": "in the app",
+    "on our website": "in the app",
+    "[website url]": "the app",
+}
+
+# Characters that open a bullet line.
+BULLET_MARKS = "-*\u2022"
+
+# Reply text that should end a chat-stream with the escalate-to-agent action.
+CTA_PATTERNS = (
+    r"if it exceed[s]?\s*48\s*hour[s]?,?\s*(please )?contact support",
+    r"contact support.*48\s*hour[s]?",
+    r"contact (?:our\s+)?support (?:team|desk|agent)s?",
+    r"reach(?:ing)?\s+out\s+to\s+(?:our\s+)?official\s+channels",
+    r"visit(?:ing)?\s+(?:our\s+)?help\s+center",
+    r"(let me|i will)?\s*(connect|escalate)\s+you(?:\s+\w+){0,3}\s+to\s+(?:a\s+)?human(?:\s+agent)?",
+    r"not\s+able\s+to\s+connect\s+you(?:\s+\w+){0,3}\s+to\s+(?:a\s+)?human(?:\s+agent)?",
+    r"talk to (a\s+)?human(\s+agent)?",
+    r"not\s+(?:a\s+)?direct\s+contact\s+to\s+(?:a\s+)?human\s+agent[s]?",
+)
+
+_WS = re.compile(r"\s+")
+_SPACES = re.compile(r"[ \t]{2,}")
+# Zero-width: where a word (or other non-space run) starts; after a newline and its indentation.
+_WORD_START = re.compile(r"(?<!\S)(?=\S)|(?<!\w)(?=\w)")
+_LINE_START = re.compile(r"\n[ \t]*(?=\S)")
+_PARTIAL_WORD = re.compile(r"\w*$")
+
+
+def _lower(text: str) -> str:
+    """Lowercase without changing the length, so offsets stay valid in the original."""
+    t = text.lower()
+    return t if len(t) == len(text) else "".join(c.lower()[0] for c in text)
+
+
+def _phrase_pattern(phrases: Iterable[str]) -> "re.Pattern":
+    alts = sorted(set(phrases), key=len, reverse=True)
+    body = "|".join(r"\s+".join(re.escape(w) for w in p.split()) for p in alts)
+    return re.compile(rf"(?<!\w)(?:{body})(?!\w)", re.IGNORECASE)
+
+
+def _open_from(low: str, phrases: Sequence[str], starts: "re.Pattern", maxlen: int) -> int:
+    """Earliest start (within the last maxlen chars) whose remaining text could still grow into a phrase."""
+    for m in starts.finditer(low, max(0, len(low) - maxlen)):
+        seg = _WS.sub(" ", low[m.end():])
+        if seg and any(p.startswith(seg) for p in phrases):
+            return m.start()
+    return len(low)
+
+
+class Stage:
+    """One incremental filter: feed() returns what may be released now, flush() the rest at the end."""
+
+    stopped = False
+    # Names the stage in metrics when it ends a stream early.
+    reason = ""
+
+    def feed(self, text: str) -> str:
+        return text
+
+    def flush(self) -> str:
+        return ""
+
+
+class Pipeline(Stage):
+    def __init__(self, *stages: Stage):
+        self.stages = stages
+
+    @property
+    def stopped(self) -> bool:
+        return any(s.stopped for s in self.stages)
+
+    @property
+    def stopped_by(self) -> str:
+        """The stopped stage nearest the client: it withheld text every stage before it let through."""
+        return next((s.reason for s in reversed(self.stages) if s.stopped), "")
+
+    def feed(self, text: str) -> str:
+        for stage in self.stages:
+            if not text:
+                return ""
+            text = stage.feed(text)
+        return text
+
+    def flush(self) -> str:
+        out = ""
+        for stage in self.stages:
+            out = (stage.feed(out) if out else "") + stage.flush()
+        return out
+
+
+class EchoDetector(Stage):
+    """Releases streamed text as soon as it cannot be the start of a prompt echo.
+
+    Only a trailing span that is still a prefix of some marker is held back. A
+    marker found within the first `window` characters sets `echoed` (and stops
+    the stream); the text before it is the last thing feed() returns. Past the
+    window the detector stops looking (`passed`).
+    """
+
+    reason = "echo"
+
+    def __init__(self, markers: Sequence[str] = ECHO_MARKERS, window: int = 200):
+        self.markers = tuple(m.lower() for m in markers)
+        self.window = window
+        self.pending = ""
+        self.released = 0
+        self.echoed = False
+        self.passed = False
+
+    @property
+    def stopped(self) -> bool:
+        return self.echoed
+
+    def _held(self, low: str) -> int:
+        """Length of the longest suffix of low that some marker starts with."""
+        for k in range(min(len(low), max(len(m) for m in self.markers) - 1), 0, -1):
+            tail = low[-k:]
+            if any(m.startswith(tail) for m in self.markers):
+                return k
+        return 0
+
+    def feed(self, chunk: str) -> str:
+        if self.echoed:
+            return ""
+        if self.passed:
+            return chunk
+        text = self.pending + chunk
+        low = _lower(text)
+        hits = [i for i in (low.find(m) for m in self.markers) if i >= 0]
+        if hits:
+            cut = min(hits)
+            self.echoed = True
+            self.pending = ""
+            self.released += cut
+            return text[:cut]
+        if self.released + len(text) >= self.window:
+            self.passed = True
+            self.pending = ""
+            self.released += len(text)
+            return text
+        keep = self._held(low)
+        out = text[:len(text) - keep]
+        self.pending = text[len(text) - keep:]
+        self.released += len(out)
+        return out
+
+    def flush(self) -> str:
+        """End of stream: whatever was held back is not an echo after all."""
+        out, self.pending = self.pending, ""
+        self.released += len(out)
+        return out
+
+
+class CutAt(Stage):
+    """Stops the stream at a line that starts with one of `phrases` (whole words, any case)."""
+
+    reason = "cut"
+
+    def __init__(self, phrases: Sequence[str] = ANSWER_END_PHRASES):
+        self.phrases = tuple(" ".join(p.lower().split()) for p in phrases)
+        self.pattern = re.compile(
+            r"\n[ \t]*" + _phrase_pattern(self.phrases).pattern, re.IGNORECASE
+        )
+        self.maxlen = 2 * max(len(p) for p in self.phrases) + 8
+        self.pending = ""
+        self.at_line_start = True
+
+    def _scan(self, text: str, final: bool) -> str:
+        # A leading newline stands in for "the previous release ended a line".
+        probe = ("\n" if self.at_line_start else "") + text
+        off = len(probe) - len(text)
+        m = self.pattern.search(probe)
+        if m:
+            self.stopped = True
+            self.pending = ""
+            return text[:max(0, m.start() - off)]
+        hold = len(probe) if final else _open_from(_lower(probe), self.phrases, _LINE_START, self.maxlen)
+        hold = max(off, hold)
+        out, self.pending = probe[off:hold], probe[hold:]
+        if out:
+            self.at_line_start = re.search(r"\n[ \t]*$", out) is not None
+        return out
+
+    def feed(self, text: str) -> str:
+        if self.stopped:
+            return ""
+        return self._scan(self.pending + text, final=False)
+
+    def flush(self) -> str:
+        if self.stopped or not self.pending:
+            return ""
+        return self._scan(self.pending, final=True)
+
+
+class DropClauses(Stage):
+    """Deletes whole sentences, or a sentence's last clause, that consist only of one of `phrases`.
+
+    "Happy to help! Your reward ..." loses "Happy to help! "; "Sure, happy to
+    help." becomes "Sure."; a phrase that is only part of a clause ("Let me know
+    if the reward is missing") is never touched. Text from a sentence start or a
+    comma is held back only while it could still turn into such a clause.
+    """
+
+    # Where a deletable clause may start: after a sentence end or newline, or at a comma.
+    _STARTS = re.compile(r"(?:(?<=[.!?])|(?<=\n))[ \t]*|[ \t]*,[ \t]*")
+
+    def __init__(self, phrases: Sequence[str]):
+        self.phrases = tuple(sorted({" ".join(p.lower().split()) for p in phrases}, key=len, reverse=True))
+        body = _phrase_pattern(self.phrases).pattern
+        self.sentence = [
+            re.compile(rf"((?:(?<=[.!?])|(?<=\n))[ \t]*){body}[ \t]*{end}", re.IGNORECASE)
+            for end in (r"[.!?]+[ \t]*", r"(?:[.!?]+[ \t]*|\Z)")
+        ]
+        self.clause = [
+            re.compile(rf"[ \t]*,[ \t]*{body}(?={end})", re.IGNORECASE)
+            for end in (r"[ \t]*[.!?]", r"[ \t]*[.!?]|[ \t]*\Z")
+        ]
+        self.maxlen = 2 * max(len(p) for p in self.phrases) + 8
+        self.pending = ""
+        # Released text the lookbehinds need; a reply starts at a sentence start.
+        self.tail = "\n"
+
+    def _could_grow(self, rest: str) -> bool:
+        seg = _WS.sub(" ", rest).lstrip(" ,")
+        return any(p.startswith(seg) for p in self.phrases) or seg.rstrip() in self.phrases
+
+    def _release(self, probe: str, off: int, final: bool) -> str:
+        out = self.sentence[final].sub(r"\1", probe)
+        out = self.clause[final].sub("", out)
+        # Matches never reach into the tail: a clause start is held until its clause is decided.
+        out = out[off:]
+        self.tail = (self.tail + out)[-8:]
+        return out
+
+    def feed(self, text: str) -> str:
+        probe = self.tail + self.pending + text
+        off = len(self.tail)
+        low = _lower(probe)
+        hold = len(probe)
+        for m in self._STARTS.finditer(low, max(off, len(low) - self.maxlen)):
+            if self._could_grow(low[m.start():]):
+                hold = m.start()
+                break
+        hold = max(off, hold)
+        self.pending = probe[hold:]
+        return self._release(probe[:hold], off, final=False)
+
+    def flush(self) -> str:
+        if not self.pending:
+            return ""
+        probe, self.pending = self.tail + self.pending, ""
+        return self._release(probe, len(self.tail), final=True)
+
+
+class Rewrite(Stage):
+    """Replaces whole-word phrases (any case, any whitespace between words); "" deletes them."""
+
+    def __init__(self, rules: Dict[str, str]):
+        self.rules = {" ".join(k.lower().split()): v for k, v in rules.items()}
+        self.phrases = tuple(self.rules)
+        self.pattern = _phrase_pattern(self.phrases)
+        self.maxlen = 2 * max(len(p) for p in self.phrases)
+        self.pending = ""
+        # Treated as already followed by a space, so a reply never starts with blanks left by a deletion.
+        self.last = " "
+
+    def _emit(self, text: str) -> str:
+        out = _SPACES.sub(" ", self.pattern.sub(lambda m: self.rules[" ".join(m.group(0).lower().split())], text))
+        if self.last in " \t":
+            out = out.lstrip(" \t")
+        if out:
+            self.last = out[-1]
+        return out
+
+    def feed(self, text: str) -> str:
+        text = self.pending + text
+        hold = _open_from(_lower(text), self.phrases, _WORD_START, self.maxlen)
+        self.pending = text[hold:]
+        return self._emit(text[:hold])
+
+    def flush(self) -> str:
+        out, self.pending = self._emit(self.pending), ""
+        return out
+
+
+class PolicyCheck(Stage):
+    """Runs the guard-rail scan over the stream; blocked content stops it before release.
+
+    `scan` returns rule categories for a piece of text (guard_rails.scan). Text
+    is released as it arrives except for the last `overlap` characters (rounded
+    back to a word start), which must cover the longest blocked term; everything
+    held is scanned together with the last `overlap` released characters, so a
+    blocked term is found before any of it is released, even when split across
+    chunks.
+    """
+
+    reason = "policy"
+
+    def __init__(self, scan: Callable[[str], FrozenSet[str]], overlap: int = 32):
+        self.scan = scan
+        self.overlap = overlap
+        self.hits: Set[str] = set()
+        self.pending = ""
+        self.tail = ""
+
+    @property
+    def blocked(self) -> bool:
+        return "blocked" in self.hits
+
+    @property
+    def warning(self) -> bool:
+        return "warning" in self.hits
+
+    @property
+    def off_topic(self) -> bool:
+        return "out_of_scope" in self.hits and "in_domain" not in self.hits
+
+    def _release(self, text: str, cut: int) -> str:
+        found = self.scan(self.tail + text)
+        self.hits |= found
+        if "blocked" in found:
+            self.stopped = True
+            self.pending = ""
+            return ""
+        ready, self.pending = text[:cut], text[cut:]
+        self.tail = (self.tail + ready)[-self.overlap:]
+        return ready
+
+    def feed(self, text: str) -> str:
+        if self.stopped:
+            return ""
+        text = self.pending + text
+        cut = max(0, len(text) - self.overlap)
+        cut = _PARTIAL_WORD.search(text, 0, cut).start()
+        return self._release(text, cut)
+
+    def flush(self) -> str:
+        if self.stopped or not self.pending:
+            return ""
+        return self._release(self.pending, len(self.pending))
+
+
+class Budget(Stage):
+    """Stops the stream once the reply has said enough.
+
+    A run of prose ends after `max_sentences` sentences (a ., ! or ? followed by
+    whitespace), unless what follows is a bullet list; a reply holds at most
+    `max_bullets` bullet lines, and sentences inside bullets are not counted.
+    Only the whitespace after a sentence that used up the budget is held back,
+    until the next character shows whether a bullet list starts. 0 disables a limit.
+    """
+
+    reason = "budget"
+
+    def __init__(self, max_sentences: int = 2, max_bullets: int = 5):
+        self.max_sentences = max_sentences
+        self.max_bullets = max_bullets
+        self.sentences = 0
+        self.bullets = 0
+        self.in_bullet = False
+        self.line_start = True
+        self.prev = ""
+        self.pending = ""
+
+    def _stop(self, text: str) -> str:
+        self.stopped = True
+        self.pending = ""
+        return text.rstrip()
+
+    def feed(self, text: str) -> str:
+        if self.stopped:
+            return ""
+        buf = self.pending + text
+        hold = 0 if self.pending else None
+        for i in range(len(self.pending), len(buf)):
+            c = buf[i]
+            if c.isspace():
+                if self.prev in ".!?" and self.prev and not self.in_bullet and hold is None:
+                    self.sentences += 1
+                    if self.max_sentences and self.sentences >= self.max_sentences:
+                        hold = i
+                if c == "\n":
+                    self.line_start = True
+            else:
+                if self.line_start and c in BULLET_MARKS:
+                    if self.max_bullets and self.bullets >= self.max_bullets:
+                        return self._stop(buf[:i if hold is None else hold])
+                    self.bullets += 1
+                    self.in_bullet = True
+                    self.sentences = 0
+                    hold = None
+                elif hold is not None:
+                    return self._stop(buf[:hold])
+                elif self.line_start:
+                    self.in_bullet = False
+                self.line_start = False
+            self.prev = c
+        if hold is None:
+            self.pending = ""
+            return buf
+        self.pending = buf[hold:]
+        return buf[:hold]
+
+    def flush(self) -> str:
+        # Only whitespace is ever held back.
+        self.pending = ""
+        return ""
+
+
+class CtaDetector(Stage):
+    """Passes text through unchanged and notes whether it contains a call to action (CTA_PATTERNS).
+
+    Each delta is checked together with the last `window` characters, so most
+    CTAs are seen as soon as they stream past. Some patterns span any distance
+    ("contact support ... 48 hours"), so finish() checks the whole reply once
+    at the end if nothing matched on the way.
+    """
+
+    def __init__(self, patterns: Sequence[str] = CTA_PATTERNS, window: int = 240):
+        self.pattern = re.compile("|".join(f"(?:{p})" for p in patterns))
+        self.window = window
+        self.tail = ""
+        self.parts = []
+        self.matched = False
+
+    def _search(self, text: str) -> bool:
+        return self.pattern.search(_WS.sub(" ", text.lower())) is not None
+
+    def feed(self, text: str) -> str:
+        if text and not self.matched:
+            self.parts.append(text)
+            seen = self.tail + text
+            self.matched = self._search(seen)
+            self.tail = seen[-self.window:]
+        return text
+
+    def finish(self) -> bool:
+        if not self.matched and len(self.parts) > 1:
+            self.matched = self._search("".join(self.parts))
+        self.parts = []
+        return self.matched
+
+
+def reply_filters(scan: Callable[[str], FrozenSet[str]], max_sentences: int = 2, max_bullets: int = 5) -> Pipeline:
+    """The filters process_chat runs LLM replies through, in order.
+
+    The budget counts sentences after pleasantries are dropped, so it sits behind the rewrite.
+    """
+    return Pipeline(
+        EchoDetector(),
+        CutAt(ANSWER_END_PHRASES),
+        DropClauses(PLEASANTRIES),
+        Rewrite(CHANNEL_REWRITES),
+        Budget(max_sentences, max_bullets),
+        PolicyCheck(scan),
+    )
@@ -0,0 +1,255 @@
+"""Topic / intent / priority classification from a declarative table.
+
+The table (data/topics.json) lists ordered rules: the first topic rule that
+matches wins, then the first intent rule allowed for that topic, then the first
+priority rule. A rule matches when any of its keywords occurs in the lowercased
+message (and its optional regex also matches). Every keyword of every rule is
+compiled into one automaton, so one pass over the text answers all three.
+
+The table is re-read when the file changes (see TopicClassifier.watch_forever).
+
+When the caller already has the query embedding, the topic comes from the
+nearest labelled-example centroid instead (CentroidClassifier); the keyword
+table answers only when that match is weak.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import observability
+from guard_rails import KeywordAutomaton
+from message import normalize, rewrite_synonyms
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TOPIC_TABLE_PATH = os.getenv("TOPIC_TABLE_PATH", os.path.join(BASE_DIR, "../data/topics.json"))
+# Seconds between checks for an edited table; 0 disables hot reload.
+TOPIC_TABLE_RELOAD_INTERVAL = float(os.getenv("TOPIC_TABLE_RELOAD_INTERVAL", "5"))
+
+# Labelled example questions ({"text", "topic"} per line) that the topic centroids are built from.
+TOPIC_EXAMPLES_PATH = os.getenv("TOPIC_EXAMPLES_PATH", os.path.join(BASE_DIR, "../data/topic_examples.jsonl"))
+TOPIC_CENTROIDS = os.getenv("TOPIC_CENTROIDS", "1").strip().lower() in {"1", "true", "yes", "on"}
+# A centroid wins only with at least this cosine similarity and this lead over the runner-up.
+TOPIC_CENTROID_MIN_SCORE = float(os.getenv("TOPIC_CENTROID_MIN_SCORE", "0.45"))
+TOPIC_CENTROID_MIN_MARGIN = float(os.getenv("TOPIC_CENTROID_MIN_MARGIN", "0.05"))
+
+
+@dataclass(frozen=True)
+class Classification:
+    topic: str
+    intent: str
+    priority: str
+
+
+@dataclass
+class _Rule:
+    label: str
+    bit: int  # 0 when the rule has no keywords
+    pattern: Optional["re.Pattern"] = None
+    topics: Optional[frozenset] = None
+
+
+class TopicTable(KeywordAutomaton):
+    """One compiled version of the topic table."""
+
+    def __init__(self, spec: Dict):
+        super().__init__()
+        self.default_topic = str(spec.get("default_topic", "unknown"))
+        self.default_intent = str(spec.get("default_intent", "unknown"))
+        self.default_priority = str(spec.get("default_priority", "LOW"))
+        self._next_bit = 1
+        self.topic_rules = [self._rule(r, "topic") for r in spec.get("topics", [])]
+        self.intent_rules = [self._rule(r, "intent") for r in spec.get("intents", [])]
+        self.priority_rules = [self._rule(r, "priority") for r in spec.get("priorities", [])]
+        self._build()
+        # Collapse each state's outputs into one bitmask of rule hits.
+        self._masks = [0] * len(self._out)
+        for state, entries in enumerate(self._out):
+            for bit in entries:
+                self._masks[state] |= bit
+
+    def _rule(self, raw: Dict, field: str) -> _Rule:
+        label = raw.get(field)
+        if not isinstance(label, str) or not label:
+            raise ValueError(f"rule without a {field!r} name: {raw!r}")
+        keywords = raw.get("any") or []
+        if not isinstance(keywords, list) or not all(isinstance(k, str) and k for k in keywords):
+            raise ValueError(f"{field} {label!r}: 'any' must be a list of non-empty strings")
+        bit = 0
+        if keywords:
+            bit = self._next_bit
+            self._next_bit <<= 1
+            for kw in keywords:
+                self._add(kw.lower(), bit)
+        pattern = re.compile(raw["pattern"]) if raw.get("pattern") else None
+        topics = frozenset(raw["topics"]) if raw.get("topics") else None
+        return _Rule(label, bit, pattern, topics)
+
+    def _hits(self, s: str) -> int:
+        goto, fail, masks = self._goto, self._fail, self._masks
+        hits = 0
+        state = 0
+        for ch in s:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            hits |= masks[state]
+        return hits
+
+    @staticmethod
+    def _matches(rule: _Rule, hits: int, s: str) -> bool:
+        if rule.bit and not hits & rule.bit:
+            return False
+        return rule.pattern is None or rule.pattern.search(s) is not None
+
+    def classify(self, lowered: str, topic: Optional[str] = None) -> Classification:
+        """Classify lowercased text; a given topic replaces the keyword topic rules."""
+        hits = self._hits(lowered)
+        if topic is None:
+            topic = next((r.label for r in self.topic_rules if self._matches(r, hits, lowered)), self.default_topic)
+        intent = next(
+            (r.label for r in self.intent_rules if (r.topics is None or topic in r.topics) and self._matches(r, hits, lowered)),
+            self.default_intent,
+        )
+        priority = next((r.label for r in self.priority_rules if self._matches(r, hits, lowered)), self.default_priority)
+        return Classification(topic, intent, priority)
+
+
+def read_examples(path: str = TOPIC_EXAMPLES_PATH) -> List[Tuple[str, str]]:
+    with open(path) as f:
+        rows = [json.loads(ln) for ln in f if ln.strip()]
+    return [(str(r["text"]), str(r["topic"])) for r in rows]
+
+
+class CentroidClassifier:
+    """Nearest-centroid topic model over sentence embeddings.
+
+    Each topic's centroid is the normalized mean of its example embeddings, so
+    classifying a query is one (topics x dim) matrix-vector product against the
+    embedding retrieval already computed.
+    """
+
+    def __init__(self, min_score: float = TOPIC_CENTROID_MIN_SCORE, min_margin: float = TOPIC_CENTROID_MIN_MARGIN):
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.labels: List[str] = []
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+
+    def fit(self, labels: List[str], embeddings) -> None:
+        emb = np.asarray(embeddings, dtype=np.float32)
+        emb = emb / np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12)
+        topics = sorted(set(labels))
+        rows = [emb[[i for i, label in enumerate(labels) if label == t]].mean(axis=0) for t in topics]
+        matrix = np.asarray(rows, dtype=np.float32).reshape(len(topics), -1)
+        self.matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        self.labels = topics
+
+    def scores(self, embedding) -> np.ndarray:
+        q = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        return self.matrix @ (q / max(float(np.linalg.norm(q)), 1e-12))
+
+    def predict(self, embedding) -> Optional[Tuple[str, float]]:
+        """Return (topic, cosine) for a confident match, else None."""
+        if not self.labels or embedding is None:
+            return None
+        scores = self.scores(embedding)
+        order = np.argsort(scores)[::-1]
+        best = float(scores[order[0]])
+        runner_up = float(scores[order[1]]) if len(order) > 1 else -1.0
+        if best < self.min_score or best - runner_up < self.min_margin:
+            return None
+        return self.labels[int(order[0])], best
+
+    def load(self, encode: Callable[[List[str]], np.ndarray], cache_dir: str, model_name: str, path: str = TOPIC_EXAMPLES_PATH) -> None:
+        """Fit from the example file, reusing centroids cached in cache_dir when examples and model are unchanged."""
+        try:
+            examples = read_examples(path)
+        except OSError as e:
+            print(f"Topic centroids disabled: {e}")
+            return
+        key = hashlib.sha256(json.dumps([model_name, examples], ensure_ascii=False).encode("utf-8")).hexdigest()
+        cache_path = os.path.join(cache_dir, "topic-centroids.npz")
+        try:
+            with np.load(cache_path) as cached:
+                if str(cached["key"]) == key:
+                    self.labels = [str(label) for label in cached["labels"]]
+                    self.matrix = cached["matrix"]
+                    return
+        except (OSError, KeyError, ValueError):
+            pass
+        # Embed the examples the way queries are embedded (lowercased, synonyms rewritten).
+        emb = encode([rewrite_synonyms(text.lower()) for text, _ in examples])
+        self.fit([topic for _, topic in examples], emb)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = os.path.join(cache_dir, f".topic-centroids.{os.getpid()}.npz")
+        np.savez(tmp, key=np.array(key), labels=np.array(self.labels), matrix=self.matrix)
+        os.replace(tmp, cache_path)
+        print(f"Topic centroids built: {len(self.labels)} topics from {len(examples)} examples")
+
+
+centroids = CentroidClassifier()
+
+
+class TopicClassifier:
+    """Serves classifications from the current TopicTable and swaps in edits to the file."""
+
+    def __init__(self, path: str = TOPIC_TABLE_PATH):
+        self.path = path
+        self._stamp = None
+        self.table = self._load()
+
+    def _stat(self):
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size
+
+    def _load(self) -> TopicTable:
+        self._stamp = self._stat()
+        with open(self.path) as f:
+            return TopicTable(json.load(f))
+
+    def reload(self, force: bool = False) -> bool:
+        """Recompile the table if the file changed; a broken edit keeps the previous table."""
+        try:
+            if not force and self._stat() == self._stamp:
+                return False
+            self.table = self._load()
+        except Exception as e:
+            print(f"Topic table reload failed, keeping previous version: {e}")
+            return False
+        print(f"Topic table reloaded from {self.path}")
+        return True
+
+    async def watch_forever(self, interval: float = TOPIC_TABLE_RELOAD_INTERVAL):
+        while interval > 0:
+            await asyncio.sleep(interval)
+            self.reload()
+
+    def classify(self, text, embedding=None, known_topic: Optional[str] = None) -> Classification:
+        """Classify a message; with its query embedding, a confident centroid decides the topic.
+
+        known_topic (the topic of an exactly matched FAQ) takes precedence over both.
+        The result is remembered on the message, so later calls without the
+        embedding (offer_aware_response, determine_priority) see the same topic.
+        """
+        msg = normalize(text)
+        table = self.table
+        if known_topic:
+            observability.TOPIC_CLASSIFICATIONS.labels("faq_variant").inc()
+            return msg.remember(table, table.classify(msg.lower, known_topic))
+        if embedding is None:
+            return msg.memo(table, lambda: table.classify(msg.lower))
+        predicted = centroids.predict(embedding) if TOPIC_CENTROIDS else None
+        observability.TOPIC_CLASSIFICATIONS.labels("centroid" if predicted else "keywords").inc()
+        return msg.remember(table, table.classify(msg.lower, predicted[0] if predicted else None))
+
+
+classifier = TopicClassifier()
+
+
+def classify(text, embedding=None, known_topic: Optional[str] = None) -> Classification:
+    return classifier.classify(text, embedding, known_topic)
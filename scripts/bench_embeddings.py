@@ -0,0 +1,169 @@
+"""Compare embedding backends on FAQ recall, query latency and resident memory.
+
+Usage:
+    python scripts/bench_embeddings.py                           # torch, onnx, onnx-int8
+    python scripts/bench_embeddings.py --backends torch,onnx-int8 --queries 500
+
+Every FAQ question (Q: line of data/faqs.txt) is a query whose correct answer is
+the chunk it came from. For each backend this reports recall@1 / recall@5 over
+those queries, how often its top-1 chunk agrees with the torch backend's, and
+the mean cosine between its query vectors and torch's. The script exits non-zero
+when a backend's recall@1 falls more than --max-recall-drop below torch's.
+
+Latency is one query per encode() call, as rag.search does. Each backend runs in
+its own subprocess so RSS numbers are not polluted by the others (torch and
+sentence-transformers are never imported by the ONNX children).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def percentile(values, pct):
+    vals = sorted(values)
+    if not vals:
+        return 0.0
+    k = min(len(vals) - 1, max(0, int(round(pct / 100.0 * (len(vals) - 1)))))
+    return vals[k]
+
+
+def faq_set():
+    """(chunks, queries, gold chunk index per query); queries are rewritten the way rag.search does."""
+    from message import rewrite_synonyms
+
+    chunks = (ROOT / "data" / "faqs.txt").read_text().split("\n\n")
+    queries, gold = [], []
+    for i, chunk in enumerate(chunks):
+        for ln in chunk.splitlines():
+            if ln.strip().startswith("Q:"):
+                queries.append(rewrite_synonyms(ln.strip()[2:].strip().lower()))
+                gold.append(i)
+    return chunks, queries, gold
+
+
+def run_one(backend: str, model_name: str, n_queries: int, out_path: str) -> dict:
+    import numpy as np
+
+    import encoders
+
+    chunks, queries, _ = faq_set()
+    rss_start = rss_mb()
+    t0 = time.perf_counter()
+    enc = encoders.make_encoder(model_name, backend)
+    load_s = time.perf_counter() - t0
+    rss_loaded = rss_mb()
+
+    t0 = time.perf_counter()
+    chunk_emb = enc.encode(chunks, batch_size=64)
+    corpus_s = time.perf_counter() - t0
+    query_emb = enc.encode(queries, batch_size=64)
+    np.savez(out_path, chunks=np.asarray(chunk_emb, dtype=np.float32), queries=np.asarray(query_emb, dtype=np.float32))
+
+    stream = (queries * (n_queries // max(1, len(queries)) + 1))[:n_queries]
+    for q in stream[:20]:
+        enc.encode([q], batch_size=1)
+    lat = []
+    for q in stream:
+        t = time.perf_counter()
+        enc.encode([q], batch_size=1)
+        lat.append((time.perf_counter() - t) * 1000)
+    return {
+        "backend": backend,
+        "model_id": enc.model_id,
+        "load_s": round(load_s, 2),
+        "corpus_chunks_per_s": round(len(chunks) / corpus_s, 1),
+        "p50_ms": round(percentile(lat, 50), 2),
+        "p99_ms": round(percentile(lat, 99), 2),
+        "rss_model_mb": round(rss_loaded - rss_start, 1),
+        "rss_total_mb": round(rss_mb(), 1),
+    }
+
+
+def recall(chunk_emb, query_emb, gold):
+    import numpy as np
+
+    scores = query_emb @ chunk_emb.T
+    top = np.argsort(-scores, axis=1)[:, :5]
+    gold = np.asarray(gold)
+    return top, float((top[:, 0] == gold).mean()), float((top == gold[:, None]).any(axis=1).mean())
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--backends", default="torch,onnx,onnx-int8")
+    ap.add_argument("--model", default="all-MiniLM-L6-v2")
+    ap.add_argument("--queries", type=int, default=1000, help="single-query encodes timed per backend")
+    ap.add_argument("--max-recall-drop", type=float, default=0.02, help="allowed recall@1 loss vs torch")
+    ap.add_argument("--child", default="", help=argparse.SUPPRESS)
+    ap.add_argument("--out", default="", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        print(json.dumps(run_one(args.child, args.model, args.queries, args.out)))
+        return
+
+    import numpy as np
+
+    _, _, gold = faq_set()
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    if "torch" not in backends:
+        backends.insert(0, "torch")
+    rows, vectors = [], {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in backends:
+            out = os.path.join(tmp, f"{backend}.npz")
+            cmd = [sys.executable, __file__, "--child", backend, "--model", args.model, "--queries", str(args.queries), "--out", out]
+            res = subprocess.run(cmd, capture_output=True, text=True, env=dict(os.environ))
+            if res.returncode != 0:
+                print(f"{backend}: failed\n{res.stderr.strip()[-2000:]}")
+                continue
+            rows.append(json.loads(res.stdout.strip().splitlines()[-1]))
+            with np.load(out) as data:
+                vectors[backend] = (data["chunks"], data["queries"])
+
+    print(f"{'backend':<10} {'load_s':>7} {'chunks/s':>9} {'p50_ms':>7} {'p99_ms':>7} {'rss_model_mb':>13} {'rss_total_mb':>13}")
+    for r in rows:
+        print(f"{r['backend']:<10} {r['load_s']:>7} {r['corpus_chunks_per_s']:>9} {r['p50_ms']:>7} {r['p99_ms']:>7} {r['rss_model_mb']:>13} {r['rss_total_mb']:>13}")
+
+    if "torch" not in vectors:
+        print("torch backend unavailable; no parity reference")
+        sys.exit(1)
+    ref_top, ref_r1, _ = recall(*vectors["torch"], gold)
+    failures = 0
+    print(f"\nrecall over {len(gold)} FAQ questions")
+    print(f"{'backend':<10} {'recall@1':>9} {'recall@5':>9} {'top1_agree':>11} {'query_cos':>10}")
+    for backend, (chunk_emb, query_emb) in vectors.items():
+        top, r1, r5 = recall(chunk_emb, query_emb, gold)
+        agree = float((top[:, 0] == ref_top[:, 0]).mean())
+        cos = float((query_emb * vectors["torch"][1]).sum(axis=1).mean())
+        flag = ""
+        if r1 < ref_r1 - args.max_recall_drop:
+            failures += 1
+            flag = "  FAIL"
+        print(f"{backend:<10} {r1:>9.3f} {r5:>9.3f} {agree:>11.3f} {cos:>10.4f}{flag}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
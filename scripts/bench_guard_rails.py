@@ -0,0 +1,84 @@
+"""Per-message cost of the guard-rail checks: per-pattern re.search loops vs the compiled RuleMatcher.
+
+Usage:
+    python scripts/bench_guard_rails.py [--rounds 200]
+
+Both sides run the checks one chat request performs: blocked + out-of-scope on the
+user message, then filter_response + response_off_topic on a typical reply. The
+script also asserts both sides agree on every sample.
+"""
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend"))
+
+import guard_rails  # noqa: E402
+
+CF = guard_rails.content_filter
+DG = guard_rails.domain_guard
+
+REPLY = (
+    "Rewards are usually credited within 48–72 hours after completion. Keep the app installed "
+    "and active. If it exceeds 72 hours, raise a ticket from the app with screenshots."
+)
+
+
+def _any(patterns, text):
+    for pattern in patterns:
+        if re.search(pattern, text):
+            return True
+    return False
+
+
+def legacy_request(msg: str, reply: str):
+    blocked = _any(CF.blocked_patterns, msg)
+    oos = not _any(DG.offer_terms, msg) and _any(DG.out_of_scope_patterns, msg)
+    reply_blocked = _any(CF.blocked_patterns, reply)
+    reply_warning = _any(CF.warning_patterns, reply)
+    reply_oos = not _any(DG.offer_terms, reply) and _any(DG.out_of_scope_patterns, reply)
+    return blocked, oos, reply_blocked, reply_warning, reply_oos
+
+
+def compiled_request(msg: str, reply: str):
+    hits = guard_rails.scan(msg)
+    reply_hits = guard_rails.scan(reply)
+    return (
+        "blocked" in hits,
+        "in_domain" not in hits and "out_of_scope" in hits,
+        "blocked" in reply_hits,
+        "warning" in reply_hits,
+        "in_domain" not in reply_hits and "out_of_scope" in reply_hits,
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=200)
+    args = ap.parse_args()
+
+    text = (ROOT / "data" / "faqs.txt").read_text()
+    msgs = [ln.strip()[2:].strip() for ln in text.splitlines() if ln.strip().startswith("Q:")]
+    msgs += [
+        "Can you help me write a python algorithm for my homework?",
+        "What is the weather in Delhi tomorrow, also book a hotel",
+        "my password got leaked and someone did a fraud transaction",
+    ]
+    for m in msgs:
+        assert legacy_request(m, REPLY) == compiled_request(m, REPLY), m
+
+    for name, fn in (("legacy re.search loops", legacy_request), ("compiled RuleMatcher", compiled_request)):
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            for m in msgs:
+                # Fresh string objects so the matcher's last-text memo does not flatter the numbers.
+                fn((m + " ")[:-1], (REPLY + " ")[:-1])
+        per_msg = (time.perf_counter() - start) / (args.rounds * len(msgs)) * 1e6
+        print(f"{name:<24} {per_msg:8.1f} us/request  ({len(msgs)} messages x {args.rounds} rounds)")
+
+
+if __name__ == "__main__":
+    main()
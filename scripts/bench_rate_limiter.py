@@ -0,0 +1,91 @@
+"""Rate limiter throughput and memory at 100k distinct client IPs.
+
+Usage:
+    python scripts/bench_rate_limiter.py [--ips 100000] [--per-ip 3]
+
+Compares the previous list-of-datetimes limiter (one global asyncio.Lock, no eviction)
+with guard_rails.RateLimiter (GCRA, one float per key, sharded, swept when idle).
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend"))
+
+import guard_rails  # noqa: E402
+
+
+class LegacyRateLimiter:
+    def __init__(self, max_requests: int = 10, time_window: int = 60):
+        self.max_requests = max_requests
+        self.time_window = time_window
+        self.requests = defaultdict(list)
+        self.lock = asyncio.Lock()
+
+    async def is_rate_limited(self, identifier: str) -> bool:
+        async with self.lock:
+            now = datetime.now()
+            self.requests[identifier] = [
+                t for t in self.requests[identifier] if now - t < timedelta(seconds=self.time_window)
+            ]
+            if len(self.requests[identifier]) >= self.max_requests:
+                return True
+            self.requests[identifier].append(now)
+            return False
+
+
+def make_ips(n: int):
+    return [f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}" for i in range(n)]
+
+
+async def run(limiter, calls):
+    start = time.perf_counter()
+    for ip in calls:
+        await limiter.is_rate_limited(ip)
+    return time.perf_counter() - start
+
+
+def measure(name, factory, calls, n_ips):
+    # Timed run first; tracemalloc slows allocation down, so memory is taken from a second run.
+    elapsed = asyncio.run(run(factory(), calls))
+    tracemalloc.start()
+    limiter = factory()
+    asyncio.run(run(limiter, calls))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    keys = len(limiter.requests) if hasattr(limiter, "requests") else len(limiter)
+    print(
+        f"{name:<10} {len(calls) / elapsed:>12,.0f} checks/s  {elapsed / len(calls) * 1e6:6.2f} us/check  "
+        f"keys={keys:<7} mem={current / 1e6:6.1f} MB ({current / max(1, n_ips):5.0f} B/ip) peak={peak / 1e6:6.1f} MB"
+    )
+    return limiter
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--ips", type=int, default=100_000)
+    ap.add_argument("--per-ip", type=int, default=3)
+    args = ap.parse_args()
+
+    ips = make_ips(args.ips)
+    calls = ips * args.per_ip
+    random.Random(1).shuffle(calls)
+
+    measure("legacy", lambda: LegacyRateLimiter(15, 60), calls, args.ips)
+    limiter = measure("gcra", lambda: guard_rails.RateLimiter(15, 60), calls, args.ips)
+
+    # Every key is idle once a full window has passed; one full sweep should empty the table.
+    start = time.perf_counter()
+    removed = limiter.sweep(now=time.monotonic() + 61)
+    print(f"sweep      removed {removed:,} idle keys in {(time.perf_counter() - start) * 1000:.1f} ms, {len(limiter)} left")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Compare retrieval backends on query latency (p50/p99) and resident memory.
+
+Usage:
+    python scripts/bench_retrieval.py                 # embed data/faqs.txt with the real model
+    python scripts/bench_retrieval.py --synthetic 5000  # random unit vectors, no model needed
+
+Each backend runs in its own subprocess so RSS numbers are not polluted by the other.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def percentile(values, pct):
+    vals = sorted(values)
+    if not vals:
+        return 0.0
+    k = min(len(vals) - 1, max(0, int(round(pct / 100.0 * (len(vals) - 1)))))
+    return vals[k]
+
+
+def load_corpus(synthetic: int, queries: int):
+    import numpy as np
+
+    if synthetic:
+        rng = np.random.default_rng(0)
+        chunks = [f"chunk {i}" for i in range(synthetic)]
+        emb = rng.standard_normal((synthetic, 384)).astype(np.float32)
+        qs = rng.standard_normal((queries, 384)).astype(np.float32)
+        return chunks, emb, qs
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer("all-MiniLM-L6-v2")
+    text = (ROOT / "data" / "faqs.txt").read_text()
+    chunks = text.split("\n\n")
+    emb = model.encode(chunks, batch_size=64)
+    questions = [ln.strip()[2:].strip() for ln in text.splitlines() if ln.strip().startswith("Q:")]
+    qs = model.encode((questions * (queries // max(1, len(questions)) + 1))[:queries], batch_size=64)
+    return chunks, emb, qs
+
+
+def run_one(backend: str, synthetic: int, queries: int) -> dict:
+    import retrieval
+
+    chunks, emb, qs = load_corpus(synthetic, queries)
+    rss_before = rss_mb()
+    index = retrieval.make_index(backend)
+    t0 = time.perf_counter()
+    index.add(chunks, emb)
+    build_ms = (time.perf_counter() - t0) * 1000
+    for q in qs[:20]:
+        index.query(q, n_results=5)
+    lat = []
+    for q in qs:
+        t = time.perf_counter()
+        index.query(q, n_results=5)
+        lat.append((time.perf_counter() - t) * 1e6)
+    return {
+        "backend": backend,
+        "chunks": len(chunks),
+        "queries": len(qs),
+        "build_ms": round(build_ms, 1),
+        "p50_us": round(percentile(lat, 50), 1),
+        "p99_us": round(percentile(lat, 99), 1),
+        "rss_delta_mb": round(rss_mb() - rss_before, 1),
+        "rss_total_mb": round(rss_mb(), 1),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--backends", default="numpy,chroma")
+    ap.add_argument("--synthetic", type=int, default=0, help="use N random chunks instead of the FAQ file")
+    ap.add_argument("--queries", type=int, default=2000)
+    ap.add_argument("--child", default="", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        print(json.dumps(run_one(args.child, args.synthetic, args.queries)))
+        return
+
+    rows = []
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        cmd = [sys.executable, __file__, "--child", backend, "--synthetic", str(args.synthetic), "--queries", str(args.queries)]
+        out = subprocess.run(cmd, capture_output=True, text=True, env=dict(os.environ))
+        if out.returncode != 0:
+            print(f"{backend}: failed\n{out.stderr.strip()[-2000:]}")
+            continue
+        rows.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print(f"{'backend':<8} {'chunks':>7} {'build_ms':>9} {'p50_us':>8} {'p99_us':>8} {'rss_delta_mb':>13} {'rss_total_mb':>13}")
+    for r in rows:
+        print(f"{r['backend']:<8} {r['chunks']:>7} {r['build_ms']:>9} {r['p50_us']:>8} {r['p99_us']:>8} {r['rss_delta_mb']:>13} {r['rss_total_mb']:>13}")
+
+
+if __name__ == "__main__":
+    main()
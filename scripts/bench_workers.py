@@ -0,0 +1,171 @@
+"""Memory of a multi-worker server: `uvicorn --workers N` vs backend/serve.py (preload + fork).
+
+Usage:
+    python scripts/bench_workers.py                    # 1, 4 and 8 workers, both modes
+    python scripts/bench_workers.py --workers 1,4 --modes preload
+
+For each run the server is started from backend/, waited on until /readyz
+answers 200 and every worker is up, warmed with a few /v1/chat-sync
+requests, and then measured over its whole process tree from
+/proc/<pid>/smaps_rollup:
+
+  rss  resident pages per process, summed (counts shared pages once per process)
+  pss  proportional set size, summed (shared pages split between sharers)
+  uss  private pages, summed (what each extra worker really costs)
+
+rss is what naive per-pod dashboards add up; pss is what the node actually spends.
+Pass EMBED_BACKEND / RAG_BACKEND etc. through the environment.
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+BACKEND_DIR = ROOT / "backend"
+
+WARMUP = [
+    "How do I withdraw money to UPI?",
+    "my reward is pending since 3 days",
+    "gift card code not working",
+    "app keeps crashing",
+]
+
+
+def children_of(pid: int):
+    kids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            kids.append(int(entry))
+    return kids
+
+
+def tree(pid: int):
+    out, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        out.append(p)
+        todo.extend(children_of(p))
+    return out
+
+
+def memory_mb(pid: int):
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1]) / 1024.0
+    except OSError:
+        return 0.0, 0.0, 0.0
+    uss = fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0)
+    return fields.get("Rss", 0.0), fields.get("Pss", 0.0), uss
+
+
+def get(url: str, timeout: float = 2.0):
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def post(url: str, message: str):
+    req = urllib.request.Request(url, data=json.dumps({"message": message}).encode("utf-8"), headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            resp.read()
+    except OSError:
+        pass
+
+
+def run_one(mode: str, workers: int, port: int, timeout: float) -> dict:
+    if mode == "uvicorn":
+        cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    else:
+        cmd = [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)]
+    env = dict(os.environ, RATE_LIMIT_CHAT_SYNC="100000/60")
+    proc = subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    try:
+        ready_streak = 0
+        # Connections land on arbitrary workers, so require a run of 200s before trusting /readyz.
+        while ready_streak < 4 * workers:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{mode} x{workers} exited with {proc.returncode}")
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError(f"{mode} x{workers} not ready after {timeout:.0f}s")
+            ready_streak = ready_streak + 1 if get(f"{base}/readyz") == 200 else 0
+            if not ready_streak:
+                time.sleep(0.2)
+        ready_s = time.perf_counter() - start
+        for _ in range(workers):
+            for m in WARMUP:
+                post(f"{base}/v1/chat-sync", m)
+        time.sleep(1.0)
+        pids = tree(proc.pid)
+        rss = pss = uss = 0.0
+        for pid in pids:
+            r, p, u = memory_mb(pid)
+            rss, pss, uss = rss + r, pss + p, uss + u
+        return {
+            "mode": mode,
+            "workers": workers,
+            "processes": len(pids),
+            "ready_s": round(ready_s, 1),
+            "rss_mb": round(rss, 1),
+            "pss_mb": round(pss, 1),
+            "uss_mb": round(uss, 1),
+        }
+    finally:
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait(timeout=15)
+        except (ProcessLookupError, subprocess.TimeoutExpired):
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            proc.wait()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", default="1,4,8")
+    ap.add_argument("--modes", default="uvicorn,preload")
+    ap.add_argument("--port", type=int, default=18080)
+    ap.add_argument("--timeout", type=float, default=300.0, help="seconds to wait for readiness")
+    args = ap.parse_args()
+
+    rows = []
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        for n in [int(w) for w in args.workers.split(",") if w.strip()]:
+            try:
+                rows.append(run_one(mode, n, args.port, args.timeout))
+            except RuntimeError as e:
+                print(e)
+
+    print(f"{'mode':<8} {'workers':>7} {'procs':>6} {'ready_s':>8} {'rss_mb':>9} {'pss_mb':>9} {'uss_mb':>9}")
+    for r in rows:
+        print(f"{r['mode']:<8} {r['workers']:>7} {r['processes']:>6} {r['ready_s']:>8} {r['rss_mb']:>9} {r['pss_mb']:>9} {r['uss_mb']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""Check the streaming reply filters and the LLM client's close/cancel behaviour.
+
+Usage:
+    python scripts/check_streaming.py              # everything
+    python scripts/check_streaming.py --filters    # only the streaming.py stages (no server needed)
+
+Filters: every scripted reply is fed to streaming.reply_filters one character
+at a time, three at a time and whole; the released text, the stop reason and
+the policy flags must be the same every time, and must equal the expected
+reply. A reply stopped by the policy check may end anywhere before the
+blocked term (text is released as it arrives), so there every chunking must
+release a prefix of the expected text instead. The policy check must also
+start releasing a long reply within its overlap. CtaDetector must give the
+same verdict for the same chunkings.
+
+LLM client: a fake Ollama (a real HTTP server on a free local port, streaming
+one frame every --frame-ms) checks that llm.ask_llm:
+  - returns every frame and reads the done frame into GenerationStats,
+  - coalesces identical concurrent requests into one upstream call,
+  - closes the upstream connection when the consumer stops early or is cancelled,
+  - keeps a shared generation alive until its last subscriber leaves,
+  - reports tokens saved (on_cancel) only when leaving actually stopped the generation,
+  - lets joiners skip the admission queue, and sheds (before any text) when it is full,
+  - moves a queued generation up to a more urgent joiner's priority.
+Exits non-zero if any check fails.
+"""
+import argparse
+import asyncio
+import json
+import socket
+import sys
+import time
+from contextlib import aclosing
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend"))
+
+import guard_rails  # noqa: E402
+import streaming  # noqa: E402
+
+CHUNK_SIZES = (1, 3, 0)  # 0 = the whole reply in one chunk
+
+# (name, reply as the model streams it, expected released text, expected stop reason)
+REPLIES = [
+    ("plain", "Verification takes 48 hours.", "Verification takes 48 hours.", ""),
+    ("echo", "You are a helpful offer-support assistant. Use ONLY the provided context", "", "echo"),
+    ("late echo", "Rewards take 48 hours.\nContext:\nQ: something", "Rewards take 48 hours.", "echo"),
+    ("cut", "Your reward is pending.\nUser question: what else?", "Your reward is pending.", "echo"),
+    ("answer line", "Your reward is pending.\nAnswer: it is", "Your reward is pending.", "cut"),
+    ("pleasantry", "I'm glad you asked. Verification takes 48 hours.", "Verification takes 48 hours.", ""),
+    ("pleasantry first", "Happy to help! Your reward is credited within 48 hours.", "Your reward is credited within 48 hours.", ""),
+    ("pleasantry clause", "Sure, happy to help. Rewards arrive within 48 hours.", "Sure. Rewards arrive within 48 hours.", ""),
+    ("pleasantry in a sentence", "Let me know if the reward is missing after 48 hours.", "Let me know if the reward is missing after 48 hours.", ""),
+    ("pleasantry then budget", "Sure! Happy to help. Rewards arrive in 48 hours.", "Sure! Rewards arrive in 48 hours.", ""),
+    ("pleasantry last", "Verification takes 48 hours. Hope this helps!", "Verification takes 48 hours.", ""),
+    ("channel", "Raise a ticket on our website today.", "raise a ticket from the app today.", ""),
+    ("budget", "One thing. Two things. Three things.", "One thing. Two things.", "budget"),
+    ("bullets", "Steps:\n- a\n- b\n- c\n- d\n- e\n- f\n- g", "Steps:\n- a\n- b\n- c\n- d\n- e", "budget"),
+    ("blocked", "Sure. Share your bank account number here. Then wait.", "Sure. Share your", "policy"),
+    ("budget then blocked", "It is pending. Check your bank account now. More.", "It is pending. Check your", "policy"),
+    ("blocked late", "Verification takes 48 hours after you finish the offer. Never share your bank account.",
+     "Verification takes 48 hours after you finish the offer. Never share your", "policy"),
+    ("number", "It costs 4.5 coins! Really.", "It costs 4.5 coins! Really.", ""),
+]
+
+CTA_REPLIES = [
+    ("near", "If it exceeds 48 hours, contact support.", True),
+    ("far", "Please contact support. " + "Some filler words here. " * 20 + "It usually takes 48 hours.", True),
+    ("none", "Verification takes 48 hours. Keep the app installed.", False),
+]
+
+
+def chunks(text: str, size: int):
+    if not size:
+        return [text]
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def run_filters(text: str, size: int):
+    filters = streaming.reply_filters(guard_rails.scan)
+    out = ""
+    for piece in chunks(text, size):
+        out += filters.feed(piece)
+        if filters.stopped:
+            break
+    out += filters.flush()
+    policy = filters.stages[-1]
+    return out.strip(), filters.stopped_by, (policy.blocked, policy.warning, policy.off_topic)
+
+
+def check_filters() -> int:
+    failures = 0
+    for name, reply, want, want_reason in REPLIES:
+        results = {size: run_filters(reply, size) for size in CHUNK_SIZES}
+        if want_reason == "policy":
+            if len({r[1:] for r in results.values()}) != 1 or not all(want.startswith(r[0]) for r in results.values()):
+                failures += 1
+                print(f"FAIL filters/{name}: want a prefix of {want!r} (policy) for every chunking, got {results}")
+            continue
+        if len(set(results.values())) != 1:
+            failures += 1
+            print(f"FAIL filters/{name}: output depends on chunking: {results}")
+            continue
+        got, reason, _ = results[0]
+        if got != want or reason != want_reason:
+            failures += 1
+            print(f"FAIL filters/{name}: got {got!r} ({reason or 'not stopped'}), want {want!r} ({want_reason or 'not stopped'})")
+    # The policy check holds back only its overlap, not a whole sentence.
+    policy = streaming.PolicyCheck(guard_rails.scan)
+    reply = "Verification usually takes about forty eight hours once the offer steps are complete."
+    held = next((i for i in range(len(reply)) if policy.feed(reply[i])), len(reply))
+    if held > policy.overlap + len("Verification"):
+        failures += 1
+        print(f"FAIL filters/policy release: first text after {held} characters")
+    for name, reply, want in CTA_REPLIES:
+        verdicts = set()
+        for size in CHUNK_SIZES:
+            cta = streaming.CtaDetector()
+            for piece in chunks(reply, size):
+                if cta.feed(piece) != piece:
+                    verdicts.add("altered")
+            verdicts.add(cta.finish())
+        if verdicts != {want}:
+            failures += 1
+            print(f"FAIL cta/{name}: got {verdicts}, want {want}")
+    total = len(REPLIES) + len(CTA_REPLIES) + 1
+    print(f"filters: {total - failures}/{total} ok")
+    return failures
+
+
+class FakeOllama:
+    """Streams `frames` numbered tokens per request and records when each connection ends."""
+
+    def __init__(self, frames: int, frame_s: float):
+        from fastapi import FastAPI, Request
+        from fastapi.responses import StreamingResponse
+
+        self.frames = frames
+        self.frame_s = frame_s
+        self.calls = []
+        self.app = FastAPI()
+
+        @self.app.post("/api/generate")
+        async def generate(request: Request):
+            body = await request.json()
+            call = {"prompt": body["prompt"], "sent": 0, "ended": None}
+            self.calls.append(call)
+
+            async def frames():
+                try:
+                    for i in range(self.frames):
+                        await asyncio.sleep(self.frame_s)
+                        call["sent"] += 1
+                        yield json.dumps({"response": f"t{i} ", "done": False}) + "\n"
+                    yield json.dumps({
+                        "response": "", "done": True, "done_reason": "stop",
+                        "prompt_eval_count": 42, "eval_count": self.frames,
+                        "load_duration": 1_000_000, "prompt_eval_duration": 20_000_000,
+                        "eval_duration": int(self.frames * self.frame_s * 1e9),
+                    }) + "\n"
+                finally:
+                    call["ended"] = time.monotonic()
+
+            return StreamingResponse(frames(), media_type="application/x-ndjson")
+
+    def calls_for(self, prompt: str):
+        return [c for c in self.calls if c["prompt"] == prompt]
+
+
+async def check_llm(frame_ms: float) -> int:
+    import uvicorn
+
+    import llm
+    import scheduler
+
+    fake = FakeOllama(frames=40, frame_s=frame_ms / 1000.0)
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(fake.app, log_level="warning", lifespan="off"))
+    serve_task = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started:
+        await asyncio.sleep(0.01)
+    llm.OLLAMA_URL = "http://127.0.0.1:%d/api/generate" % sock.getsockname()[1]
+    llm.LLM_COALESCE = True
+    llm.llm_scheduler = scheduler.LLMScheduler(concurrency=4)
+    # Long enough for a closed connection to be noticed, short next to the 40-frame stream.
+    settle = max(0.3, 5 * fake.frame_s)
+    full = "".join(f"t{i} " for i in range(fake.frames))
+    failures = 0
+
+    def check(ok: bool, what: str):
+        nonlocal failures
+        if not ok:
+            failures += 1
+            print(f"FAIL llm/{what}")
+
+    async def read(prompt: str, limit: int = 0, **kw):
+        out = []
+        async with aclosing(llm.ask_llm(prompt, **kw)) as stream:
+            async for chunk in stream:
+                out.append(chunk)
+                if limit and len(out) >= limit:
+                    break
+        return "".join(out)
+
+    # Whole stream, with Ollama's accounting from the done frame.
+    stats = llm.GenerationStats()
+    text = await read("full", stats=stats)
+    check(text == full, "full stream text")
+    check(stats.done and stats.completion_tokens == fake.frames and stats.prompt_tokens == 42, "done frame stats")
+
+    # Identical concurrent requests share one upstream call.
+    texts = await asyncio.gather(*[read("coalesce") for _ in range(5)])
+    check(len(fake.calls_for("coalesce")) == 1, "coalesced into one upstream call")
+    check(all(t == full for t in texts), "every coalesced subscriber gets the whole reply")
+
+    # A consumer that stops early closes the upstream connection.
+    saved = []
+    await read("early", limit=3, on_cancel=saved.append)
+    await asyncio.sleep(settle)
+    call = fake.calls_for("early")[0]
+    check(call["ended"] is not None and call["sent"] < fake.frames, "early stop closes upstream")
+    check(len(saved) == 1 and saved[0] > 0, "early stop reports the tokens saved")
+
+    # So does cancelling the consuming task.
+    task = asyncio.create_task(read("cancel"))
+    await asyncio.sleep(5 * fake.frame_s)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    await asyncio.sleep(settle)
+    call = fake.calls_for("cancel")[0]
+    check(call["ended"] is not None and call["sent"] < fake.frames, "cancelled consumer closes upstream")
+
+    # A shared generation keeps going while one subscriber is left, and stops when it leaves too.
+    left, last = [], []
+    stays = asyncio.create_task(read("shared", limit=20, on_cancel=last.append))
+    await read("shared", limit=2, on_cancel=left.append)
+    await asyncio.sleep(settle)
+    call = fake.calls_for("shared")[0]
+    check(call["ended"] is None and not left, "shared generation survives one subscriber leaving, nothing saved")
+    await stays
+    await asyncio.sleep(settle)
+    check(call["ended"] is not None and call["sent"] < fake.frames, "shared generation closes after the last subscriber")
+    check(len(last) == 1, "the last subscriber leaving reports the tokens saved")
+
+    # Joiners bypass the admission queue; a new generation behind a busy slot is shed before any text.
+    llm.llm_scheduler = scheduler.LLMScheduler(concurrency=1, budgets={"HIGH": 0.0, "MEDIUM": 0.0, "LOW": 0.0})
+    first = asyncio.create_task(read("slot"))
+    await asyncio.sleep(3 * fake.frame_s)
+    joiners = [asyncio.create_task(read("slot")) for _ in range(3)]
+    shed = ""
+    try:
+        await read("other")
+    except scheduler.QueueShed as e:
+        shed = e.reason
+    check(bool(shed) and not fake.calls_for("other"), "new generation shed while the only slot is busy")
+    joined = await asyncio.gather(first, *joiners)
+    check(all(t == full for t in joined), "joiners skip the queue")
+    check(len(fake.calls_for("slot")) == 1, "joiners share the upstream call")
+    check(llm.llm_scheduler.active == 0, "slots released")
+
+    # A HIGH joiner lifts a queued LOW generation ahead of a queued MEDIUM one.
+    llm.llm_scheduler = scheduler.LLMScheduler(concurrency=1)
+    first = asyncio.create_task(read("busy"))
+    await asyncio.sleep(3 * fake.frame_s)
+    low = asyncio.create_task(read("low", priority_level="LOW"))
+    await asyncio.sleep(0)
+    mid = asyncio.create_task(read("mid", priority_level="MEDIUM"))
+    await asyncio.sleep(0)
+    high = asyncio.create_task(read("low", priority_level="HIGH"))
+    await asyncio.gather(first, low, mid, high)
+    order = [c["prompt"] for c in fake.calls if c["prompt"] in ("low", "mid")]
+    check(order == ["low", "mid"], f"joiner promotes the queued generation (upstream order {order})")
+
+    server.should_exit = True
+    await serve_task
+    await llm.close_client()
+    total = 14
+    print(f"llm: {total - failures}/{total} ok")
+    return failures
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--filters", action="store_true", help="only check the streaming.py stages")
+    ap.add_argument("--frame-ms", type=float, default=20.0, help="fake Ollama delay per frame")
+    args = ap.parse_args()
+
+    failures = check_filters()
+    if not args.filters:
+        failures += asyncio.run(check_llm(args.frame_ms))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""Check the compiled topic classifier against the golden corpus.
+
+Usage:
+    python scripts/check_topics.py                  # verify data/topics_golden.jsonl
+    python scripts/check_topics.py --write-golden   # regenerate it from the reference cascade
+    python scripts/check_topics.py --fuzz 50000     # also compare on random keyword mixes
+    python scripts/check_topics.py --centroids      # leave-one-out routing accuracy on data/topic_examples.jsonl
+
+The reference is the substring cascade detect_topic / classify_offer_intent /
+determine_priority used before data/topics.json existed. An edit to the table
+that changes any golden answer shows up here as a diff; if the change is
+intended, regenerate the corpus from the new table with --write-golden --from-table.
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend"))
+
+import topics  # noqa: E402
+
+GOLDEN_PATH = ROOT / "data" / "topics_golden.jsonl"
+
+
+def legacy_topic(user_msg: str) -> str:
+    s = (user_msg or "").lower()
+    if any(k in s for k in ["gift card", "giftcard", "xoxoday", "redemption", "redeemed", "merchant", "redeem a gift"]):
+        return "gift_card"
+    if any(k in s for k in ["referral", "refer", "invite", "referral code", "bonus", "friend"]):
+        return "referral"
+    payout_keys = [
+        "upi", "bank", "withdraw", "withdrawal", "payout", "transfer", "money not transferred", "redeem coins",
+        "payout processing", "processing payout", "payout failed", "failed payout", "transfer failed", "payment pending"
+    ]
+    if any(k in s for k in payout_keys):
+        return "payout"
+    if any(k in s for k in ["crash", "crashed", "crashing", "crach", "not loading", "freeze", "freezing", "stuck", "glitch",
+                            "keeps closing", "closing automatically", "update the app", "update app"]):
+        return "app_issue"
+    if any(k in s for k in ["survey", "survey options"]):
+        return "survey"
+    if any(k in s for k in ["suspicious environment", "developer option", "developer options", "developer mode", "clone app", "cloned app"]):
+        return "device_integrity"
+    if any(k in s for k in ["account hold", "on hold", "blocked", "vpn", "policy violation", "proxy"]):
+        return "account_hold"
+    if any(k in s for k in ["customer care", "support number", "phone number", "timing", "timings", "contact support", "reach support", "raise a ticket", "support ticket"]):
+        return "support_contact"
+    if any(k in s for k in ["refund", "in-app purchase", "transaction"]):
+        return "refund"
+    if any(k in s for k in ["expired", "ongoing", "completed", "offer status", "offer is", "progress", "started", "start time", "expires", "expiry"]):
+        return "offer_status"
+    if any(k in s for k in ["under verification", "pending", "verification", "reward not", "reward not credited", "reward not received",
+                            "not credited", "not received", "not get", "did not get", "didn't get", "not getting", "points not credited",
+                            "coins not credited", "reward pending", "rewards pending"]):
+        return "offer_reward_crediting"
+    if re.search(r"\b(\d+)\s*(hours?|hrs?|days?)\b", s) and any(k in s for k in ["already", "more than", "over", "exceed", "exceeded", "since"]):
+        return "offer_reward_crediting"
+    return "unknown"
+
+
+def legacy_intent(user_msg: str) -> str:
+    s = (user_msg or "").lower()
+    if legacy_topic(s) in {"offer_status", "offer_reward_crediting"}:
+        if any(w in s for w in ["status", "ongoing", "completed", "expired", "active", "inactive", "progress", "started", "start time", "expires", "expiry"]):
+            return "status"
+        return "reward"
+    if legacy_topic(s) in {"support_contact", "ticket"}:
+        return "ticket"
+    return "unknown"
+
+
+def legacy_priority(user_message: str) -> str:
+    message = user_message.lower()
+    for word in ["payment", "money", "charged", "deducted", "failed transaction"]:
+        if word in message:
+            return "HIGH"
+    for word in ["login", "error", "crash", "not working", "issue", "bug", "refund"]:
+        if word in message:
+            return "MEDIUM"
+    return "LOW"
+
+
+def legacy(text: str):
+    return legacy_topic(text), legacy_intent(text), legacy_priority(text)
+
+
+def compiled(text: str):
+    c = topics.classify(text)
+    return c.topic, c.intent, c.priority
+
+
+def table_keywords(spec):
+    for section in ("topics", "intents", "priorities"):
+        for rule in spec.get(section, []):
+            yield from rule.get("any", [])
+
+
+def build_corpus(spec, seed: int = 7):
+    """FAQ questions, every keyword alone and in a sentence, keyword pairs, and the time-claim rule."""
+    rng = random.Random(seed)
+    faq = (ROOT / "data" / "faqs.txt").read_text()
+    corpus = [ln.strip()[2:].strip() for ln in faq.splitlines() if ln.strip().startswith("Q:")]
+    keywords = sorted(set(table_keywords(spec)))
+    for kw in keywords:
+        corpus += [kw, kw.upper(), f"my {kw} issue since yesterday", f"Hi, {kw.title()}?"]
+    for _ in range(600):
+        a, b = rng.sample(keywords, 2)
+        corpus.append(f"{a} and then {b}")
+    corpus += [
+        "It has been 3 days already and nothing",
+        "waited more than 72 hours",
+        "72hrs over, still nothing",
+        "since 2 days",
+        "5 days",
+        "it has been over a week",
+        "12hours already",
+        "I completed the offer 3 days ago but my reward is not credited yet",
+        "hello",
+        "thanks",
+        "",
+        "İnvite code not working",
+        "gift  card double space",
+        "payment failed but money deducted",
+    ]
+    seen, out = set(), []
+    for text in corpus:
+        if text not in seen:
+            seen.add(text)
+            out.append(text)
+    return out
+
+
+def eval_centroids():
+    """Leave-one-out: route each labelled example with centroids fit on the others, vs the keyword table."""
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+    from message import rewrite_synonyms
+
+    examples = topics.read_examples()
+    model = SentenceTransformer("all-MiniLM-L6-v2")
+    emb = model.encode([rewrite_synonyms(t.lower()) for t, _ in examples], show_progress_bar=False)
+    labels = [label for _, label in examples]
+    routed = correct = keyword_correct = 0
+    for i, (text, label) in enumerate(examples):
+        clf = topics.CentroidClassifier()
+        keep = [j for j in range(len(examples)) if j != i]
+        clf.fit([labels[j] for j in keep], np.asarray(emb)[keep])
+        predicted = clf.predict(emb[i])
+        keyword = topics.classifier.table.classify(text.lower()).topic
+        keyword_correct += keyword == label
+        final = predicted[0] if predicted else keyword
+        routed += predicted is not None
+        correct += final == label
+        if final != label:
+            print(f"MISS {text!r}: want {label}, centroid {predicted}, keywords {keyword}")
+    n = len(examples)
+    print(f"keywords only: {keyword_correct}/{n}  centroid+fallback: {correct}/{n}  (centroid decided {routed}/{n})")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--write-golden", action="store_true")
+    ap.add_argument("--from-table", action="store_true", help="with --write-golden: take answers from the compiled table")
+    ap.add_argument("--fuzz", type=int, default=0)
+    ap.add_argument("--centroids", action="store_true")
+    args = ap.parse_args()
+    if args.centroids:
+        eval_centroids()
+        return
+    spec = json.loads(Path(topics.TOPIC_TABLE_PATH).read_text())
+
+    if args.write_golden:
+        answer = compiled if args.from_table else legacy
+        with open(GOLDEN_PATH, "w") as f:
+            for text in build_corpus(spec):
+                t, i, p = answer(text)
+                f.write(json.dumps({"text": text, "topic": t, "intent": i, "priority": p}, ensure_ascii=False) + "\n")
+        print(f"wrote {GOLDEN_PATH}")
+        return
+
+    failures = 0
+    rows = [json.loads(ln) for ln in GOLDEN_PATH.read_text().splitlines() if ln.strip()]
+    for row in rows:
+        got = compiled(row["text"])
+        want = (row["topic"], row["intent"], row["priority"])
+        if got != want:
+            failures += 1
+            print(f"MISMATCH {row['text']!r}: want {want}, got {got}")
+    print(f"golden: {len(rows) - failures}/{len(rows)} match")
+
+    if args.fuzz:
+        rng = random.Random(1)
+        keywords = sorted(set(table_keywords(spec))) + ["3 days", "48 hrs", "the", "my", "offer", "app", "İ", "  "]
+        mism = 0
+        for _ in range(args.fuzz):
+            text = " ".join(rng.choice(keywords) for _ in range(rng.randint(1, 5)))
+            if legacy(text) != compiled(text):
+                mism += 1
+                if mism <= 10:
+                    print(f"FUZZ MISMATCH {text!r}: legacy {legacy(text)}, compiled {compiled(text)}")
+        print(f"fuzz: {args.fuzz - mism}/{args.fuzz} match")
+        failures += mism
+
+    msgs = [r["text"] for r in rows]
+    for name, fn in (("substring cascade", legacy), ("compiled table", compiled)):
+        start = time.perf_counter()
+        for _ in range(20):
+            for m in msgs:
+                fn((m + " ")[:-1])
+        print(f"{name:<18} {(time.perf_counter() - start) / (20 * len(msgs)) * 1e6:7.1f} us/message")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""CPU time of the text-processing stages process_chat runs before retrieval.
+
+Usage:
+    python scripts/profile_chat.py [--rounds 200] [--cprofile]
+
+"per-stage str" passes the raw message to every stage, so each one lowercases,
+splits and tokenizes it again (what process_chat did before NormalizedMessage).
+"shared message" builds one message.NormalizedMessage per request and hands it
+to every stage. Both sides must agree on every stage result. The embedding and
+LLM calls are left out; they are the same on both sides.
+"""
+import argparse
+import cProfile
+import pstats
+import re
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "backend"))
+
+import guard_rails  # noqa: E402
+import offer_context  # noqa: E402
+import priority  # noqa: E402
+from message import SYNONYMS, NormalizedMessage  # noqa: E402
+
+OFFER_CONTEXT = {
+    "offer": {
+        "oid": "demo-1",
+        "title": "Play Level 10",
+        "tags": ["MULTI_REWARD"],
+        "status": {"user_status": "ONGOING", "offer_status": "ACTIVE", "progress": 0.4, "started_at": int(time.time()) - 50 * 3600},
+    },
+    "postback_reward": [{"reward_id": 1, "label": "Install", "status": "COMPLETED"}, {"reward_id": 2, "label": "Level 10", "status": "PENDING"}],
+}
+SUMMARY = offer_context.summarize_offer_context(OFFER_CONTEXT)
+
+VERBS = {"connect", "escalate", "talk", "speak", "transfer", "reach", "contact", "open", "create", "submit", "file", "raise"}
+TARGETS = {"human", "support", "customer", "care", "agent", "representative", "associate", "executive", "person", "service", "team"}
+
+
+def legacy_escalation(user_msg: str) -> bool:
+    norm = re.sub(r"\s+", " ", user_msg or "").strip().lower()
+    tokens = re.findall(r"[a-z]+", norm)
+    has_verb = any(t in VERBS for t in tokens) or any(any(v in t for v in VERBS) for t in tokens)
+    has_target = any(t in TARGETS for t in tokens) or any(any(trg in t for trg in TARGETS) for t in tokens)
+    ticket = ("ticket" in tokens or "request" in tokens) and any(t in {"open", "create", "submit", "file", "raise"} for t in tokens)
+    return (has_verb and has_target) or ticket
+
+
+def shared_escalation(msg: NormalizedMessage) -> bool:
+    tokens = msg.token_set
+    has_verb = not tokens.isdisjoint(VERBS) or any(any(v in t for v in VERBS) for t in tokens)
+    has_target = not tokens.isdisjoint(TARGETS) or any(any(trg in t for trg in TARGETS) for t in tokens)
+    ticket = ("ticket" in tokens or "request" in tokens) and not tokens.isdisjoint({"open", "create", "submit", "file", "raise"})
+    return (has_verb and has_target) or ticket
+
+
+def legacy_rewrite(query: str) -> str:
+    norm = query.lower()
+    for k, v in SYNONYMS.items():
+        norm = norm.replace(k, v)
+    return norm
+
+
+def legacy_request(user_msg: str):
+    return (
+        guard_rails.input_validator.validate_input(user_msg)["valid"],
+        guard_rails.content_filter.contains_blocked_content(user_msg),
+        guard_rails.domain_guard.is_out_of_scope(user_msg),
+        user_msg.strip().lower() in {"hi", "hello", "hey", "yo"},
+        legacy_escalation(user_msg),
+        offer_context.detect_topic(user_msg),
+        offer_context.offer_aware_response(SUMMARY, user_msg),
+        priority.determine_priority(user_msg),
+        legacy_rewrite(user_msg.strip()),
+    )
+
+
+def shared_request(user_msg: str):
+    msg = NormalizedMessage(user_msg)
+    return (
+        guard_rails.input_validator.validate_input(msg)["valid"],
+        guard_rails.content_filter.contains_blocked_content(msg),
+        guard_rails.domain_guard.is_out_of_scope(msg),
+        msg.lower.strip() in {"hi", "hello", "hey", "yo"},
+        shared_escalation(msg),
+        offer_context.detect_topic(msg),
+        offer_context.offer_aware_response(SUMMARY, msg),
+        priority.determine_priority(msg),
+        msg.rewritten.strip(),
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=200)
+    ap.add_argument("--cprofile", action="store_true", help="print the top functions of each side")
+    args = ap.parse_args()
+
+    text = (ROOT / "data" / "faqs.txt").read_text()
+    msgs = [ln.strip()[2:].strip() for ln in text.splitlines() if ln.strip().startswith("Q:")]
+    msgs += [
+        "I completed the offer 3 days ago but my reward is not credited yet",
+        "please connect me to a human support agent",
+        "did not get my money after payout, upi   cashout failed",
+    ]
+    for m in msgs:
+        assert legacy_request(m) == shared_request(m), m
+
+    for name, fn in (("per-stage str", legacy_request), ("shared message", shared_request)):
+        profiler = cProfile.Profile() if args.cprofile else None
+        if profiler:
+            profiler.enable()
+        start = time.process_time()
+        for _ in range(args.rounds):
+            for m in msgs:
+                # Fresh string objects so the guard matcher's last-text memo does not flatter either side.
+                fn((m + " ")[:-1])
+        per_msg = (time.process_time() - start) / (args.rounds * len(msgs)) * 1e6
+        if profiler:
+            profiler.disable()
+        print(f"{name:<16} {per_msg:8.1f} us CPU/request  ({len(msgs)} messages x {args.rounds} rounds)")
+        if profiler:
+            pstats.Stats(profiler).sort_stats("tottime").print_stats(8)
+
+
+if __name__ == "__main__":
+    main()